@@ -0,0 +1,263 @@
+from array import array
+import astclasses
+import holyparser
+import lexer
+from astclasses import ASTNode, Program
+
+# An ASTArena keeps a whole tree in five parallel arrays, one row per node:
+#
+#   kinds          the node class, as an index into ROW_CLASSES
+#   first_children row of the first child, or -1
+#   next_siblings  row of the next child of the same parent, or -1
+#   payloads       index into `values`, a table of interned tuples
+#   offsets        source offset of the node, or -1 when it has none
+#
+# Rows are numbered in preorder, so the rows of a subtree are contiguous and
+# every child comes after its parent. A payload holds one entry per field of
+# the node class: the value itself for scalars, or CHILD when the field is
+# stored as the next child row. Lists and tuples in fields get a row of their
+# own whose children are the elements; a scalar element gets a VALUE row.
+
+#######################################
+# CONSTANTS
+#######################################
+
+NODE_CLASSES = [obj for obj in vars(astclasses).values()
+                if isinstance(obj, type) and issubclass(obj, ASTNode) and obj is not ASTNode]
+NODE_KINDS = {cls: kind for kind, cls in enumerate(NODE_CLASSES)}
+LIST_KIND = len(NODE_CLASSES)
+TUPLE_KIND = LIST_KIND + 1
+VALUE_KIND = LIST_KIND + 2
+ROW_CLASSES = NODE_CLASSES + [list, tuple, None]
+
+# Marks a payload entry whose field is stored as a child row. No field of a
+# node ever holds Ellipsis, and it survives pickling as the same object.
+CHILD = ...
+
+#######################################
+# ARENA
+#######################################
+
+
+class ASTArena:
+    def __init__(self, fn='<arena>', root=None):
+        self.fn = fn
+        self.kinds = array('B')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.payloads = array('I')
+        self.offsets = array('i')
+        self.values = []
+        self.value_index = {}
+        # Rows of the root, normally a Program, its statement list and its last statement
+        self.root = self.append(Program([]) if root is None else root)
+        self.statement_list = self.first_children[self.root] if root is None else -1
+        self.last_statement = -1
+
+    @classmethod
+    def from_program(cls, program, fn='<arena>'):
+        """Build an arena from a Program, or from any other node the Lark transformer returned."""
+        if isinstance(program, Program):
+            return cls.from_statements(program.statements, fn)
+        return cls(fn, program)
+
+    @classmethod
+    def from_statements(cls, statements, fn='<arena>'):
+        """Build an arena from an iterable of top-level statements, holding only one at a time."""
+        arena = cls(fn)
+        for statement in statements:
+            arena.add_statement(statement)
+        return arena
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, payload):
+        try:
+            value_id = self.value_index.get(payload)
+        except TypeError:
+            # Lark Trees left in a field are not hashable
+            self.values.append(payload)
+            return len(self.values) - 1
+        if value_id is None:
+            value_id = self.value_index[payload] = len(self.values)
+            self.values.append(payload)
+        return value_id
+
+    def add_statement(self, statement):
+        self.last_statement = self.append(statement, self.statement_list, self.last_statement)
+        return self.last_statement
+
+    def append(self, item, parent=-1, previous=-1):
+        """Add the tree under `item` as the child of `parent` after row `previous`, returning its row."""
+        kinds, first_children, next_siblings = self.kinds, self.first_children, self.next_siblings
+        payloads, offsets, intern = self.payloads, self.offsets, self.intern
+        root = len(kinds)
+        # The last child row added to each parent so far
+        last = {parent: previous}
+        stack = [(item, parent)]
+        while stack:
+            item, parent = stack.pop()
+            row = len(kinds)
+            children = []
+            if isinstance(item, ASTNode):
+                payload = []
+                for field in item._fields:
+                    value = getattr(item, field, None)
+                    if isinstance(value, (ASTNode, list, tuple)):
+                        payload.append(CHILD)
+                        children.append(value)
+                    else:
+                        payload.append(value)
+                kinds.append(NODE_KINDS[type(item)])
+                payloads.append(intern(tuple(payload)))
+                offset = item.offset
+                offsets.append(-1 if offset is None else offset)
+            else:
+                if isinstance(item, list):
+                    kinds.append(LIST_KIND)
+                    children = item
+                    payloads.append(0)
+                elif isinstance(item, tuple):
+                    kinds.append(TUPLE_KIND)
+                    children = item
+                    payloads.append(0)
+                else:
+                    kinds.append(VALUE_KIND)
+                    payloads.append(intern((item,)))
+                offsets.append(-1)
+            first_children.append(-1)
+            next_siblings.append(-1)
+            if parent >= 0:
+                if last.get(parent, -1) < 0:
+                    first_children[parent] = row
+                else:
+                    next_siblings[last[parent]] = row
+                last[parent] = row
+            stack.extend((child, row) for child in reversed(children))
+        return root
+
+    #######################################
+    # ROWS
+    #######################################
+
+    def node_class(self, row):
+        """The astclasses class of `row`; list or tuple for sequences, None for a scalar."""
+        return ROW_CLASSES[self.kinds[row]]
+
+    def children(self, row):
+        child = self.first_children[row]
+        while child >= 0:
+            yield child
+            child = self.next_siblings[child]
+
+    def fields(self, row):
+        """(field, value) pairs of a node row, where a child field's value is its row."""
+        children = self.children(row)
+        for field, value in zip(NODE_CLASSES[self.kinds[row]]._fields, self.values[self.payloads[row]]):
+            yield field, next(children) if value is CHILD else value
+
+    def subtree_end(self, row):
+        """The row after the last row of the subtree under `row`."""
+        if self.next_siblings[row] >= 0:
+            return self.next_siblings[row]
+        # Otherwise the subtree ends with its last descendant
+        while self.first_children[row] >= 0:
+            row = self.first_children[row]
+            while self.next_siblings[row] >= 0:
+                row = self.next_siblings[row]
+        return row + 1
+
+    def statement_rows(self):
+        return self.children(self.statement_list)
+
+    #######################################
+    # CONVERSION
+    #######################################
+
+    def build(self, row):
+        """Rebuild the astclasses tree under `row`."""
+        kinds, first_children, next_siblings = self.kinds, self.first_children, self.next_siblings
+        payloads, offsets, values = self.payloads, self.offsets, self.values
+        end = self.subtree_end(row)
+        built = [None] * (end - row)
+        # Children come after their parent, so walking backwards builds them first
+        for current in range(end - 1, row - 1, -1):
+            kind = kinds[current]
+            children = []
+            child = first_children[current]
+            while child >= 0:
+                children.append(built[child - row])
+                child = next_siblings[child]
+            if kind == LIST_KIND:
+                item = children
+            elif kind == TUPLE_KIND:
+                item = tuple(children)
+            elif kind == VALUE_KIND:
+                item = values[payloads[current]][0]
+            else:
+                cls = NODE_CLASSES[kind]
+                item = cls.__new__(cls)
+                children = iter(children)
+                for field, value in zip(cls._fields, values[payloads[current]]):
+                    setattr(item, field, next(children) if value is CHILD else value)
+                if offsets[current] >= 0:
+                    item.offset = offsets[current]
+            built[current - row] = item
+            # A child is only needed until its parent is built
+            child = first_children[current]
+            while child >= 0:
+                built[child - row] = None
+                child = next_siblings[child]
+        return built[0]
+
+    def to_program(self):
+        """Rebuild the whole astclasses.Program."""
+        return self.build(self.root)
+
+    def program(self):
+        """A Program whose statements are rebuilt one at a time as they are iterated.
+
+        Passes that visit the statements in order, like SemanticAnalyzer and
+        WATGenerator, then only hold one statement's objects at a time. Each
+        iteration builds new nodes, so what a pass records on them, such as
+        node.type and node.binding, is gone by the next one: a statement has
+        to go through every pass before the next is built, as in parallel.py.
+        """
+        return Program(ArenaStatements(self))
+
+
+class ArenaStatements:
+    """Read-only sequence of the top-level statements of an ASTArena."""
+
+    def __init__(self, arena):
+        self.arena = arena
+        self.rows = array('i', arena.statement_rows())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.arena.build(row) for row in self.rows[idx]]
+        return self.arena.build(self.rows[idx])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.arena.build(row)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def run(fn, tokens, lines=None, report=None):
+    """Parse tokens straight into an ASTArena, returning (arena, error).
+
+    Each top-level statement is added to the arena as soon as it is parsed,
+    so the object tree of the whole program is never built. `report` is
+    passed on to holyparser.Parser.
+    """
+    try:
+        return ASTArena.from_statements(holyparser.Parser(fn, tokens, lines, report).iter_statements(), fn), None
+    except (holyparser.ParseError, lexer.LexError) as e:
+        return None, e.error
@@ -1,23 +1,129 @@
 from typing import Union, List
 import sys
+import functools
 from dataclasses import dataclass
-from lark import Lark, ast_utils, Transformer, v_args, Tree
-from lark.tree import Meta, Tree
+
+# Trees can be far deeper than Python's recursion limit (a + b + c + ... with
+# thousands of terms is a left-deep chain), so repr() and pretty_print() walk
+# them with explicit stacks.
+
+def node_repr(root):
+    """repr() of an AST node, built without recursing into its children."""
+    # Frames of (item, children still to show, reprs of the children shown so far)
+    stack = [(root, iter(repr_children(root)), [])]
+    while True:
+        item, children, parts = stack[-1]
+        for child in children:
+            if isinstance(child, ASTNode) or type(child) in (list, tuple):
+                stack.append((child, iter(repr_children(child)), []))
+                break
+            parts.append(repr(child))
+        else:
+            stack.pop()
+            if type(item) is list:
+                text = '[' + ', '.join(parts) + ']'
+            elif type(item) is tuple:
+                text = '(' + parts[0] + ',)' if len(parts) == 1 else '(' + ', '.join(parts) + ')'
+            else:
+                names = [k for k in item._fields if hasattr(item, k)]
+                text = f"{type(item).__name__}({', '.join(f'{k}={part}' for k, part in zip(names, parts))})"
+            if not stack:
+                return text
+            stack[-1][2].append(text)
+
+def repr_children(item):
+    if isinstance(item, ASTNode):
+        return [getattr(item, k) for k in item._fields if hasattr(item, k)]
+    return item
+
+class PrettyPrinter:
+    """Runs the pretty_print methods of a tree without recursing into children.
+
+    ASTNodeMeta wraps every pretty_print, so a call on a child while a printer
+    is active does not run the child's method. A first pass runs each method
+    with '' for its children to find the (child, indent) calls it makes; a
+    second pass runs them again from the leaves up, with every child's text
+    ready.
+    """
+    active = None
+
+    def __init__(self):
+        self.requests = None
+        self.texts = {}
+
+    def child(self, node, indent):
+        if self.requests is not None:
+            self.requests.append((node, indent))
+            return ''
+        return self.texts[id(node), indent]
+
+    def run(self, root, indent):
+        PrettyPrinter.active = self
+        try:
+            order = []
+            stack = [(root, indent)]
+            while stack:
+                node, node_indent = stack.pop()
+                self.requests = []
+                type(node).pretty_print.__wrapped__(node, node_indent)
+                order.append((node, node_indent, self.requests))
+                stack.extend(reversed(self.requests))
+            # Children were found after their parents, so they are printed first
+            texts = self.texts
+            self.requests = None
+            for node, node_indent, children in reversed(order):
+                texts[id(node), node_indent] = type(node).pretty_print.__wrapped__(node, node_indent)
+                # A child's text is only needed by its parent
+                for child, child_indent in children:
+                    texts.pop((id(child), child_indent), None)
+            return texts[id(root), indent]
+        finally:
+            PrettyPrinter.active = None
+
+def printed(method):
+    @functools.wraps(method)
+    def pretty_print(self, indent=0):
+        printer = PrettyPrinter.active
+        if printer is None:
+            return PrettyPrinter().run(self, indent)
+        return printer.child(self, indent)
+    return pretty_print
+
+# Slots that annotate a node rather than hold its fields: the source offset set
+# by the parser, the symbols.Binding the analyzer resolves an Identifier to and
+# the type it computes for an expression. They default to None and are left
+# out of _fields, repr() and the arena.
+ANNOTATIONS = ('offset', 'binding', 'type')
 
 class ASTNodeMeta(type):
     def __new__(mcs, name, bases, dct):
+        # Every node declares its fields in __slots__, so instances carry no __dict__.
+        # _fields lists them in declaration order, inherited ones first.
+        dct.setdefault('__slots__', ())
+        inherited = tuple(field for base in bases for field in getattr(base, '_fields', ()))
+        dct['_fields'] = inherited + tuple(field for field in dct['__slots__'] if field not in ANNOTATIONS)
         if name != 'ASTNode':
-            def repr_func(self):
-                attrs = ', '.join(f'{k}={repr(v)}' for k, v in vars(self).items() if not k.startswith('__'))
-                return f"{name}({attrs})"
-            dct['__repr__'] = repr_func
+            dct['__repr__'] = node_repr
+        if 'pretty_print' in dct:
+            dct['pretty_print'] = printed(dct['pretty_print'])
         return super().__new__(mcs, name, bases, dct)
 
 class ASTNode(metaclass=ASTNodeMeta):
+    # Source offset of the node's first token, set by the parser when known.
+    # lexer.LineIndex turns it into a line and column.
+    __slots__ = ('offset',)
+
+    def __getattr__(self, name):
+        # Only reached while a slot is unset; annotations default to None
+        if name in ANNOTATIONS:
+            return None
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
     def pretty_print(self, indent=0):
         raise NotImplementedError("Subclasses should implement pretty_print")
     
 class MemberAccessExpression(ASTNode):
+    __slots__ = ('object_expr', 'operation', 'index', 'type')
     def __init__(self, object_expr, operation=None, index=None):
         self.object_expr = object_expr  # The object being accessed (e.g., array, list, tuple)
         self.operation = operation      # The operation (e.g., 'head', 'tail') or attribute being accessed
@@ -40,6 +146,7 @@ class MemberAccessExpression(ASTNode):
 
 
 class IntegerLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value):
         self.value = value
 
@@ -50,6 +157,7 @@ class IntegerLiteral(ASTNode):
         return f'IntegerLiteral({repr(self.value)})'
 
 class Identifier(ASTNode):
+    __slots__ = ('name',)
     def __init__(self, name):
         self.name = name
 
@@ -60,6 +168,7 @@ class Identifier(ASTNode):
         return f'Identifier({repr(self.name)})'
     
 class StringLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value):
         self.value = value
 
@@ -70,6 +179,7 @@ class StringLiteral(ASTNode):
         return f'StringLiteral({repr(self.value)})'
 # Literal nodes
 class VariableDeclaration(ASTNode):
+    __slots__ = ('declaration_specifier', 'assignment_expression')
     def __init__(self, declaration_specifier, assignment_expression):
         self.declaration_specifier = declaration_specifier
         self.assignment_expression = assignment_expression
@@ -97,6 +207,7 @@ class VariableDeclaration(ASTNode):
 
 
 class IntLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value: int):
         self.value = value
 
@@ -107,6 +218,7 @@ class IntLiteral(ASTNode):
         return f"{indent_str}IntLiteral: {self.value}"
 
 class FloatLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value: float):
         self.value = value
     def pretty_print(self, indent=0):
@@ -115,6 +227,7 @@ class FloatLiteral(ASTNode):
         return f"FloatLiteral({self.value})"
 
 class BoolLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value: bool):
         self.value = value
 
@@ -124,6 +237,7 @@ class BoolLiteral(ASTNode):
         return ' ' * indent + f"BoolLiteral: {self.value}"
 
 class StringLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value: str):
         self.value = value
     def pretty_print(self, indent=0):
@@ -132,6 +246,8 @@ class StringLiteral(ASTNode):
         return f"StringLiteral('{self.value}')"
 
 class Identifier(ASTNode):
+    # binding is set by SemanticAnalyzer to the declaration the name resolves to
+    __slots__ = ('value', 'binding', 'type')
     def __init__(self, value: str):
         self.value = value
 
@@ -142,6 +258,7 @@ class Identifier(ASTNode):
         return f"{indent_str}Identifier: {self.value}"
 
 class Operator(ASTNode):
+    __slots__ = ('value',)
     def __init__(self, value: str):
         self.value = value
     def pretty_print(self, indent=0):
@@ -150,6 +267,7 @@ class Operator(ASTNode):
         return f"Operator('{self.value}')"
 
 class Symbol(ASTNode):
+    __slots__ = ('value',)
     def __init__(self, value: str):
         self.value = value
     def pretty_print(self, indent=0):
@@ -158,6 +276,7 @@ class Symbol(ASTNode):
         return f"Symbol('{self.value}')"
     
 class Keyword(ASTNode):
+    __slots__ = ('value',)
     def __init__(self, value: str):
         self.value = value
     def pretty_print(self, indent=0):
@@ -166,6 +285,7 @@ class Keyword(ASTNode):
         return f"Keyword('{self.value}')"
 
 class EndOfStatement(ASTNode):
+    __slots__ = ('value',)
     def __init__(self, value: str):
         self.value = value
     def pretty_print(self, indent=0):
@@ -176,6 +296,7 @@ class EndOfStatement(ASTNode):
 
 
 class ListLiteral(ASTNode):
+    __slots__ = ('elements',)
     def __init__(self, elements: List[ASTNode]):
         self.elements = elements
     def pretty_print(self, indent=0):
@@ -187,6 +308,7 @@ class ListLiteral(ASTNode):
         return f"ListLiteral([{elements_str}])"
 
 class TupleLiteral(ASTNode):
+    __slots__ = ('elements',)
     def __init__(self, elements: List[ASTNode]):
         self.elements = elements
     def pretty_print(self, indent=0):
@@ -199,6 +321,8 @@ class TupleLiteral(ASTNode):
 
 # Expressions
 class FunctionCall(ASTNode):
+    # binding is set by SemanticAnalyzer to the function's declaration
+    __slots__ = ('name', 'arguments', 'binding', 'type')
     def __init__(self, name: str, arguments: List[ASTNode]):
         self.name = name
         self.arguments = arguments
@@ -211,15 +335,17 @@ class FunctionCall(ASTNode):
         return f"FunctionCall('{self.name}', [{arguments_str}])"
 
 class Expression(ASTNode):
-    pass
+    __slots__ = ()
 
 class Literal(Expression):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
     def pretty_print(self, indent=0):
         return ' ' * indent + f"{self.__class__.__name__}: {self.value}"
 
 class UnaryExpression(ASTNode):
+    __slots__ = ('operator', 'operand', 'type')
     def __init__(self, operator: Operator, operand: ASTNode):
         self.operator = operator
         self.operand = operand
@@ -231,6 +357,7 @@ class UnaryExpression(ASTNode):
     def __repr__(self):
         return f"UnaryExpression({repr(self.operator)}, {repr(self.operand)})"
 class BeliefKeyword(ASTNode):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -241,6 +368,7 @@ class BeliefKeyword(ASTNode):
         return 'BeliefKeyword()'
 
 class LeftParen(ASTNode):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -251,6 +379,7 @@ class LeftParen(ASTNode):
         return 'LeftParen()'
 
 class GreaterThan(ASTNode):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -261,6 +390,7 @@ class GreaterThan(ASTNode):
         return 'GreaterThan()'
 
 class LeftBrace(ASTNode):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -271,6 +401,7 @@ class LeftBrace(ASTNode):
         return 'LeftBrace()'
     
 class UtilityFunctionCall(ASTNode):
+    __slots__ = ('function_name', 'expression')
     def __init__(self, function_name, expression):
         self.function_name = function_name
         self.expression = expression
@@ -285,6 +416,7 @@ class UtilityFunctionCall(ASTNode):
 
 
 class RightBrace(ASTNode):
+    __slots__ = ()
     def __init__(self):
         pass
 
@@ -295,6 +427,7 @@ class RightBrace(ASTNode):
         return 'RightBrace()'
 
 class BinaryExpression(ASTNode):
+    __slots__ = ('left', 'operator', 'right', 'type')
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -311,6 +444,7 @@ class BinaryExpression(ASTNode):
 
 
 class ArrayIndexing(ASTNode):
+    __slots__ = ('array', 'index')
     def __init__(self, array: ASTNode, index: ASTNode):
         self.array = array
         self.index = index
@@ -325,6 +459,7 @@ class ArrayIndexing(ASTNode):
 
 # Statements
 class CompoundStatement(ASTNode):
+    __slots__ = ('declarations', 'statements')
     def __init__(self, declarations: List[ASTNode], statements: List[ASTNode]):
         self.declarations = declarations
         self.statements = statements
@@ -353,8 +488,15 @@ class CompoundStatement(ASTNode):
         statements_str = ', '.join(repr(stmt) for stmt in self.statements)
         return f"CompoundStatement([{declarations_str}],\n{statements_str})"
 
+class ErrorStatement(ASTNode):
+    # Stands in for a statement the parser could not parse and skipped after reporting it
+    __slots__ = ()
+    def pretty_print(self, indent=0):
+        return f"{' ' * indent}ErrorStatement"
+
 
 class ArrayAccess(ASTNode):
+    __slots__ = ('array', 'index')
     def __init__(self, array: ASTNode, index: ASTNode):
         self.array = array
         self.index = index
@@ -371,6 +513,7 @@ class ArrayAccess(ASTNode):
         return f"ArrayAccess({repr(self.array)}, {repr(self.index)})"
     
 class ForLoop(ASTNode):
+    __slots__ = ('init', 'condition', 'update', 'body')
     def __init__(self, init: ASTNode, condition: ASTNode, update: ASTNode, body: ASTNode):
         self.init = init
         self.condition = condition
@@ -400,6 +543,7 @@ class ForLoop(ASTNode):
 
     
 class CharLiteral(ASTNode):
+    __slots__ = ('value', 'type')
     def __init__(self, value):
         self.value = value
 
@@ -410,6 +554,7 @@ class CharLiteral(ASTNode):
         return f'CharLiteral({repr(self.value)})'
 
 class MultiplicativeExpression(ASTNode):
+    __slots__ = ('left', 'operator', 'right')
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -426,6 +571,7 @@ class MultiplicativeExpression(ASTNode):
 
 
 class IfStatement(ASTNode):
+    __slots__ = ('condition', 'true_branch', 'false_branch')
     def __init__(self, condition: ASTNode, true_branch: ASTNode, false_branch: Union[ASTNode, None]):
         self.condition = condition
         self.true_branch = true_branch
@@ -433,8 +579,10 @@ class IfStatement(ASTNode):
     def pretty_print(self, indent=0):
         ind = '    ' * indent
         result = ind + "if ("
-        # Check if condition is a Lark Tree and handle it appropriately
-        if isinstance(self.condition, Tree):
+        # Check if condition is a Lark Tree and handle it appropriately.
+        # A Tree can only exist once lark is loaded, so it is not imported here.
+        lark_tree = sys.modules.get('lark.tree')
+        if lark_tree is not None and isinstance(self.condition, lark_tree.Tree):
             # Handling Tree objects simply as a placeholder; you might need to process them
             result += "Complex Condition Processed for Display"
         else:
@@ -451,6 +599,7 @@ class IfStatement(ASTNode):
         return f"IfStatement({repr(self.condition)}, {repr(self.true_branch)}, {false_branch_str})"
 
 class DoWhileLoop(ASTNode):
+    __slots__ = ('body', 'condition')
     def __init__(self, body: ASTNode, condition: ASTNode):
         self.body = body
         self.condition = condition
@@ -466,6 +615,7 @@ class DoWhileLoop(ASTNode):
 
     
 class WhileLoop(ASTNode):
+    __slots__ = ('condition', 'body')
     def __init__(self, condition: ASTNode, body: ASTNode):
         self.condition = condition
         self.body = body
@@ -479,6 +629,7 @@ class WhileLoop(ASTNode):
         return f"WhileLoop({repr(self.condition)}, {repr(self.body)})"
 
 class FunctionDefinition(ASTNode):
+    __slots__ = ('return_type', 'name', 'parameters', 'body')
     def __init__(self, return_type: ASTNode, name: str, parameters: List[tuple[ASTNode, str]], body: ASTNode):
         self.return_type = return_type
         self.name = name
@@ -501,6 +652,7 @@ class FunctionDefinition(ASTNode):
         return f"FunctionDefinition({repr(self.return_type)}, '{self.name}', [{parameters_str}], {repr(self.body)})"
 
 class ArrayLiteral(ASTNode):
+    __slots__ = ('elements',)
     def __init__(self, elements: List[ASTNode]):
         self.elements = elements
     def pretty_print(self, indent=0):
@@ -521,6 +673,7 @@ class ArrayLiteral(ASTNode):
 #         return f"Program(declarations={self.declarations}, statements={self.statements})"
     
 class Program(ASTNode):
+    __slots__ = ('statements',)
     def __init__(self, statements):
         self.statements = statements
     def pretty_print(self, indent=0):
@@ -531,6 +684,7 @@ class Program(ASTNode):
         return f"Program({', '.join(repr(stmt) for stmt in self.statements)})"
 
 class SelectionStatement(ASTNode):
+    __slots__ = ('condition', 'true_branch', 'false_branch')
     def __init__(self, condition: ASTNode, true_branch: ASTNode, false_branch: Union[None, ASTNode]):
         self.condition = condition
         self.true_branch = true_branch
@@ -548,6 +702,7 @@ class SelectionStatement(ASTNode):
 
 
 class IterationStatement(ASTNode):
+    __slots__ = ('condition', 'body', 'declaration')
     def __init__(self, condition: ASTNode, body: ASTNode, declaration: Union[None, ASTNode] = None):
         self.condition = condition
         self.body = body
@@ -566,6 +721,7 @@ class IterationStatement(ASTNode):
 
 
 class ListComprehension(ASTNode):
+    __slots__ = ('declaration', 'condition', 'body')
     def __init__(self, declaration: ASTNode, condition: Union[ASTNode, None], body: ASTNode):
         self.declaration = declaration
         self.condition = condition
@@ -583,6 +739,7 @@ class ListComprehension(ASTNode):
         return f"ListComprehension({repr(self.declaration)}, {condition_str}, {repr(self.body)})"
 
 class JumpStatement(ASTNode):
+    __slots__ = ('keyword', 'expression')
     def __init__(self, keyword, expression=None):
         self.keyword = keyword
         self.expression = expression
@@ -599,6 +756,7 @@ class JumpStatement(ASTNode):
 
 # In ast__Classes.py
 class PreachStatement(ASTNode):
+    __slots__ = ('expression',)
     def __init__(self, expression):
         self.expression = expression
 
@@ -615,6 +773,7 @@ class PreachStatement(ASTNode):
 
 # Declarations
 class Declaration(ASTNode):
+    __slots__ = ('declaration_specifier', 'expression')
     def __init__(self, declaration_specifier: Union[None, ASTNode], expression: ASTNode):
         self.declaration_specifier = declaration_specifier
         # self.type_specifier = type_specifier
@@ -632,6 +791,7 @@ class Declaration(ASTNode):
         return f"Declaration({specifier_str}, {repr(self.expression)})"
 
 class DeclarationSpecifier(ASTNode):
+    __slots__ = ('eternal', 'type_specifier')
     def __init__(self, eternal: Union[None, str], type_specifier: ASTNode):
         self.eternal = eternal
         self.type_specifier = type_specifier
@@ -648,6 +808,7 @@ class DeclarationSpecifier(ASTNode):
 
 
 class TypeSpecifier(ASTNode):
+    __slots__ = ('type_keyword',)
     def __init__(self, type_keyword: str):
         self.type_keyword = type_keyword
 
@@ -658,6 +819,7 @@ class TypeSpecifier(ASTNode):
         return f"{indent_str}TypeSpecifier: {self.type_keyword}"
 
 class TupleDeclaration(ASTNode):
+    __slots__ = ('identifier', 'values')
     def __init__(self, identifier, values):
         self.identifier = identifier
         self.values = values
@@ -674,6 +836,7 @@ class TupleDeclaration(ASTNode):
 
 
 class ListDeclaration(ASTNode):
+    __slots__ = ('identifier', 'value_list')
     def __init__(self, identifier: str, value_list: List[ASTNode]):
         self.identifier = identifier
         self.value_list = value_list
@@ -689,6 +852,7 @@ class ListDeclaration(ASTNode):
 
 
 class ArrayDeclaration(ASTNode):
+    __slots__ = ('type_specifier', 'identifier', 'expressions')
     def __init__(self, type_specifier: ASTNode, identifier: str, expressions: List[ASTNode]):
         self.type_specifier = type_specifier
         self.identifier = identifier
@@ -706,6 +870,7 @@ class ArrayDeclaration(ASTNode):
 
 # Utility functions
 class BuiltinFunction(ASTNode):
+    __slots__ = ('name', 'arguments')
     def __init__(self, name: str, arguments: List[ASTNode]):
         self.name = name
         self.arguments = arguments
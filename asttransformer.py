@@ -1,10 +1,12 @@
 import sys
 import os
+from collections import Counter
 import lexer
 from lark import Lark, Transformer, Tree, Token
 from typing import List
 from dataclasses import dataclass
 from lark import Lark, ast_utils, Transformer, v_args
+from lark.visitors import Transformer_NonRecursive
 from lark.tree import Meta
 import astclasses
 
@@ -103,14 +105,50 @@ from astclasses import *
 
 def remove_none(lst):
     flat_list = []
-    for sublist in lst:
-        if isinstance(sublist, list):
-            flat_list.extend(remove_none(sublist))
-        elif sublist is not None:
-            flat_list.append(sublist)
+    # Iterators of the lists being flattened, innermost last
+    stack = [iter(lst)]
+    while stack:
+        for sublist in stack[-1]:
+            if isinstance(sublist, list):
+                stack.append(iter(sublist))
+                break
+            elif sublist is not None:
+                flat_list.append(sublist)
+        else:
+            stack.pop()
     return flat_list
 
-class ToAst(Transformer):
+class ToAst(Transformer_NonRecursive):
+    # Every callback receives children that are already transformed and never
+    # transforms a subtree again, so the same ToAst works after parsing, with
+    # transform(), and inline, as the transformer= of a LALR Lark parser.
+    # Transformer_NonRecursive walks the tree with a stack, so transform()
+    # handles trees deeper than the recursion limit.
+
+    def count_visits(self, names):
+        """Count each call of the callbacks for the given rule and terminal names in self.visits.
+
+        Lark looks the callbacks up when an inline parser is built, so this has
+        to be called before the transformer is passed to Lark.
+        """
+        self.visits = Counter()
+        for name in names:
+            callback = getattr(self, name, None)
+            if callable(callback):
+                setattr(self, name, self.counted(name, callback))
+        default = self.__default__
+
+        def counted_default(data, children, meta):
+            if not data.startswith('_'):
+                self.visits[data] += 1
+            return default(data, children, meta)
+        self.__default__ = counted_default
+
+    def counted(self, name, callback):
+        def counted_callback(*args):
+            self.visits[name] += 1
+            return callback(*args)
+        return counted_callback
 
     # def start(self, children):
     #     statements = []
@@ -136,16 +174,15 @@ class ToAst(Transformer):
     
     
     def compound_statement(self, children):
-        declarations = [child for child in children if isinstance(child, Declaration)]
-        statements = [child for child in children if not isinstance(child, Declaration)]
-        return CompoundStatement(declarations, statements)
+        # Declarations are statements too, so everything between the braces stays in order
+        return CompoundStatement([], children[1:-1])
 
     def tuple_declaration(self, children):
         identifier = children[0]  # The identifier node
-        # Skip the first child assuming it is 'LeftParen()'
+        # Skip the '=' token and 'LeftParen()' that follow the identifier
         values = []
-        # Loop over all children except the first (LeftParen) and last (RightParen)
-        for child in children[2:-1]:  # Adjust indices appropriately
+        # Loop over all children after LeftParen, except the last (RightParen)
+        for child in children[3:-1]:  # Adjust indices appropriately
             if isinstance(child, ASTNode):
                 values.append(child)
             elif isinstance(child, list):  # Handle cases where values are within a nested list
@@ -164,7 +201,8 @@ class ToAst(Transformer):
         return Literal(children[0])
 
     def list_declaration(self, children):
-        identifier = Identifier(children[1].value)
+        # Assuming children = [identifier, '=', '[', value_list, ']']
+        identifier = children[0]
         value_list = children[3]
         return ListDeclaration(identifier, value_list)
 
@@ -227,10 +265,9 @@ class ToAst(Transformer):
         body = children[3]
         return WhileLoop(condition, body)
     
-    def CHAR_SEQUENCE(self, token):
-        # Remove the single quotes from the token value
-        char_value = token[1:-1]
-        return CharLiteral(char_value)
+    def CHAR_LITERAL(self, token):
+        # The lexer has already removed the quotes from the token value
+        return CharLiteral(token.value)
     
     def member_access_expression(self, args):
         def ensure_ast_node(node):
@@ -251,6 +288,9 @@ class ToAst(Transformer):
             # Dot operation, could be list_op, tuple_op, or array_op
             object_expr = ensure_ast_node(args[0])
             operation = ensure_ast_node(args[2])  # Transform if necessary
+            if not isinstance(operation, BuiltinFunction):
+                # '.[expression]' indexes like '[expression]'
+                return MemberAccessExpression(object_expr, index=operation)
             return MemberAccessExpression(object_expr, operation=operation)
         
         elif len(args) == 4 and args[1].type == 'LBRACKET':
@@ -267,6 +307,13 @@ class ToAst(Transformer):
 
 
     
+    def member_op(self, children):
+        # children = [NAME] or [NAME, '(', arguments..., ')'], or ['[', expression, ']'] for an index
+        name = children[0]
+        if name.type == 'LBRACKET':
+            return children[1]
+        return BuiltinFunction(name.value, children[2:-1])
+
     def preach_statement(self, items):
         # Assuming items = ['preach', '(', expression, ')']
         _, _, expression, _ = items
@@ -289,9 +336,6 @@ class ToAst(Transformer):
     def LPAREN(self, token):
         return LeftParen()
     
-    def GT(self, token):
-        return GreaterThan()
-
     def LBRACE(self, token):
         return LeftBrace()
 
@@ -340,32 +384,23 @@ class ToAst(Transformer):
         keyword = args[0].value
 
         if keyword == "chant":
-            loop_components = []
-            for part in args[1:]:
-                if isinstance(part, Tree):
-                    loop_components.append(self.transform(part))
-                else:
-                    loop_components.append(part)
-            if len(loop_components) < 7:
-                raise ValueError("Incomplete loop structure")
-            declaration = loop_components[0] 
-            condition = loop_components[2] 
-            increment = loop_components[4]  
-            body = loop_components[6]     
-            return ForLoop(declaration, condition, increment, body)
+            # Children reach a rule already transformed, so they are used as they are.
+            # The optional specifier, condition and update are None when left out.
+            _, _, specifier, assignment, condition, increment, _, body = args
+            return ForLoop(VariableDeclaration(specifier, assignment), condition, increment, body)
         
         elif keyword == "oath":
             if len(args) < 4:
                 raise ValueError("Incomplete 'oath' loop structure")
-            body = self.transform(args[1]) if isinstance(args[1], Tree) else args[1]
-            condition = self.transform(args[3]) if isinstance(args[3], Tree) else args[3]
+            body = args[1]
+            condition = args[4]
             return DoWhileLoop(body, condition)
 
         elif keyword == "pledge":
             if len(args) < 5:
                 raise ValueError("Incomplete 'pledge' loop structure")
-            condition = self.transform(args[2]) if isinstance(args[2], Tree) else args[2]
-            body = self.transform(args[4]) if isinstance(args[4], Tree) else args[4]
+            condition = args[2]
+            body = args[4]
             return WhileLoop(condition, body)
 
         else:
@@ -385,9 +420,9 @@ class ToAst(Transformer):
         return BinaryExpression(left, operator, right)
 
     def array_declaration(self, children):
-        type_specifier = children[0]  # Assuming the type_specifier is the first child
-        identifier = children[1]      # Assuming the identifier is the second child
-        expressions = children[3:-1] if len(children) > 4 else []  # Check if there are more than four children to include expressions
+        type_specifier = children[1]  # Assuming the type_specifier follows '<'
+        identifier = children[3]      # Assuming the identifier follows '>'
+        expressions = children[6:-1] if len(children) > 7 else []  # Check if there are more than seven children to include expressions
 
         return ArrayDeclaration(type_specifier, identifier, expressions)
 
@@ -437,17 +472,13 @@ class ToAst(Transformer):
         if len(items) == 3:
             # Assuming items = [left, operator, right]
             left, operator, right = items
-            left_node = self.convert_to_ast_node(left)
-            right_node = self.convert_to_ast_node(right)
-            # Use the type of the operator object to determine the operator symbol
-            operator_symbol = None
-            if isinstance(operator, GreaterThan):
-                operator_symbol = '>'
-            # Add more cases for other operator types as needed
-            if operator_symbol is not None:
-                return BinaryExpression(left_node, operator_symbol, right_node)
+            return BinaryExpression(left, operator.value, right)
         # If it's not a relational expression, just return the single item
-        return self.convert_to_ast_node(items[0]) if items else None
+        return items[0]
+
+    # Every level of the expression chain is 'left OPERATOR right' or its tighter operand
+    logical_or_expression = logical_and_expression = and_expression = relational_expression
+    equality_expression = multiplicative_expression = relational_expression
 
     def utility_function(self, items):
         # Assuming items = ['length', '(', expression, ')']
@@ -465,16 +496,19 @@ class ToAst(Transformer):
     def primary_expression(self, *args):
         if len(args) == 1:
             value = args[0]
+            if isinstance(value, list) and len(value) == 3:
+                # Parenthesized expression: ['(', expression, ')']
+                return value[1]
             if isinstance(value, Token):
                 if value.type == 'IDENTIFIER':
                     return Identifier(value.value)
-                elif value.type == 'int':
-                    return IntLiteral(int(value.value))
-                elif value.type == 'float':
-                    return FloatLiteral(float(value.value))
-                elif value.type == 'str':
-                    return StringLiteral(value.value[1:-1])
-                elif value.type == 'bool':
+                elif value.type == 'INT_LITERAL':
+                    return IntLiteral(value.value)
+                elif value.type == 'FLOAT_LITERAL':
+                    return FloatLiteral(value.value)
+                elif value.type == 'STRING_LITERAL':
+                    return StringLiteral(value.value)
+                elif value.type == 'BOOL_LITERAL':
                     return BoolLiteral(value.value)
             else:
                 return value
@@ -499,9 +533,10 @@ class ToAst(Transformer):
         parameters = []
         for param in params:
             if isinstance(param, tuple) and len(param) == 2:
-                type_keyword, identifier_token = param
-                if isinstance(identifier_token, Token) and identifier_token.type == 'CNAME':
-                    parameters.append((type_keyword, identifier_token.value))
+                type_keyword, identifier_name = param
+                # parameter_list has already reduced the identifier to its name
+                if isinstance(identifier_name, str):
+                    parameters.append((type_keyword, identifier_name))
                 else:
                     raise ValueError("Invalid identifier token in parameters")
             else:
@@ -514,11 +549,31 @@ class ToAst(Transformer):
 
 
     
-    def SIGNED_INT(self, token):
-        return IntegerLiteral(int(token))
+    def INT_LITERAL(self, token):
+        return IntegerLiteral(token.value)
+
+    def FLOAT_LITERAL(self, token):
+        return FloatLiteral(token.value)
+
+    def BOOL_LITERAL(self, token):
+        return BoolLiteral(token.value)
 
-    def CNAME(self, token):
-        return Identifier(token)
+    def IDENTIFIER(self, token):
+        return Identifier(token.value)
+
+    def parameter_type(self, children):
+        # Array parameters are written as 'int[] name'
+        type_specifier = children[0]
+        if len(children) > 1:
+            return TypeSpecifier(type_specifier.type_keyword + '[]')
+        return type_specifier
+
+    def identifier(self, children):
+        # Utility names such as 'length' may also be used as identifiers
+        name = children[0]
+        if isinstance(name, Identifier):
+            return name
+        return Identifier(name.value)
 
     def parameter_list(self, children):
         # Ensure that the number of children is even to form pairs
@@ -570,24 +625,23 @@ class ToAst(Transformer):
 
 
     def function_body(self, children):
-        statements = []
-        for stmt in children[1:-1]:
-            if isinstance(stmt, (Declaration, IfStatement, IterationStatement, FunctionCall, PreachStatement, JumpStatement)):
-                statements.append(stmt)
-        return CompoundStatement([], statements)
+        # Every statement between the braces, as compound_statement keeps them
+        return CompoundStatement([], children[1:-1])
 
     def function_call(self, children):
+        # children = [identifier, '(', assignment_expression, value_list, ')']
         name = children[0].value
-        arguments = children[1]
+        arguments = [children[2]] + children[3]
         return FunctionCall(name, arguments)
     
     def array_declaration(self, children):
         # Extract the type specifier and identifier, which are expected to always be present
-        type_specifier = children[0]  # This should be an instance of TypeSpecifier
-        identifier = children[1]      # This should be an instance of Identifier
+        # Assuming children = ['<', type_specifier, '>', identifier, '=', '[', expressions..., ']']
+        type_specifier = children[1]  # This should be an instance of TypeSpecifier
+        identifier = children[3]      # This should be an instance of Identifier
 
-        # Extract expressions if present. They are beyond the 3rd element after type_specifier, identifier, and '['
-        expressions = children[3:-1] if len(children) > 4 else []
+        # Extract expressions if present. They are between '[' and ']'
+        expressions = children[6:-1] if len(children) > 7 else []
 
         return ArrayDeclaration(type_specifier, identifier.value, expressions)
 
@@ -625,8 +679,9 @@ class ToAst(Transformer):
 
     def convert_to_ast_node(self, item):
         if isinstance(item, Tree):
-            # If the item is a Tree, transform it into an AST node using the appropriate transformation method
-            return self.transform(item)
+            # A Tree left by __default__ has been transformed already; transforming it
+            # again would only rebuild the same Tree
+            return item
         elif isinstance(item, list):
             # If the item is a list, check if it contains a single element and convert it
             # If it contains more than one element, convert each element and return the list
@@ -636,23 +691,23 @@ class ToAst(Transformer):
                 return [self.convert_to_ast_node(sub_item) for sub_item in item]
         elif isinstance(item, Token):
             # Convert tokens to appropriate AST nodes based on their type
-            if item.type == 'CNAME':
+            if item.type == 'IDENTIFIER':
                 return Identifier(item.value)
-            elif item.type == 'SIGNED_INT':
-                return IntegerLiteral(int(item.value))
-            elif item.type == 'STRING':
-                return StringLiteral(item.value[1:-1])
-            elif item.type == 'FLOAT':
-                return FloatLiteral(float(item.value))
-            elif item.type == 'BOOLEAN' :
-                return BoolLiteral(bool(item.value))
+            elif item.type == 'INT_LITERAL':
+                return IntegerLiteral(item.value)
+            elif item.type == 'STRING_LITERAL':
+                return StringLiteral(item.value)
+            elif item.type == 'FLOAT_LITERAL':
+                return FloatLiteral(item.value)
+            elif item.type == 'BOOL_LITERAL':
+                return BoolLiteral(item.value)
             # Add more cases for other token types as needed
         return item
 
     
     def block(self, children):
         # Filter out any None children, which might be placeholders for optional grammar parts
-        statements = [self.transform(child) for child in children if child is not None]
+        statements = [child for child in children if child is not None]
         return CompoundStatement(statements)
 
     # def binary_expression(self, children):
@@ -662,14 +717,13 @@ class ToAst(Transformer):
     #     right_node = self.transform(right)
     #     return BinaryExpression(left=left_node, operator=operator, right=right_node)
     
-    def SINGLE_QUOTE_STR(self, token):
-        # Remove the single quotes from the token value
-        string_value = token[1:-1]
-        return StringLiteral(string_value)
+    def STRING_LITERAL(self, token):
+        # The lexer has already removed the quotes from the token value
+        return StringLiteral(token.value)
     
     def unary_expression(self, children):
         operator = children[0]  # Assuming the operator is a terminal node or already transformed
-        operand = self.transform(children[1])
+        operand = children[1]
         
         return UnaryExpression(operator=operator, operand=operand)
 
@@ -685,8 +739,46 @@ class ToAst(Transformer):
         return token
 
     def __default__(self, data, children, meta):
+        if data.startswith('_'):
+            # Lark's own rules for 'x*' repetitions; an inline LALR parser splices
+            # the children of this Tree into the rule that uses them
+            return Tree(data, children)
         if children:
             if len(children) == 1:
                 return children[0]
             return Tree(data, children)
-        return data
\ No newline at end of file
+        return data
+
+
+class InlineTerminals:
+    """Hands a ToAst to the transformer= of a LALR Lark parser.
+
+    An inline parser only calls the callbacks of terminals Lark defines
+    itself, and mygrammar.lark %declares every terminal for
+    TokenStreamLexer, so the rules would get the raw tokens. Each rule
+    callback here first converts the tokens among its children with the
+    ToAst method named after their terminal, as transform() does.
+    """
+
+    def __init__(self, transformer):
+        self.transformer = transformer
+        # Terminal -> its ToAst callback, or None for a token rules use as it is
+        self.terminals = {}
+
+    def __getattr__(self, name):
+        # Lark asks for the callback of each rule, and __default__ for the others
+        callback = getattr(self.transformer, name)
+        if name == '__default__':
+            return lambda data, children, meta: callback(data, self.convert(children), meta)
+        return lambda children: callback(self.convert(children))
+
+    def convert(self, children):
+        terminals = self.terminals
+        for index, child in enumerate(children):
+            if isinstance(child, Token):
+                if child.type not in terminals:
+                    terminals[child.type] = getattr(self.transformer, child.type, None)
+                callback = terminals[child.type]
+                if callback is not None:
+                    children[index] = callback(child)
+        return children
@@ -0,0 +1,1299 @@
+import argparse
+import glob
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import lexer
+
+# Programs every benchmark runs on, relative to the repository root
+CORPUS = sorted(glob.glob('testcases/*.holy')) + sorted(glob.glob('A7_testcases/*.holy'))
+
+
+def load_tokens(path):
+    import main
+    with open(path) as file:
+        script_text = main.extract_script(file.read())
+    tokens, error = lexer.run_buffer(path, script_text)
+    if error:
+        raise SystemExit(error.as_string())
+    return tokens
+
+
+def best_time(func, repeat, number):
+    """Best average seconds per call of `func` over `repeat` rounds of `number` calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def corpus_source(paths, size):
+    """Concatenate the corpus scripts until the source is at least `size` characters."""
+    import main
+    scripts = []
+    for path in paths:
+        with open(path) as file:
+            scripts.append(main.extract_script(file.read()))
+    chunk = '\n'.join(scripts) + '\n'
+    return chunk * max(1, size // len(chunk) + 1)
+
+
+#######################################
+# LEX
+#######################################
+
+
+def bench_lex(args):
+    """Compare the per-character Lexer with the regex driven RegexLexer."""
+    source = corpus_source(args.files or CORPUS, args.size)
+    reference, error = lexer.Lexer('<bench>', source).make_tokens()
+    tokens, error = lexer.RegexLexer('<bench>', source).make_tokens()
+    if error or tokens != reference:
+        print("RegexLexer output differs from Lexer")
+        return 1
+
+    char_time = best_time(lambda: lexer.Lexer('<bench>', source).make_tokens(), args.repeat, 1)
+    regex_time = best_time(lambda: lexer.RegexLexer('<bench>', source).make_tokens(), args.repeat, 1)
+    print(f"source: {len(source)} characters, {len(tokens)} tokens")
+    print(f"Lexer:      {char_time * 1000:10.1f} ms")
+    print(f"RegexLexer: {regex_time * 1000:10.1f} ms")
+    print(f"speedup: {char_time / regex_time:.1f}x")
+    return 0
+
+
+def retained_bytes(func):
+    """Bytes still allocated after `func()` returns, while its result is alive."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def bench_tokens(args):
+    """Compare the memory of a token list with a TokenBuffer for the same source."""
+    source = corpus_source(args.files or CORPUS, args.size)
+    tokens, error = lexer.run('<bench>', source)
+    buffer, error = lexer.run_buffer('<bench>', source)
+    if error or buffer.tokens() != tokens:
+        print("TokenBuffer contents differ from the token list")
+        return 1
+    del tokens, buffer
+
+    list_bytes = retained_bytes(lambda: lexer.run('<bench>', source)[0])
+    buffer_bytes = retained_bytes(lambda: lexer.run_buffer('<bench>', source)[0])
+    count = len(lexer.run_buffer('<bench>', source)[0])
+    print(f"source: {len(source)} characters, {count} tokens")
+    print(f"token list:  {list_bytes / 1e6:8.2f} MB ({list_bytes / count:5.1f} bytes/token)")
+    print(f"TokenBuffer: {buffer_bytes / 1e6:8.2f} MB ({buffer_bytes / count:5.1f} bytes/token)")
+    print(f"reduction: {list_bytes / buffer_bytes:.1f}x")
+    return 0
+
+
+def peak_bytes(func):
+    """Peak traced allocation while `func()` runs."""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+# Non-ASCII identifiers, and errors after them whose columns count characters
+NON_ASCII_SOURCE = 'int café = 1;\nint ü = café € 2;\n  € preach(ü);\n'
+
+
+def lexed(text):
+    """(kind, value) of every token and (details, line, column) of every error in `text`."""
+    errors = []
+    tokens = [(kind, value) for kind, _, _, value in lexer.RegexLexer('<bench>', text, report=errors.append).iter_tokens()]
+    return tokens, [(error.details, error.pos_start.ln, error.pos_start.col) for error in errors]
+
+
+def bench_stream(args):
+    """Peak memory of lexing a large file read into a str against an mmap'd token stream."""
+    import main
+    source = 'summon HolyScript\n' + corpus_source(args.files or CORPUS, args.size) + 'doom\n'
+    with tempfile.NamedTemporaryFile('w', suffix='.holy', delete=False) as file:
+        file.write(source)
+    del source
+
+    def read_and_lex():
+        with open(file.name) as source_file:
+            script_text = main.extract_script(source_file.read())
+        return len(lexer.run(file.name, script_text)[0])
+
+    def stream_and_lex():
+        data = main.read_holy_script_file(file.name)
+        count = sum(1 for _ in lexer.RegexLexer(file.name, data, *main.script_frame(data)).iter_tokens())
+        data.close()
+        return count
+
+    try:
+        count = read_and_lex()
+        if stream_and_lex() != count:
+            print("Streamed tokens differ from the token list")
+            return 1
+        if lexed(NON_ASCII_SOURCE) != lexed(NON_ASCII_SOURCE.encode()):
+            print("Lexing non-ASCII source as bytes differs from lexing it as a str")
+            return 1
+        read_peak = peak_bytes(read_and_lex)
+        stream_peak = peak_bytes(stream_and_lex)
+    finally:
+        os.remove(file.name)
+    print(f"{count} tokens")
+    print(f"read + token list: {read_peak / 1e6:8.2f} MB peak")
+    print(f"mmap + iter_tokens: {stream_peak / 1e6:8.2f} MB peak")
+    return 0
+
+
+def bench_incremental(args):
+    """Time re-parsing a large source after a one statement edit, in full and incrementally."""
+    import holyparser
+    import incremental
+    source = corpus_source(args.files or CORPUS, args.size)
+    # Change one literal in the middle of the source; its length changes so later offsets move
+    start = source.index('1;', len(source) // 2)
+    edited = source[:start] + '10' + source[start + 1:]
+
+    def full_parse():
+        tokens, error = lexer.run_buffer('<bench>', edited)
+        return holyparser.run('<bench>', tokens)
+
+    editor = incremental.IncrementalParser('<bench>', source)
+    full_program, error = full_parse()
+    program, error = editor.update(edited)
+    if error or repr(program) != repr(full_program):
+        print("Incremental result differs from a full parse")
+        return 1
+
+    def edit_and_undo():
+        editor.edit(start, start + 1, '10')
+        editor.edit(start, start + 2, '1')
+
+    full_time = best_time(full_parse, args.repeat, 1)
+    incremental_time = best_time(edit_and_undo, args.repeat, 1) / 2
+    print(f"source: {len(source)} characters, {len(program.statements)} top-level statements")
+    print(f"full lex + parse:  {full_time * 1000:10.2f} ms")
+    print(f"incremental edit:  {incremental_time * 1000:10.2f} ms ({editor.reparsed} statement(s) re-parsed)")
+    print(f"speedup: {full_time / incremental_time:.1f}x")
+    return 0
+
+
+#######################################
+# PARSE
+#######################################
+
+PARSE_TARGET_SPEEDUP = 10
+
+
+def parse_tree_nodes(tree, transformer):
+    """Trees and transformer-handled tokens in a Lark parse tree: the visits a single pass makes."""
+    return (sum(1 for _ in tree.iter_subtrees()) +
+            sum(1 for _ in tree.scan_values(lambda value: hasattr(transformer, getattr(value, 'type', '')))))
+
+
+def node_difference(left, right):
+    """Describe the first place the two trees differ, comparing node by node, or return None."""
+    import astclasses
+    stack = [('program', left, right)]
+    while stack:
+        path, left, right = stack.pop()
+        if type(left) is not type(right):
+            return f"{path}: {type(left).__name__} vs {type(right).__name__}"
+        if isinstance(left, astclasses.ASTNode):
+            for field in reversed(left._fields):
+                stack.append((f"{path}.{field}", getattr(left, field, None), getattr(right, field, None)))
+        elif isinstance(left, (list, tuple)):
+            if len(left) != len(right):
+                return f"{path}: {len(left)} vs {len(right)} items"
+            stack.extend((f"{path}[{index}]", *pair) for index, pair in reversed(list(enumerate(zip(left, right)))))
+        elif left != right:
+            return f"{path}: {left!r} vs {right!r}"
+    return None
+
+
+def bench_parse(args):
+    """Time tokens -> astclasses.Program for the Lark paths and the native parser.
+
+    Every parser has to build the same Program, compared by repr, and the
+    inline LALR Program is also compared with the native one node by node.
+    """
+    import main
+    import holyparser
+
+    main.count_visits = True
+    earley = main.build_parser('earley')
+    lalr = main.build_parser('lalr')
+    transformer = main.get_transformer()
+    paths = {
+        'earley': lambda tokens: transformer.transform(earley.parse(tokens)),
+        'lalr': lambda tokens: transformer.transform(lalr.parse(tokens)),
+        'lalr inline': lambda tokens: main.parse_program('<bench>', tokens, 'lalr')[0],
+        'native': lambda tokens: holyparser.run('<bench>', tokens)[0],
+    }
+
+    totals = dict.fromkeys(paths, 0.0)
+    visits = dict.fromkeys(['parse tree', 'lalr', 'lalr inline'], 0)
+    # Programs the Lark parsers build differently from the native parser
+    mismatched = []
+    print(f"{'program':32} {'tokens':>7} " + ' '.join(f"{name + ' (ms)':>16}" for name in paths))
+    for path in args.files or CORPUS:
+        tokens = load_tokens(path)
+        programs = {repr(paths[name](tokens)) for name in ('earley', 'lalr', 'native')}
+        if len(programs) != 1:
+            mismatched.append(path)
+        difference = node_difference(paths['lalr inline'](tokens), paths['native'](tokens))
+        if difference is not None:
+            print(f"{path}: lalr inline and native ASTs differ at {difference}")
+            mismatched.append(path)
+        # Count the transformer calls of one compile on each Lark LALR path
+        visits['parse tree'] += parse_tree_nodes(lalr.parse(tokens), transformer)
+        for name in ('lalr', 'lalr inline'):
+            transformer.visits.clear()
+            paths[name](tokens)
+            visits[name] += sum(transformer.visits.values())
+        times = {name: best_time(lambda: parse(tokens), args.repeat, args.number)
+                 for name, parse in paths.items()}
+        for name, seconds in times.items():
+            totals[name] += seconds
+        print(f"{path:32} {len(tokens):>7} " + ' '.join(f"{seconds * 1000:>16.3f}" for seconds in times.values()))
+
+    print(f"{'total':32} {'':>7} " + ' '.join(f"{seconds * 1000:>16.3f}" for seconds in totals.values()))
+    print("transformer visits: " + ', '.join(f"{name} {count}" for name, count in visits.items()))
+    speedup = totals['earley'] / totals['native']
+    print(f"native vs earley+transformer: {speedup:.1f}x (target {PARSE_TARGET_SPEEDUP}x)")
+    print(f"native vs lalr+transformer: {totals['lalr'] / totals['native']:.1f}x")
+    print(f"lalr inline vs lalr+transformer: {totals['lalr'] / totals['lalr inline']:.1f}x")
+    single_pass = visits['lalr'] == visits['lalr inline'] == visits['parse tree']
+    if not single_pass:
+        print("transformer visits differ from the number of parse tree nodes")
+    for path in mismatched:
+        print(f"{path}: earley, lalr and native parsers build different programs")
+    return 0 if speedup >= PARSE_TARGET_SPEEDUP and single_pass and not mismatched else 1
+
+
+#######################################
+# AST
+#######################################
+
+
+def ast_nodes(root):
+    """Every ASTNode under `root`, including it."""
+    import astclasses
+    nodes, stack = [], [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, astclasses.ASTNode):
+            nodes.append(item)
+            stack.extend(getattr(item, field, None) for field in item._fields)
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return nodes
+
+
+def dict_nodes(root, copies=None):
+    """Copy the tree into plain objects that keep their fields in a __dict__, as nodes did before __slots__.
+
+    Each copied node is also appended to `copies` when it is given.
+    """
+    import astclasses
+    classes = {}
+
+    def copy(item):
+        if isinstance(item, astclasses.ASTNode):
+            cls = type(item)
+            if cls not in classes:
+                classes[cls] = type(cls.__name__, (), {})
+            node = classes[cls]()
+            if copies is not None:
+                copies.append(node)
+            for field in item._fields:
+                if hasattr(item, field):
+                    setattr(node, field, copy(getattr(item, field)))
+            if item.offset is not None:
+                node.offset = item.offset
+            return node
+        if isinstance(item, list):
+            return [copy(element) for element in item]
+        if isinstance(item, tuple):
+            return tuple(copy(element) for element in item)
+        return item
+
+    return copy(root)
+
+
+def node_bytes(node):
+    return sys.getsizeof(node) + (sys.getsizeof(vars(node)) if hasattr(node, '__dict__') else 0)
+
+
+def bench_ast(args):
+    """Bytes per AST node with __slots__, in per-instance dicts and in an ASTArena."""
+    import astarena
+    import holyparser
+    source = corpus_source(args.files or CORPUS, args.size)
+    tokens, error = lexer.run_buffer('<bench>', source)
+    program, error = holyparser.run('<bench>', tokens)
+    if error:
+        print(error.as_string())
+        return 1
+    nodes = ast_nodes(program)
+    count = len(nodes)
+    slotted = sum(map(node_bytes, nodes))
+    copies = []
+    dict_nodes(program, copies)
+    unslotted = sum(map(node_bytes, copies))
+    del program, nodes, copies
+
+    slotted_tree = retained_bytes(lambda: holyparser.run('<bench>', tokens)[0])
+    dict_tree = retained_bytes(lambda: dict_nodes(holyparser.run('<bench>', tokens)[0]))
+    arena, error = astarena.run('<bench>', tokens)
+    if repr(arena.to_program()) != repr(holyparser.run('<bench>', tokens)[0]):
+        print("ASTArena round trip differs from the parsed Program")
+        return 1
+    rows = len(arena)
+    del arena
+    arena_tree = retained_bytes(lambda: astarena.run('<bench>', tokens)[0])
+    print(f"source: {len(source)} characters, {count} AST nodes, {rows} arena rows")
+    print(f"{'':10} {'bytes/node':>11} {'whole tree (MB)':>16}")
+    print(f"{'__dict__':10} {unslotted / count:>11.1f} {dict_tree / 1e6:>16.2f}")
+    print(f"{'__slots__':10} {slotted / count:>11.1f} {slotted_tree / 1e6:>16.2f}")
+    print(f"{'ASTArena':10} {arena_tree / count:>11.1f} {arena_tree / 1e6:>16.2f}")
+    print(f"reduction: {unslotted / slotted:.1f}x per node, {dict_tree / slotted_tree:.1f}x per tree")
+    print(f"ASTArena vs __slots__ tree: {slotted_tree / arena_tree:.1f}x")
+    return 0
+
+
+#######################################
+# DISPATCH
+#######################################
+
+# The node kinds SemanticAnalyzer handled with its if/elif chain, in chain order
+ANALYZER_KINDS = ['Program', 'VariableDeclaration', 'PreachStatement', 'IntegerLiteral', 'CharLiteral',
+                  'StringLiteral', 'BoolLiteral', 'FloatLiteral', 'CompoundStatement', 'Identifier',
+                  'IfStatement', 'BinaryExpression', 'LeftBrace', 'RightBrace', 'TupleDeclaration',
+                  'ForLoop', 'WhileLoop']
+
+
+def name_chain(node):
+    """Dispatch the way SemanticAnalyzer.analyze did, comparing the class name down a chain."""
+    node_type = type(node).__name__
+    for position, kind in enumerate(ANALYZER_KINDS):
+        if node_type == kind:
+            return position
+    return -1
+
+
+def bench_dispatch(args):
+    """Per node cost of the name-compare chain against the cached Visitor dispatch."""
+    import holyparser
+    import visitor
+
+    def handler(position):
+        return visitor.handles(ANALYZER_KINDS[position])(lambda self, node: position)
+
+    handlers = {f'handle_{position}': handler(position) for position in range(len(ANALYZER_KINDS))}
+    handlers['generic_visit'] = lambda self, node: -1
+    pass_class = type('DispatchPass', (visitor.Visitor,), handlers)
+
+    source = corpus_source(args.files or CORPUS, args.size)
+    tokens, error = lexer.run_buffer('<bench>', source)
+    nodes = ast_nodes(holyparser.run('<bench>', tokens)[0])
+    dispatcher = pass_class()
+    if [dispatcher.visit(node) for node in nodes] != [name_chain(node) for node in nodes]:
+        print("Visitor dispatch differs from the name chain")
+        return 1
+
+    def per_node(dispatch, sample):
+        return best_time(lambda: [dispatch(node) for node in sample], args.repeat, 1) / len(sample)
+
+    print(f"{len(nodes)} AST nodes")
+    print(f"{'nodes':24} {'name chain (ns)':>16} {'Visitor (ns)':>14}")
+    samples = {'whole program': nodes}
+    for kind in ('Program', 'Identifier', 'WhileLoop', 'FunctionDefinition'):
+        sample = [node for node in nodes if type(node).__name__ == kind]
+        if sample:
+            samples[kind] = sample * max(1, len(nodes) // len(sample))
+    for name, sample in samples.items():
+        chain_time = per_node(name_chain, sample)
+        visit_time = per_node(dispatcher.visit, sample)
+        print(f"{name:24} {chain_time * 1e9:>16.1f} {visit_time * 1e9:>14.1f}")
+    return 0
+
+
+#######################################
+# DIAGNOSTICS
+#######################################
+
+
+def declarations_source(count):
+    """A program that analyzes cleanly, reporting a note for each of its statements."""
+    return ''.join(f'int v{i} = {i}; belief (v{i} > 0) {{ int w = v{i}; }} preach("v");\n' for i in range(count))
+
+
+def bench_diagnostics(args):
+    """Analyzer time when every message is printed at once, rendered in batch, or dropped by quiet mode."""
+    import diagnostics
+    import holyparser
+    import main
+
+    class EagerDiagnostics(diagnostics.Diagnostics):
+        # Writes each record as it is reported, the way the analyzer used to print
+        def report(self, severity, code, message, node=None):
+            diagnostic = super().report(severity, code, message, node)
+            self.flush()
+            return diagnostic
+
+    source = declarations_source(args.statements)
+    tokens, error = lexer.run_buffer('<bench>', source)
+    program = holyparser.run('<bench>', tokens, tokens.lines)[0]
+
+    def analyze(make, format='text'):
+        buffer = make('<bench>', tokens.lines)
+        result = main.SemanticAnalyzer(buffer).analyze(program)
+        buffer.flush(format, out)
+        return result, len(buffer)
+
+    with open(os.devnull, 'w') as out:
+        modes = {
+            'print each': lambda: analyze(EagerDiagnostics),
+            'batch text': lambda: analyze(diagnostics.Diagnostics),
+            'batch json': lambda: analyze(diagnostics.Diagnostics, 'json'),
+            'quiet': lambda: analyze(lambda fn, lines: diagnostics.Diagnostics(fn, lines, quiet=True)),
+        }
+        buffer = diagnostics.Diagnostics('<bench>', tokens.lines)
+        if main.SemanticAnalyzer(buffer).analyze(program) != "Code analyzed successfully":
+            print(buffer.render())
+            return 1
+        print(f"{args.statements * 4} statements, {len(buffer)} notes")
+        print(f"{'output':12} {'analyze (ms)':>13}")
+        for name, mode in modes.items():
+            # EagerDiagnostics writes to stdout, so point it at the null device as well
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                elapsed = best_time(mode, args.repeat, 1)
+            finally:
+                sys.stdout = stdout
+            print(f"{name:12} {elapsed * 1000:>13.1f}")
+    return 0
+
+
+#######################################
+# RECOVERY
+#######################################
+
+
+# One lexical, one syntax and one semantic error, each confined to its line
+BROKEN_LINES = ('int e{i} = {i} $ 1;\n', 'int e{i} = {i} +;\n', 'int e{i} = missing{i};\n')
+
+
+def broken_source(groups, errors):
+    """declarations_source() lines with `errors` of them broken, spread evenly, and the broken line numbers."""
+    lines = declarations_source(groups).splitlines(keepends=True)
+    step = max(1, len(lines) // errors)
+    broken = {}
+    for n, line in enumerate(range(0, len(lines), step)[:errors]):
+        lines[line] = BROKEN_LINES[n % len(BROKEN_LINES)].format(i=line)
+        broken[line] = lines[line]
+    return lines, broken
+
+
+def compile_errors(lines, max_errors):
+    """Lex, parse and analyze the source, returning its Diagnostics."""
+    import diagnostics
+    import main
+    source = ''.join(lines)
+    buffer = diagnostics.Diagnostics('<bench>', lexer.LineIndex(source), quiet=True, max_errors=max_errors)
+    try:
+        program, error = main.parse_source('<bench>', source, report=buffer.add_error)
+        main.SemanticAnalyzer(buffer).analyze(program)
+    except diagnostics.TooManyErrors:
+        pass
+    return buffer
+
+
+def bench_recovery(args):
+    """Compiles and time to find every error, one compile per error against a single recovering compile."""
+    lines, broken = broken_source(args.statements, args.errors)
+
+    start = time.perf_counter()
+    fixed, compiles = list(lines), 0
+    while True:
+        compiles += 1
+        buffer = compile_errors(fixed, max_errors=1)
+        located = [record for record in buffer if record.span is not None]
+        if not located:
+            break
+        # Fix the first reported line, the way a user would before compiling again
+        line = buffer.lines.line_col(located[0].span.start)[0]
+        fixed[line] = f'int e{line} = {line};\n'
+    one_at_a_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buffer = compile_errors(lines, max_errors=0)
+    recovering = time.perf_counter() - start
+    found = {buffer.lines.line_col(record.span.start)[0] for record in buffer if record.span is not None}
+    if found != set(broken):
+        print(f"Recovering compile reported lines {sorted(found)}, expected {sorted(broken)}")
+        return 1
+
+    print(f"{len(lines)} lines, {len(broken)} errors")
+    print(f"{'':16} {'compiles':>9} {'total (ms)':>11}")
+    print(f"{'first error':16} {compiles:>9} {one_at_a_time * 1000:>11.1f}")
+    print(f"{'recovering':16} {1:>9} {recovering * 1000:>11.1f}")
+    return 0
+
+
+#######################################
+# SYMBOLS
+#######################################
+
+
+def chain_lookup(scopes, name):
+    """Resolve `name` by walking the scope dicts from the innermost out."""
+    for scope in reversed(scopes):
+        if name in scope:
+            return scope[name]
+    return None
+
+
+def bench_symbols(args):
+    """Per lookup cost of walking the scope chain against symbols.SymbolTable at growing depths."""
+    import symbols
+
+    print(f"{'depth':>8} {'scope chain (ns)':>18} {'SymbolTable (ns)':>18}")
+    for depth in args.depths:
+        table = symbols.SymbolTable()
+        scopes = [{}]
+        for name in ('x', 'y', 'z'):
+            scopes[0][name] = table.declare(name, 'int')
+        for level in range(depth):
+            table.enter_scope()
+            scopes.append({})
+            scopes[-1][f'v{level}'] = table.declare(f'v{level}', 'int')
+        # Names declared in the global scope are the worst case for the chain
+        names = ['x', 'y', 'z'] * 100
+        if [chain_lookup(scopes, name) for name in names] != [table.lookup(name) for name in names]:
+            print("SymbolTable resolves differently from the scope chain")
+            return 1
+        chain_time = best_time(lambda: [chain_lookup(scopes, name) for name in names], args.repeat, 1)
+        table_time = best_time(lambda: [table.lookup(name) for name in names], args.repeat, 1)
+        print(f"{depth:>8} {chain_time / len(names) * 1e9:>18.1f} {table_time / len(names) * 1e9:>18.1f}")
+    return 0
+
+
+#######################################
+# DEPTH
+#######################################
+
+
+def deep_programs(depth):
+    """Programs nested `depth` levels deep, each past the default recursion limit."""
+    return {
+        'a + b + ... chain': 'int x = ' + ' + '.join(['1'] * depth) + ';',
+        'nested belief': 'int x = 1;' + 'belief (x > 0) {' * depth + 'int y = x;' + '}' * depth,
+        'nested chant': 'chant (int i = 0; i < 3; i + 1) {' * depth + 'preach("x");' + '}' * depth,
+    }
+
+
+def bench_depth(args):
+    """Time every pass over programs nested deeper than Python's recursion limit."""
+    import astarena
+    import holyparser
+    import lowering
+    import main
+    from wat_backend import WATBackend
+
+    stages = {
+        'parse': lambda tokens, program: holyparser.run('<bench>', tokens)[0],
+        'analyze': lambda tokens, program: main.SemanticAnalyzer().analyze(program),
+        'repr': lambda tokens, program: repr(program),
+        'arena': lambda tokens, program: astarena.ASTArena.from_program(program).to_program(),
+        'lalr inline': lambda tokens, program: main.parse_program('<bench>', tokens, 'lalr')[0],
+        'lalr + transform': lambda tokens, program: main.get_transformer().transform(main.parse_tokens(tokens)),
+        # Runs on the tree 'analyze' typed
+        'lower + ir wat': lambda tokens, program: WATBackend().generate(lowering.lower(program)),
+    }
+    print(f"depth {args.depth}, recursion limit {sys.getrecursionlimit()}")
+    print(f"{'program':20} " + ' '.join(f"{name + ' (ms)':>20}" for name in stages))
+    failed = False
+    for name, source in deep_programs(args.depth).items():
+        tokens, error = lexer.run_buffer('<bench>', source)
+        program = holyparser.run('<bench>', tokens)[0]
+        times = []
+        for stage in stages.values():
+            start = time.perf_counter()
+            try:
+                stage(tokens, program)
+                times.append(f"{(time.perf_counter() - start) * 1000:>20.1f}")
+            except RecursionError:
+                times.append(f"{'RecursionError':>20}")
+                failed = True
+        print(f"{name:20} " + ' '.join(times))
+    return 1 if failed else 0
+
+
+#######################################
+# TYPES
+#######################################
+
+
+def bench_types(args):
+    """Codegen time reading node.type against typing each operand again, on growing '+' chains."""
+    import diagnostics
+    import holyparser
+    import main
+    from visitor import handles
+    from wasm_generator import WATGenerator
+
+    class RetypingGenerator(WATGenerator):
+        # Types the left operand of every operator again, as codegen would without the type slot
+        @handles('BinaryExpression')
+        def handle_binary_expression(self, expr):
+            typer = main.SemanticAnalyzer(diagnostics.Diagnostics(quiet=True))
+            # A parameter, as in the function, so the binding it leaves on `a` is still a local
+            typer.symbols.enter_scope('function')
+            typer.symbols.declare('a', 'int')
+            typer.analyze(expr.left)
+            return (yield from WATGenerator.handle_binary_expression(self, expr))
+
+    print(f"{'operators':>10} {'node.type (ms)':>15} {'retyping (ms)':>14}")
+    failed = False
+    for length in args.lengths:
+        source = 'invoke int f(int a) { deliver ' + ' + '.join(['a'] * (length + 1)) + '; }'
+        tokens, error = lexer.run_buffer('<bench>', source)
+        program = holyparser.run('<bench>', tokens)[0]
+        main.SemanticAnalyzer(diagnostics.Diagnostics(quiet=True)).analyze(program)
+        expected = WATGenerator().generate_code(program)
+        times = []
+        for generator in (WATGenerator, RetypingGenerator):
+            start = time.perf_counter()
+            code = generator().generate_code(program)
+            times.append(time.perf_counter() - start)
+            failed = failed or code != expected
+        print(f"{length:>10} {times[0] * 1000:>15.1f} {times[1] * 1000:>14.1f}")
+    return 1 if failed else 0
+
+
+#######################################
+# FOLDING
+#######################################
+
+
+def constants_source(count):
+    """A program of eternal constants, each used by a function that computes with it and with literals."""
+    return ''.join(f'eternal int c{i} = {i} * 4 + 1;\n'
+                   f'invoke int f{i}(int a) {{ deliver a * c{i} + (c{i} - 1) * 2 + 60 / 4 - {i} % 7; }}\n'
+                   for i in range(count))
+
+
+def wat_instructions(code):
+    """Instructions in generated WAT, counted by their opening parenthesis."""
+    return len(re.findall(r'\((?:i32|f32|local|call|return)\b', code))
+
+
+def bench_fold(args):
+    """Instructions generated and compile time with and without optimizer.ConstantFolder.
+
+    The code is generated through the IR, without its passes, as the tree
+    generator cannot compile the global constants.
+    """
+    import diagnostics
+    import holyparser
+    import lowering
+    import main
+    import optimizer
+    from wat_backend import WATBackend
+
+    source = constants_source(args.functions)
+    print(f"{args.functions} functions")
+    print(f"{'':10} {'instructions':>13} {'fold (ms)':>10} {'codegen (ms)':>13}")
+    for name in ('-O0', '-O1'):
+        tokens, error = lexer.run_buffer('<bench>', source)
+        program = holyparser.run('<bench>', tokens)[0]
+        buffer = diagnostics.Diagnostics(quiet=True)
+        if main.SemanticAnalyzer(buffer).analyze(program) != "Code analyzed successfully":
+            print(buffer.render())
+            return 1
+        start = time.perf_counter()
+        if name == '-O1':
+            program = optimizer.optimize(program)
+        folded = time.perf_counter() - start
+        start = time.perf_counter()
+        code = WATBackend().generate(lowering.lower(program))
+        generated = time.perf_counter() - start
+        print(f"{name:10} {wat_instructions(code):>13} {folded * 1000:>10.1f} {generated * 1000:>13.1f}")
+    return 0
+
+
+#######################################
+# PARALLEL
+#######################################
+
+
+def functions_source(count, terms):
+    """A program of `count` functions, each delivering `terms` terms and a call of the one before it.
+
+    Only what the tree generator compiles, so the two ways of compiling can be compared.
+    """
+    body = ' + '.join(f'(a * {n} + b) * (b - {n})' for n in range(terms))
+    return ''.join(f'invoke int f{i}(int a, int b) {{\n    deliver {body} + f{i - 1}(a, b + {i});\n}}\n'
+                   if i else f'invoke int f0(int a, int b) {{\n    deliver {body} + a;\n}}\n'
+                   for i in range(count))
+
+
+def bench_parallel(args):
+    """Analysis, optimization and IR codegen time in process against parallel.compile_program() with growing worker counts."""
+    import diagnostics
+    import holyparser
+    import main
+    import optimizer
+    import parallel
+
+    source = functions_source(args.functions, args.terms)
+    tokens, error = lexer.run_buffer('<bench>', source)
+
+    def sequential(program):
+        buffer = diagnostics.Diagnostics('<bench>', tokens.lines)
+        result = main.SemanticAnalyzer(buffer).analyze(program)
+        program = optimizer.optimize(program)
+        return main.generate_from_ir(program, '<bench>', buffer), result, buffer.render()
+
+    def in_workers(program, workers):
+        buffer = diagnostics.Diagnostics('<bench>', tokens.lines)
+        code, result = parallel.compile_program(program, buffer, workers)
+        return code, result, buffer.render()
+
+    def timed(compile, *args):
+        # The passes rewrite the tree, so every compile gets a fresh one
+        program = holyparser.run('<bench>', tokens, tokens.lines)[0]
+        start = time.perf_counter()
+        output = compile(program, *args)
+        return output, time.perf_counter() - start
+
+    expected, baseline = timed(sequential)
+    if expected[1] != "Code analyzed successfully":
+        print(expected[2])
+        return 1
+    print(f"{args.functions} functions, {len(source)} characters, {os.cpu_count()} CPUs")
+    print(f"{'workers':10} {'total (ms)':>11} {'speedup':>8}")
+    print(f"{'in process':10} {baseline * 1000:>11.1f} {1:>7.2f}x")
+    failed = False
+    for workers in args.workers:
+        output, elapsed = timed(in_workers, workers)
+        same = '' if output == expected else '  output differs'
+        failed = failed or bool(same)
+        print(f"{workers:<10} {elapsed * 1000:>11.1f} {baseline / elapsed:>7.2f}x{same}")
+    return 1 if failed else 0
+
+
+#######################################
+# IR
+#######################################
+
+
+def bench_ir(args):
+    """Compile time and instructions generated from the tree and through the SSA IR, per program."""
+    import diagnostics
+    import holyparser
+    import ir
+    import lowering
+    import main
+    import optimizer
+    from wasm_generator import WATGenerator, UnsupportedError
+    from wat_backend import WATBackend
+
+    print(f"{'program':28} {'ast instr':>10} {'ast (ms)':>9} {'ir instr':>9} {'wat instr':>10} "
+          f"{'lower (ms)':>11} {'verify (ms)':>12} {'emit (ms)':>10}")
+    failed = False
+    for path in args.files or CORPUS:
+        tokens = load_tokens(path)
+        program = holyparser.run(path, tokens)[0]
+        buffer = diagnostics.Diagnostics(path, quiet=True)
+        if main.SemanticAnalyzer(buffer).analyze(program) != "Code analyzed successfully" or buffer.has_errors:
+            print(f"{path:28} does not compile")
+            continue
+        if args.optimize:
+            program = optimizer.optimize(program)
+        try:
+            ast_code = WATGenerator().generate_code(program)
+        except UnsupportedError:
+            ast_code = None  # The tree generator cannot compile it yet
+        else:
+            ast_time = best_time(lambda: WATGenerator().generate_code(program), args.repeat, args.number)
+        module = lowering.lower(program)
+        problems = ir.verify_module(module)
+        for problem in problems:
+            print(f"{path}: {problem}")
+        failed = failed or bool(problems)
+        code = WATBackend().generate(module)
+        lower_time = best_time(lambda: lowering.lower(program), args.repeat, args.number)
+        verify_time = best_time(lambda: ir.verify_module(module), args.repeat, args.number)
+        emit_time = best_time(lambda: WATBackend().generate(module), args.repeat, args.number)
+        instructions = sum(len(block.phis) + len(block.instructions) + 1
+                           for function in module.all_functions() for block in function.blocks)
+        ast_columns = (f"{'-':>10} {'-':>9}" if ast_code is None
+                       else f"{wat_instructions(ast_code):>10} {ast_time * 1000:>9.2f}")
+        print(f"{path:28} {ast_columns} {instructions:>9} "
+              f"{wat_instructions(code):>10} {lower_time * 1000:>11.2f} {verify_time * 1000:>12.2f} "
+              f"{emit_time * 1000:>10.2f}")
+    return 1 if failed else 0
+
+
+#######################################
+# IR PASSES
+#######################################
+
+
+def workloads(seed=7):
+    """Calls each A7 program is measured on: (function, args, {address: array}), with arrays as the tests lay them out."""
+    import random
+    rng = random.Random(seed)
+    return {
+        'sort.holy': [('sort', [0, 300], {0: [rng.randint(1, 100) for _ in range(300)]})],
+        'caesar.holy': [('caesarEncrypt', [0, 2000, 3], {0: [rng.randint(0, 25) for _ in range(2000)]}),
+                        ('caesarDecrypt', [0, 2000, 3], {})],
+        'arithmetic.holy': [(name, [x, y], {}) for name in ('add', 'sub', 'mul', 'div', 'rem')
+                            for x in range(-20, 21) for y in (-7, 0, 3, 5) if y or name != 'rem'],
+    }
+
+
+class IRMachine:
+    """Run the functions of an ir.Module, counting the instructions executed.
+
+    Phis are left out of the count: the back-end turns them into copies on
+    the edges into their block, which mostly fold into the code before them.
+    """
+
+    def __init__(self, module):
+        self.functions = {function.name: function for function in module.all_functions()}
+        self.globals = dict.fromkeys(module.globals, 0)
+        self.memory = bytearray(65536)
+        self.logged = []
+        self.executed = 0
+        if module.start.blocks:
+            self.call(module.start.name, [])
+
+    def call(self, name, params):
+        import struct
+        function = self.functions.get(name)
+        if function is None:
+            self.logged.append(params[0])  # An import
+            return None
+        values = {}
+        block, previous = function.entry, None
+        while True:
+            if previous is not None:
+                edge = block.preds.index(previous)
+                incoming = [values[phi.args[edge]] for phi in block.phis]
+                values.update(zip(block.phis, incoming))
+            self.executed += len(block.instructions) + 1
+            for instruction in block.instructions:
+                op, attr = instruction.op, instruction.attr
+                args = [values[arg] for arg in instruction.args]
+                if op == 'const':
+                    result = attr
+                elif op == 'param':
+                    result = params[attr]
+                elif op == 'global.get':
+                    result = self.globals[attr]
+                elif op == 'global.set':
+                    self.globals[attr] = args[0]
+                    continue
+                elif op == 'call':
+                    result = self.call(attr, args)
+                elif op == 'load':
+                    result = struct.unpack_from('<i' if instruction.type == 'i32' else '<f', self.memory, args[0])[0]
+                elif op == 'store':
+                    struct.pack_into('<i' if instruction.args[1].type == 'i32' else '<f', self.memory, *args)
+                    continue
+                else:
+                    result = self.binary(op, *args)
+                values[instruction] = result
+            terminator = block.terminator
+            if terminator.op == 'return':
+                return values[terminator.args[0]] if terminator.args else None
+            if terminator.op == 'unreachable':
+                raise RuntimeError(f"{name} reached unreachable code")
+            previous = block
+            if terminator.op == 'jump':
+                block = terminator.attr[0]
+            else:
+                block = terminator.attr[0 if values[terminator.args[0]] else 1]
+
+    @staticmethod
+    def binary(op, a, b):
+        import ir
+        import optimizer
+        name = op.split('.')[1]
+        if op in ir.COMPARISONS:
+            comparison = {'eq': '==', 'ne': '!=', 'lt': '<', 'gt': '>', 'le': '<=', 'ge': '>='}[name.split('_')[0]]
+            return int(optimizer.COMPARISONS[comparison](a, b))
+        if name in ('and', 'or', 'shl'):
+            return optimizer.wrap_i32(a & b if name == 'and' else a | b if name == 'or' else a << (b & 31))
+        operator = {'add': '+', 'sub': '-', 'mul': '*', 'div_s': '/', 'rem_s': '%', 'div': '/'}[name]
+        if op.startswith('f32'):
+            result = optimizer.fold_float(operator, a, b)
+            if result is None:  # Division by zero
+                return math.nan if a == 0 or a != a else math.copysign(math.inf, a) * math.copysign(1, b)
+            return result
+        result = optimizer.fold_int(operator, a, b)
+        if result is None:
+            raise ZeroDivisionError(f"{op} {a} {b} traps")
+        return result
+
+
+def run_workload(module, calls):
+    """Run `calls` on a fresh IRMachine; returns (instructions executed, what the calls observably did)."""
+    import struct
+    machine = IRMachine(module)
+    results = []
+    for name, params, arrays in calls:
+        for address, values in arrays.items():
+            struct.pack_into(f'<{len(values)}i', machine.memory, address, *values)
+        try:
+            results.append(machine.call(name, params))
+        except ZeroDivisionError:
+            results.append('trap')
+    return machine.executed, (results, machine.logged, machine.globals, bytes(machine.memory))
+
+
+def bench_passes(args):
+    """Code size and instructions executed on the A7 workloads after each pass of ir_optimizer.py."""
+    import diagnostics
+    import holyparser
+    import ir
+    import ir_optimizer
+    import lowering
+    import main
+    import optimizer
+    from wat_backend import WATBackend
+
+    calls = workloads()
+    print(f"{'program':28} {'after':8} {'ir instr':>9} {'wat instr':>10} {'executed':>10} {'pass (ms)':>10}")
+    failed = False
+    for path in args.files or sorted(glob.glob('A7_testcases/*.holy')):
+        tokens = load_tokens(path)
+        program = holyparser.run(path, tokens)[0]
+        buffer = diagnostics.Diagnostics(path, quiet=True)
+        if main.SemanticAnalyzer(buffer).analyze(program) != "Code analyzed successfully" or buffer.has_errors:
+            print(f"{path:28} does not compile")
+            continue
+        program = optimizer.optimize(program)
+        workload = calls.get(os.path.basename(path), [])
+        module = lowering.lower(program)
+        expected = None
+        # Each pass runs on what the passes before it left
+        for name, ir_pass in [('lowering', None)] + ir_optimizer.PASSES:
+            start = time.perf_counter()
+            if ir_pass is not None:
+                for function in module.all_functions():
+                    ir_pass(function).run()
+            elapsed = time.perf_counter() - start
+            problems = ir.verify_module(module)
+            for problem in problems:
+                print(f"{path}: after {name}: {problem}")
+            instructions = sum(len(block.phis) + len(block.instructions) + 1
+                               for function in module.all_functions() for block in function.blocks)
+            executed, observed = run_workload(module, workload)
+            if expected is None:
+                expected = observed
+            same = '' if observed == expected else '  results differ'
+            failed = failed or bool(problems or same)
+            print(f"{path:28} {name:8} {instructions:>9} {wat_instructions(WATBackend().generate(module)):>10} "
+                  f"{executed:>10} {elapsed * 1000:>10.2f}{same}")
+    return 1 if failed else 0
+
+
+#######################################
+# WASMTIME
+#######################################
+
+# Functions whose -O1 code reuses a load or moves one out of a loop, run
+# beside the A7 test cases: swap() forwards the stores of sort's swap to
+# the loads after them, and overwrite() must not, as i and k may be equal.
+# accumulate() and count() load arr[0] in the header of a loop that
+# stores, which moves in front of the loop only where nothing in it may
+# write arr[0], and accumulate() also loads arr[k], which k == 1 aliases.
+MEMORY_SOURCE = """
+    invoke int swap(int[] arr, int j) {
+        int temp = arr[j];
+        arr[j] = arr[j + 1];
+        arr[j + 1] = temp;
+        deliver arr[j] - arr[j + 1];
+    }
+
+    invoke int overwrite(int[] arr, int i, int k) {
+        arr[i] = 5;
+        arr[k] = 7;
+        deliver arr[i];
+    }
+
+    invoke int accumulate(int[] arr, int n, int k) {
+        pledge (arr[0] < n) {
+            arr[1] = arr[1] + arr[0];
+            arr[2] = arr[2] + arr[k];
+            n = n - 1;
+        }
+        deliver arr[1] + arr[2];
+    }
+
+    invoke int count(int[] arr, int n) {
+        pledge (arr[0] < n) {
+            arr[0] = arr[0] + 1;
+        }
+        deliver arr[0];
+    }
+"""
+
+MEMORY_CALLS = ([('swap', [0, j], {0: [9, 4, 7, 1, 8, 2]}) for j in range(5)]
+                + [('overwrite', [0, i, k], {}) for i, k in ((1, 1), (1, 2), (3, 3))]
+                + [('accumulate', [0, 12, k], {0: [2, 1, 1, 1]}) for k in range(4)]
+                + [('count', [0, 9], {0: [3]})])
+
+# Instructions wasmtime runs the calls of one program for, far more than the workloads need
+WASM_FUEL = 100_000_000
+
+
+def run_wasm(wat, calls):
+    """Instantiate `wat` in wasmtime and make `calls` like run_workload() does.
+
+    Returns (seconds the calls took, what they observably did), where every
+    import only records its name and arguments. The calls trap once they
+    have run WASM_FUEL instructions, so a loop the optimizer broke fails
+    the check rather than hanging it.
+    """
+    import struct
+    import wasmtime
+    config = wasmtime.Config()
+    config.consume_fuel = True
+    engine = wasmtime.Engine(config)
+    store = wasmtime.Store(engine)
+    store.set_fuel(WASM_FUEL)
+    module = wasmtime.Module(engine, wat)
+    linker = wasmtime.Linker(engine)
+    logged = []
+    for imported in module.imports:
+        linker.define_func(imported.module, imported.name, imported.type,
+                           lambda *args, name=imported.name: logged.append((name, args)))
+    exports = linker.instantiate(store, module).exports(store)
+    memory = exports.get('memory')
+    results = []
+    start = time.perf_counter()
+    for name, params, arrays in calls:
+        for address, values in arrays.items():
+            memory.write(store, struct.pack(f'<{len(values)}i', *values), address)
+        try:
+            results.append(exports[name](store, *params))
+        except wasmtime.Trap:
+            results.append('trap')
+    elapsed = time.perf_counter() - start
+    return elapsed, (results, logged, bytes(memory.read(store)) if memory is not None else b'')
+
+
+def bench_wasm(args):
+    """Run the A7 workloads compiled at -O0 and at -O1 in wasmtime, checking that they do the same."""
+    try:
+        import wasmtime  # noqa: F401
+    except ImportError:
+        print("wasmtime is not installed; pip install wasmtime")
+        return 1
+    import diagnostics
+    import holyparser
+    import main
+    import optimizer
+
+    def compile(name, tokens, optimize):
+        program = holyparser.run(name, tokens)[0]
+        buffer = diagnostics.Diagnostics(name, quiet=True)
+        if main.SemanticAnalyzer(buffer).analyze(program) != "Code analyzed successfully" or buffer.has_errors:
+            return None
+        if optimize:
+            program = optimizer.optimize(program)
+        return main.generate_from_ir(program, name, buffer, optimize)
+
+    calls = workloads()
+    programs = [(path, load_tokens(path), calls.get(os.path.basename(path), []))
+                for path in args.files or sorted(glob.glob('A7_testcases/*.holy'))]
+    if not args.files:
+        programs.append(('<memory>', lexer.run_buffer('<memory>', MEMORY_SOURCE)[0], MEMORY_CALLS))
+    print(f"{'program':28} {'-O0 instr':>10} {'-O1 instr':>10} {'-O0 (ms)':>9} {'-O1 (ms)':>9} {'speedup':>8}")
+    failed = False
+    for name, tokens, workload in programs:
+        unoptimized, optimized = compile(name, tokens, False), compile(name, tokens, True)
+        if unoptimized is None or optimized is None:
+            print(f"{name:28} does not compile")
+            failed = True
+            continue
+        # Each run gets a fresh instance, as the calls write to memory
+        before, expected = min((run_wasm(unoptimized, workload) for _ in range(args.repeat)), key=lambda run: run[0])
+        after, observed = min((run_wasm(optimized, workload) for _ in range(args.repeat)), key=lambda run: run[0])
+        same = '' if observed == expected else '  results differ'
+        failed = failed or bool(same)
+        print(f"{name:28} {wat_instructions(unoptimized):>10} {wat_instructions(optimized):>10} "
+              f"{before * 1000:>9.2f} {after * 1000:>9.2f} {before / after:>7.2f}x{same}")
+    return 1 if failed else 0
+
+
+#######################################
+# STARTUP
+#######################################
+
+# Modules that only a pipeline stage may load; importing main must not pull them in
+LAZY_MODULES = ['lark', 'anytree', 'asttransformer', 'holyparser', 'wasm_generator', 'ir', 'lowering',
+                'ir_optimizer', 'wat_backend', 'subprocess']
+
+
+def import_times(statement):
+    """Run `statement` under `python -X importtime`, returning {module: (self_us, cumulative_us)}."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit():
+            continue  # the column header
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def bench_startup(args):
+    """Measure the import time of main with -X importtime and check that heavy stages stay lazy."""
+    runs = [import_times('import main') for _ in range(args.repeat)]
+    times = min(runs, key=lambda run: run['main'][1])
+    total_ms = times['main'][1] / 1000
+    print(f"import main: {total_ms:8.2f} ms cumulative, {len(times)} modules")
+    print(f"{'module':32} {'self (ms)':>10} {'cumulative (ms)':>16}")
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{name:32} {self_us / 1000:>10.2f} {cumulative_us / 1000:>16.2f}")
+
+    help_time = best_time(lambda: subprocess.run([sys.executable, 'main.py', '--help'],
+                                                 capture_output=True, check=True), args.repeat, 1)
+    print(f"main.py --help: {help_time * 1000:8.2f} ms wall")
+
+    failed = False
+    loaded = [name for name in LAZY_MODULES if name in times]
+    if loaded:
+        print(f"loaded at startup but should be lazy: {', '.join(loaded)}")
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"import main exceeds the {args.budget_ms} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="HolyScript compiler benchmarks.")
+    subparsers = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help="compare the Lark parsers with the native parser")
+    parse_parser.add_argument('files', nargs='*', help="programs to parse (default: the test corpus)")
+    parse_parser.add_argument('--repeat', type=int, default=5)
+    parse_parser.add_argument('--number', type=int, default=20)
+    parse_parser.set_defaults(run=bench_parse)
+
+    lex_parser = subparsers.add_parser('lex', help="compare the per-character lexer with the regex lexer")
+    lex_parser.add_argument('files', nargs='*', help="programs to lex (default: the test corpus)")
+    lex_parser.add_argument('--size', type=int, default=1_000_000, help="approximate source size in characters")
+    lex_parser.add_argument('--repeat', type=int, default=3)
+    lex_parser.set_defaults(run=bench_lex)
+
+    tokens_parser = subparsers.add_parser('tokens', help="compare token list and TokenBuffer memory")
+    tokens_parser.add_argument('files', nargs='*', help="programs to lex (default: the test corpus)")
+    tokens_parser.add_argument('--size', type=int, default=1_000_000, help="approximate source size in characters")
+    tokens_parser.set_defaults(run=bench_tokens)
+
+    stream_parser = subparsers.add_parser('stream', help="compare peak memory of reading a file with streaming it")
+    stream_parser.add_argument('files', nargs='*', help="programs to repeat into the file (default: the test corpus)")
+    stream_parser.add_argument('--size', type=int, default=20_000_000, help="approximate file size in characters")
+    stream_parser.set_defaults(run=bench_stream)
+
+    incremental_parser = subparsers.add_parser('incremental', help="compare a full re-parse with an incremental edit")
+    incremental_parser.add_argument('files', nargs='*', help="programs to repeat into the source (default: the test corpus)")
+    incremental_parser.add_argument('--size', type=int, default=1_000_000, help="approximate source size in characters")
+    incremental_parser.add_argument('--repeat', type=int, default=3)
+    incremental_parser.set_defaults(run=bench_incremental)
+
+    ast_parser = subparsers.add_parser('ast', help="compare AST memory with __slots__, __dict__ and an ASTArena")
+    ast_parser.add_argument('files', nargs='*', help="programs to repeat into the source (default: the test corpus)")
+    ast_parser.add_argument('--size', type=int, default=1_000_000, help="approximate source size in characters")
+    ast_parser.set_defaults(run=bench_ast)
+
+    dispatch_parser = subparsers.add_parser('dispatch', help="compare name-compare dispatch with the Visitor")
+    dispatch_parser.add_argument('files', nargs='*', help="programs to repeat into the source (default: the test corpus)")
+    dispatch_parser.add_argument('--size', type=int, default=1_000_000, help="approximate source size in characters")
+    dispatch_parser.add_argument('--repeat', type=int, default=3)
+    dispatch_parser.set_defaults(run=bench_dispatch)
+
+    diagnostics_parser = subparsers.add_parser('diagnostics', help="compare printed, batched and quiet analyzer output")
+    diagnostics_parser.add_argument('--statements', type=int, default=5000, help="declaration groups in the program")
+    diagnostics_parser.add_argument('--repeat', type=int, default=3)
+    diagnostics_parser.set_defaults(run=bench_diagnostics)
+
+    recovery_parser = subparsers.add_parser('recovery', help="compare fixing errors one compile at a time with one recovering compile")
+    recovery_parser.add_argument('--statements', type=int, default=2000, help="declaration groups in the program")
+    recovery_parser.add_argument('--errors', type=int, default=30, help="lines to break")
+    recovery_parser.set_defaults(run=bench_recovery)
+
+    symbols_parser = subparsers.add_parser('symbols', help="compare scope chain lookups with the SymbolTable index")
+    symbols_parser.add_argument('--depths', type=int, nargs='+', default=[1, 10, 100, 1000], help="scope nesting depths")
+    symbols_parser.add_argument('--repeat', type=int, default=20)
+    symbols_parser.set_defaults(run=bench_symbols)
+
+    depth_parser = subparsers.add_parser('depth', help="run every pass on programs nested past the recursion limit")
+    depth_parser.add_argument('--depth', type=int, default=2000, help="nesting depth and chain length")
+    depth_parser.set_defaults(run=bench_depth)
+
+    types_parser = subparsers.add_parser('types', help="compare reading expression types with typing them again")
+    types_parser.add_argument('--lengths', type=int, nargs='+', default=[100, 500, 2000], help="operators per chain")
+    types_parser.set_defaults(run=bench_types)
+
+    fold_parser = subparsers.add_parser('fold', help="compare generated code with and without constant folding")
+    fold_parser.add_argument('--functions', type=int, default=2000, help="constants and functions in the program")
+    fold_parser.set_defaults(run=bench_fold)
+
+    parallel_parser = subparsers.add_parser('parallel', help="compare in-process analysis and codegen with worker processes")
+    parallel_parser.add_argument('--functions', type=int, default=400, help="functions in the program")
+    parallel_parser.add_argument('--terms', type=int, default=80, help="terms in the expression each function delivers")
+    parallel_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                                 help="worker process counts to try")
+    parallel_parser.set_defaults(run=bench_parallel)
+
+    ir_parser = subparsers.add_parser('ir', help="compare code generated from the tree and through the SSA IR")
+    ir_parser.add_argument('files', nargs='*', help="programs to compile (default: the test corpus)")
+    ir_parser.add_argument('-O', '--optimize', type=int, choices=[0, 1], default=1, metavar='LEVEL',
+                           help="run optimizer.py on the tree first (default: 1)")
+    ir_parser.add_argument('--repeat', type=int, default=5)
+    ir_parser.add_argument('--number', type=int, default=20)
+    ir_parser.set_defaults(run=bench_ir)
+
+    passes_parser = subparsers.add_parser('passes', help="measure each IR pass on the A7 workloads")
+    passes_parser.add_argument('files', nargs='*', help="programs to compile (default: the A7 test cases)")
+    passes_parser.set_defaults(run=bench_passes)
+
+    wasm_parser = subparsers.add_parser('wasm', help="check the A7 workloads do the same at -O0 and -O1 in wasmtime")
+    wasm_parser.add_argument('files', nargs='*', help="programs to compile (default: the A7 test cases and loads to forward and hoist)")
+    wasm_parser.add_argument('--repeat', type=int, default=3)
+    wasm_parser.set_defaults(run=bench_wasm)
+
+    startup_parser = subparsers.add_parser('startup', help="measure import time of the compiler entry point")
+    startup_parser.add_argument('--repeat', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=10, help="number of slowest modules to list")
+    startup_parser.add_argument('--budget-ms', type=float, help="fail when importing main takes longer")
+    startup_parser.set_defaults(run=bench_startup)
+
+    args = arg_parser.parse_args()
+    sys.exit(args.run(args))
@@ -0,0 +1,184 @@
+import json
+import sys
+
+# Passes report what they find to a Diagnostics buffer instead of printing it.
+# Records stay in memory until the driver renders them all at once, as text or
+# JSON; in quiet mode notes, the messages of passes that succeed, are dropped
+# as they are reported, so a clean compile writes nothing at all.
+#
+# The lexer, parser and analyzer recover from errors and keep going, so one
+# run reports every error. `max_errors` caps how many: the next error after
+# the cap raises TooManyErrors, which ends the compile.
+
+#######################################
+# CONSTANTS
+#######################################
+
+ERROR = 'error'
+WARNING = 'warning'
+NOTE = 'note'
+
+FORMATS = ('text', 'json')
+
+# Errors reported before a compile gives up, unless the driver picks a cap
+MAX_ERRORS = 20
+
+#######################################
+# DIAGNOSTICS
+#######################################
+
+
+class TooManyErrors(Exception):
+    """Raised by Diagnostics once `max_errors` errors have been reported."""
+
+
+class Span:
+    """Source offsets [start, end) in file `fn`; LineIndex turns them into lines when rendered."""
+    __slots__ = ('fn', 'start', 'end')
+
+    def __init__(self, fn, start, end=None):
+        self.fn = fn
+        self.start = start
+        self.end = start if end is None else end
+
+    def __repr__(self):
+        return f"Span({self.fn!r}, {self.start}, {self.end})"
+
+
+class Diagnostic:
+    __slots__ = ('severity', 'code', 'span', 'message')
+
+    def __init__(self, severity, code, span, message):
+        self.severity = severity
+        self.code = code
+        self.span = span
+        self.message = message
+
+    def __repr__(self):
+        return f"Diagnostic({self.severity!r}, {self.code!r}, {self.span!r}, {self.message!r})"
+
+
+class Diagnostics:
+    def __init__(self, fn='<stdin>', lines=None, quiet=False, max_errors=None):
+        self.fn = fn
+        # LineIndex of the source the spans point into, or None to show offsets
+        self.lines = lines
+        self.quiet = quiet
+        # 0 or None reports every error
+        self.max_errors = max_errors
+        self.records = []
+        self.error_count = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def has_errors(self):
+        return self.error_count > 0
+
+    def span(self, node):
+        """The Span of an AST node, or None when the parser gave it no offset."""
+        offset = getattr(node, 'offset', None)
+        return None if offset is None else Span(self.fn, offset)
+
+    def report(self, severity, code, message, node=None):
+        if severity == NOTE and self.quiet:
+            return None
+        if severity == ERROR:
+            self.count_error()
+        diagnostic = Diagnostic(severity, code, self.span(node), message)
+        self.records.append(diagnostic)
+        return diagnostic
+
+    def error(self, code, message, node=None):
+        return self.report(ERROR, code, message, node)
+
+    def warning(self, code, message, node=None):
+        return self.report(WARNING, code, message, node)
+
+    def note(self, code, message, node=None):
+        return self.report(NOTE, code, message, node)
+
+    def add_error(self, error):
+        """Record a lexer.Error, such as an IllegalCharError or a holyparser.InvalidSyntaxError."""
+        code = error.error_name.lower().replace(' ', '-')
+        span = None
+        if error.pos_start is not None:
+            end = error.pos_end.idx if error.pos_end is not None else None
+            span = Span(error.pos_start.fn, error.pos_start.idx, end)
+            if self.lines is None:
+                self.lines = error.pos_start.lines
+        details = error.details
+        if span is None and getattr(error, 'token_idx', -1) >= 0:
+            # Tokens packed from a plain list have no source offsets
+            details = f"{details} (token {error.token_idx + 1})"
+        self.count_error()
+        diagnostic = Diagnostic(ERROR, code, span, details)
+        self.records.append(diagnostic)
+        return diagnostic
+
+    def merge(self, records):
+        """Add the records another buffer collected, such as a worker process's, counting their errors."""
+        for diagnostic in records:
+            if diagnostic.severity == ERROR:
+                self.count_error()
+            self.records.append(diagnostic)
+
+    def count_error(self):
+        if self.max_errors and self.error_count >= self.max_errors:
+            self.records.append(Diagnostic(ERROR, 'too-many-errors', None,
+                                           f"Stopping after {self.error_count} errors"))
+            raise TooManyErrors(self.error_count)
+        self.error_count += 1
+
+    #######################################
+    # RENDERING
+    #######################################
+
+    def location(self, span):
+        """(line, column) of a span, both counted from 1, or None when no source is known."""
+        if span is None or self.lines is None:
+            return None
+        ln, col = self.lines.line_col(span.start)
+        return ln + 1, col + 1
+
+    def render_text(self):
+        out = []
+        for diagnostic in self.records:
+            span = diagnostic.span
+            location = self.location(span)
+            if location is not None:
+                prefix = f"{span.fn}:{location[0]}:{location[1]}: "
+            elif span is not None:
+                prefix = f"{span.fn}: "
+            else:
+                prefix = ''
+            out.append(f"{prefix}{diagnostic.severity}[{diagnostic.code}]: {diagnostic.message}")
+        return '\n'.join(out)
+
+    def render_json(self):
+        out = []
+        for diagnostic in self.records:
+            span = diagnostic.span
+            record = {'severity': diagnostic.severity, 'code': diagnostic.code, 'message': diagnostic.message}
+            if span is not None:
+                record.update(file=span.fn, start=span.start, end=span.end)
+                location = self.location(span)
+                if location is not None:
+                    record.update(line=location[0], column=location[1])
+            out.append(record)
+        return json.dumps(out, indent=2)
+
+    def render(self, format='text'):
+        if format == 'json':
+            return self.render_json()
+        return self.render_text()
+
+    def flush(self, format='text', file=None):
+        """Write every record in one go and empty the buffer."""
+        if self.records or format == 'json':
+            print(self.render(format), file=sys.stdout if file is None else file)
+        self.records.clear()
@@ -0,0 +1,49 @@
+import sys
+from lark import Lark
+from lark.common import ParserConf
+from lark.parsers.lalr_analysis import LALR_Analyzer
+from lark_lexer import TokenStreamLexer
+
+# Lark stops at the first reduce/reduce collision and silently resolves
+# shift/reduce conflicts as shifts. This report runs the same LALR(1) analysis
+# but lists every conflict, so the grammar can be kept conflict-free.
+
+
+def find_conflicts(grammar, start='start'):
+    """Return a list of (kind, terminal, rules) for every LALR(1) conflict."""
+    # Earley does no table construction, so this only compiles the rules
+    compiled = Lark(grammar, start=start, parser='earley', lexer=TokenStreamLexer)
+    analyzer = LALR_Analyzer(ParserConf(compiled.rules, {}, [start]))
+    analyzer.compute_lr0_states()
+    analyzer.compute_reads_relations()
+    analyzer.compute_includes_lookback()
+    analyzer.compute_lookaheads()
+
+    conflicts = []
+    for itemset in analyzer.lr0_itemsets:
+        for lookahead, rules in itemset.lookaheads.items():
+            if len(rules) > 1:
+                conflicts.append(('Reduce/Reduce', lookahead.name, sorted(map(str, rules))))
+            elif lookahead in itemset.transitions:
+                conflicts.append(('Shift/Reduce', lookahead.name, sorted(map(str, rules))))
+    return conflicts
+
+
+def print_report(conflicts):
+    if not conflicts:
+        print("No LALR(1) conflicts found.")
+        return
+    for kind, terminal, rules in conflicts:
+        print(f"{kind} conflict on {terminal}:")
+        for rule in rules:
+            print(f"    {rule}")
+    print(f"{len(conflicts)} LALR(1) conflict(s) found.")
+
+
+if __name__ == "__main__":
+    grammar_path = sys.argv[1] if len(sys.argv) > 1 else 'mygrammar.lark'
+    with open(grammar_path) as file:
+        grammar = file.read()
+    conflicts = find_conflicts(grammar)
+    print_report(conflicts)
+    sys.exit(1 if conflicts else 0)
@@ -0,0 +1,520 @@
+from types import GeneratorType
+import lexer
+from lexer import (TokenBuffer, INT_KIND, FLOAT_KIND, BOOL_KIND, END_OF_STATEMENT_KIND, KEYWORD_KIND,
+                   IDENTIFIER_KIND, OPERATOR_KIND, SYMBOL_KIND, STRING_KIND, TYPE_KEYWORD_KIND,
+                   UTILITY_KIND, CHAR_KIND)
+from astclasses import (Program, CompoundStatement, ErrorStatement, VariableDeclaration, DeclarationSpecifier,
+                        TypeSpecifier, TupleDeclaration, ListDeclaration, ArrayDeclaration,
+                        IfStatement, ForLoop, WhileLoop, DoWhileLoop, JumpStatement, PreachStatement,
+                        FunctionDefinition, FunctionCall, BinaryExpression, UnaryExpression,
+                        MemberAccessExpression, BuiltinFunction, Identifier, IntegerLiteral,
+                        FloatLiteral, StringLiteral, CharLiteral, BoolLiteral)
+
+#######################################
+# CONSTANTS
+#######################################
+
+# Binding power of each binary operator, from loosest to tightest. This is the
+# expression chain of mygrammar.lark, from logical_or_expression down to
+# multiplicative_expression.
+BINARY_PRECEDENCE = {
+    '||': 1,
+    '&&': 2,
+    '&': 3,
+    '==': 4, '!=': 4,
+    '<': 5, '>': 5, '<=': 5, '>=': 5,
+    '+': 6, '-': 6,
+    '*': 7, '/': 7, '%': 7,
+}
+
+ASSIGNMENT_OPERATORS = {'=', '*=', '/=', '%=', '+=', '-='}
+POSTFIX_OPERATORS = {'++', '--'}
+DECLARATION_TYPES = {'void', 'char', 'int', 'float', 'bool', 'str'}
+
+LITERAL_NODES = {
+    INT_KIND: IntegerLiteral,
+    FLOAT_KIND: FloatLiteral,
+    BOOL_KIND: BoolLiteral,
+    STRING_KIND: StringLiteral,
+    CHAR_KIND: CharLiteral,
+}
+
+#######################################
+# ERRORS
+#######################################
+
+
+class InvalidSyntaxError(lexer.Error):
+    def __init__(self, fn, token_idx, details, pos_start=None, pos_end=None):
+        self.fn = fn
+        self.token_idx = token_idx
+        super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
+
+    def as_string(self):
+        if self.pos_start is not None:
+            return super().as_string()
+        # Tokens packed from a plain list have no source offsets, so point at the token index
+        result = f'{self.error_name}: {self.details}\n'
+        result += f'File {self.fn}, token {self.token_idx + 1}'
+        return result
+
+
+class ParseError(Exception):
+    def __init__(self, error):
+        super().__init__(error.details)
+        self.error = error
+
+
+#######################################
+# PARSER
+#######################################
+
+
+class Parser:
+    """Recursive-descent parser that builds astclasses nodes from lexer tokens.
+
+    Statements follow mygrammar.lark rule for rule; binary expressions are
+    parsed by precedence climbing over BINARY_PRECEDENCE. Tokens are read one
+    at a time as (kind, start, end, value) entries, from a lexer.TokenBuffer
+    or straight from RegexLexer.iter_tokens(), so no token object is built
+    unless an error has to show one.
+
+    Without a `report` callback the first syntax error raises ParseError.
+    With one, each error is passed to it, the tokens up to the end of the
+    broken statement are skipped and an ErrorStatement takes its place.
+    """
+
+    def __init__(self, fn, tokens, lines=None, report=None):
+        if isinstance(tokens, list):
+            tokens = TokenBuffer.from_tokens(fn, tokens)
+        if isinstance(tokens, TokenBuffer):
+            lines = tokens.lines
+            tokens = tokens.entries()
+        self.fn = fn
+        self.entries = iter(tokens)
+        self.lines = lines
+        self.report = report
+        # Token index of the last error reported, so one spot is reported once
+        self.error_idx = -1
+        self.idx = -1
+        # The current token; kind is None at the end of the input
+        self.kind = None
+        self.value = None
+        self.start = self.end = 0
+        self.advance()
+
+    def advance(self):
+        self.idx += 1
+        entry = next(self.entries, None)
+        if entry is not None:
+            self.kind, self.start, self.end, self.value = entry
+        else:
+            self.kind = self.value = None
+            self.start = self.end
+
+    def error(self, expected):
+        found = repr(lexer.TOKEN_KINDS[self.kind](self.value)) if self.kind is not None else 'end of input'
+        pos_start = pos_end = None
+        if self.lines is not None:
+            pos_start = lexer.Position(self.start, self.fn, self.lines)
+            pos_end = lexer.Position(self.end, self.fn, self.lines)
+        raise ParseError(InvalidSyntaxError(self.fn, self.idx, f"Expected {expected}, found {found}",
+                                            pos_start, pos_end))
+
+    def at(self, kind, value):
+        return self.kind == kind and self.value == value
+
+    def expect(self, kind, value):
+        if not self.at(kind, value):
+            self.error(f"'{value}'")
+        self.advance()
+
+    def parse(self):
+        return Program(list(self.iter_statements()))
+
+    def iter_statements(self):
+        """Yield each top-level statement as soon as it is parsed."""
+        while self.kind is not None:
+            yield self.statement()
+
+    #######################################
+    # STATEMENTS
+    #######################################
+
+    def statement(self):
+        """Parse one statement, including the statements nested in it.
+
+        Compound statements, branches and loop bodies are generators that
+        yield each time they need a nested statement parsed at the current
+        token, and get it back from the yield. This loop keeps them on an
+        explicit stack, so nesting depth is not limited by Python's
+        recursion limit.
+        """
+        frames = []  # (generator, offset) of the statements waiting for a nested one
+        while True:
+            offset = self.start
+            try:
+                node = self.statement_node()
+            except ParseError as e:
+                node = self.recover(e, frames)
+            if type(node) is GeneratorType:
+                frames.append((node, offset))
+                node = None
+            else:
+                node.offset = offset
+            # Hand the finished statement to the one waiting for it, until one
+            # needs another nested statement
+            while frames:
+                generator, offset = frames[-1]
+                try:
+                    generator.send(node)
+                    break
+                except StopIteration as stop:
+                    frames.pop()
+                    node = stop.value
+                    node.offset = offset
+                except ParseError as e:
+                    # The statement that was waiting is broken itself
+                    frames.pop()
+                    node = self.recover(e, frames)
+                    node.offset = offset
+            else:
+                return node
+
+    def recover(self, e, frames):
+        """Report a syntax error and skip the rest of the broken statement, returning an ErrorStatement."""
+        if self.report is None:
+            raise e
+        error = e.error
+        if error.token_idx != self.error_idx:
+            self.report(error)
+            self.error_idx = error.token_idx
+        self.synchronize(nested=bool(frames))
+        return ErrorStatement()
+
+    def synchronize(self, nested):
+        """Skip tokens up to and including the ';' ending a statement, or the '}' closing a block opened on the way.
+
+        A '}' that closes an enclosing block is left for that block to end on;
+        at the top level there is none, so it is skipped too.
+        """
+        depth = 0
+        while self.kind is not None:
+            if self.kind == END_OF_STATEMENT_KIND and depth == 0:
+                self.advance()
+                return
+            if self.kind == SYMBOL_KIND:
+                if self.value == '{':
+                    depth += 1
+                elif self.value == '}':
+                    if depth == 0:
+                        if not nested:
+                            self.advance()
+                        return
+                    depth -= 1
+                    if depth == 0:
+                        self.advance()
+                        return
+            self.advance()
+
+    def statement_node(self):
+        kind, value = self.kind, self.value
+        if kind == SYMBOL_KIND and value == '{':
+            return self.compound_statement()
+        if kind == KEYWORD_KIND:
+            handler = self.KEYWORD_STATEMENTS.get(value)
+            if handler is not None:
+                return handler(self)
+        elif kind == TYPE_KEYWORD_KIND:
+            if value == 'tuple':
+                return self.tuple_declaration()
+            if value == 'list':
+                return self.list_declaration()
+            if value == 'array':
+                return self.array_declaration()
+        return self.declaration()
+
+    def compound_statement(self):
+        self.expect(SYMBOL_KIND, '{')
+        statements = []
+        while not self.at(SYMBOL_KIND, '}'):
+            if self.kind is None:
+                self.error("'}'")
+            statements.append((yield))
+        self.advance()
+        return CompoundStatement([], statements)
+
+    def declaration(self):
+        specifier = self.declaration_specifier()
+        assignment = self.assignment_expression()
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return VariableDeclaration(specifier, assignment)
+
+    def declaration_specifier(self):
+        """Parse an optional 'eternal'? type_specifier prefix."""
+        eternal = None
+        if self.at(KEYWORD_KIND, 'eternal'):
+            eternal = 'eternal'
+            self.advance()
+        elif self.kind != TYPE_KEYWORD_KIND:
+            return None
+        return DeclarationSpecifier(eternal, self.type_specifier())
+
+    def type_specifier(self):
+        value = self.value
+        if self.kind != TYPE_KEYWORD_KIND or value not in DECLARATION_TYPES:
+            self.error("a type")
+        self.advance()
+        return TypeSpecifier(value)
+
+    def tuple_declaration(self):
+        self.advance()
+        identifier = self.identifier()
+        self.expect(OPERATOR_KIND, '=')
+        self.expect(SYMBOL_KIND, '(')
+        values = self.argument_list(')')
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return TupleDeclaration(identifier, values)
+
+    def list_declaration(self):
+        self.advance()
+        identifier = self.identifier()
+        self.expect(OPERATOR_KIND, '=')
+        self.expect(SYMBOL_KIND, '[')
+        values = self.argument_list(']')
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return ListDeclaration(identifier, values)
+
+    def array_declaration(self):
+        self.advance()
+        self.expect(OPERATOR_KIND, '<')
+        type_specifier = self.type_specifier()
+        self.expect(OPERATOR_KIND, '>')
+        identifier = self.identifier()
+        self.expect(OPERATOR_KIND, '=')
+        self.expect(SYMBOL_KIND, '[')
+        expressions = []
+        if not self.at(SYMBOL_KIND, ']'):
+            expressions.append(self.expression())
+            while self.at(SYMBOL_KIND, ','):
+                self.advance()
+                expressions.append(self.expression())
+        self.expect(SYMBOL_KIND, ']')
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return ArrayDeclaration(type_specifier, identifier.value, expressions)
+
+    def preach_statement(self):
+        self.advance()
+        expression = self.parenthesized_expression()
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return PreachStatement(expression)
+
+    def selection_statement(self):
+        self.advance()
+        condition = self.parenthesized_expression()
+        true_branch = yield
+        false_branch = None
+        # 'else' binds to the nearest 'belief', as in the LALR grammar
+        if self.at(KEYWORD_KIND, 'else'):
+            self.advance()
+            false_branch = yield
+        return IfStatement(condition, true_branch, false_branch)
+
+    def while_loop(self):
+        self.advance()
+        condition = self.parenthesized_expression()
+        return WhileLoop(condition, (yield))
+
+    def do_while_loop(self):
+        self.advance()
+        body = yield
+        self.expect(KEYWORD_KIND, 'pledge')
+        condition = self.parenthesized_expression()
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return DoWhileLoop(body, condition)
+
+    def for_loop(self):
+        self.advance()
+        self.expect(SYMBOL_KIND, '(')
+        specifier = self.declaration_specifier()
+        init = VariableDeclaration(specifier, self.assignment_expression())
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        condition = None if self.kind == END_OF_STATEMENT_KIND else self.expression()
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        update = None if self.at(SYMBOL_KIND, ')') else self.expression()
+        self.expect(SYMBOL_KIND, ')')
+        return ForLoop(init, condition, update, (yield))
+
+    def jump_statement(self):
+        keyword = self.value
+        self.advance()
+        expression = None
+        if keyword == 'deliver' and self.kind != END_OF_STATEMENT_KIND:
+            expression = self.expression()
+        self.expect(END_OF_STATEMENT_KIND, ';')
+        return JumpStatement(keyword, expression)
+
+    def function_definition(self):
+        self.advance()
+        return_type = self.type_specifier()
+        name = self.identifier()
+        self.expect(SYMBOL_KIND, '(')
+        parameters = []
+        if not self.at(SYMBOL_KIND, ')'):
+            parameters.append(self.parameter())
+            while self.at(SYMBOL_KIND, ','):
+                self.advance()
+                parameters.append(self.parameter())
+        self.expect(SYMBOL_KIND, ')')
+        body = yield from self.compound_statement()
+        return FunctionDefinition(return_type, name.value, parameters, body)
+
+    def parameter(self):
+        type_keyword = self.type_specifier().type_keyword
+        # Array parameters are written as 'int[] name'
+        if self.at(SYMBOL_KIND, '['):
+            self.advance()
+            self.expect(SYMBOL_KIND, ']')
+            type_keyword += '[]'
+        return (type_keyword, self.identifier().value)
+
+    KEYWORD_STATEMENTS = {
+        'preach': preach_statement,
+        'belief': selection_statement,
+        'pledge': while_loop,
+        'oath': do_while_loop,
+        'chant': for_loop,
+        'persist': jump_statement,
+        'retreat': jump_statement,
+        'deliver': jump_statement,
+        'invoke': function_definition,
+    }
+
+    #######################################
+    # EXPRESSIONS
+    #######################################
+
+    def assignment_expression(self):
+        left = self.expression()
+        operator = self.value
+        if self.kind == OPERATOR_KIND and operator in ASSIGNMENT_OPERATORS:
+            if isinstance(left, BinaryExpression):
+                self.error("an expression before the assignment")
+            self.advance()
+            # Assignment is right associative: a = b = c is a = (b = c)
+            node = BinaryExpression(left, operator, self.assignment_expression())
+            node.offset = left.offset
+            return node
+        return left
+
+    def expression(self, min_precedence=1):
+        left = self.postfix_expression()
+        while True:
+            if self.kind != OPERATOR_KIND:
+                return left
+            operator = self.value
+            precedence = BINARY_PRECEDENCE.get(operator)
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.advance()
+            # Operands bind tighter than this operator, so chains are left associative
+            right = self.expression(precedence + 1)
+            offset = left.offset
+            left = BinaryExpression(left, operator, right)
+            left.offset = offset
+
+    def parenthesized_expression(self):
+        self.expect(SYMBOL_KIND, '(')
+        expression = self.expression()
+        self.expect(SYMBOL_KIND, ')')
+        return expression
+
+    def postfix_expression(self):
+        node = self.primary_expression()
+        offset = node.offset
+        while True:
+            kind, value = self.kind, self.value
+            if kind == SYMBOL_KIND and value == '[':
+                self.advance()
+                index = self.expression()
+                self.expect(SYMBOL_KIND, ']')
+                node = MemberAccessExpression(node, index=index)
+            elif kind == SYMBOL_KIND and value == '.':
+                self.advance()
+                node = self.member_operation(node)
+            elif kind == OPERATOR_KIND and value in POSTFIX_OPERATORS:
+                self.advance()
+                node = UnaryExpression(value, node)
+            else:
+                return node
+            node.offset = offset
+
+    def member_operation(self, node):
+        kind, value = self.kind, self.value
+        if kind == SYMBOL_KIND and value == '[':
+            self.advance()
+            index = self.expression()
+            self.expect(SYMBOL_KIND, ']')
+            return MemberAccessExpression(node, index=index)
+        if kind != UTILITY_KIND:
+            self.error("a list, tuple or array operation")
+        self.advance()
+        arguments = []
+        if self.at(SYMBOL_KIND, '('):
+            self.advance()
+            arguments = self.argument_list(')')
+        return MemberAccessExpression(node, operation=BuiltinFunction(value, arguments))
+
+    def primary_expression(self):
+        kind, value = self.kind, self.value
+        if kind == SYMBOL_KIND and value == '(':
+            return self.parenthesized_expression()
+        offset = self.start
+        literal_node = LITERAL_NODES.get(kind)
+        if literal_node is not None:
+            self.advance()
+            node = literal_node(value)
+        elif kind == IDENTIFIER_KIND or kind == UTILITY_KIND:
+            self.advance()
+            if self.at(SYMBOL_KIND, '('):
+                self.advance()
+                node = FunctionCall(value, self.argument_list(')'))
+            else:
+                node = Identifier(value)
+        else:
+            self.error("an expression")
+        node.offset = offset
+        return node
+
+    def argument_list(self, closing):
+        """Parse comma separated assignment expressions up to and including `closing`."""
+        arguments = []
+        if not self.at(SYMBOL_KIND, closing):
+            arguments.append(self.assignment_expression())
+            while self.at(SYMBOL_KIND, ','):
+                self.advance()
+                arguments.append(self.assignment_expression())
+        self.expect(SYMBOL_KIND, closing)
+        return arguments
+
+    def identifier(self):
+        value = self.value
+        # Utility names such as 'length' may also be used as identifiers
+        if self.kind != IDENTIFIER_KIND and self.kind != UTILITY_KIND:
+            self.error("an identifier")
+        node = Identifier(value)
+        node.offset = self.start
+        self.advance()
+        return node
+
+
+def run(fn, tokens, lines=None, report=None):
+    """Parse a token list, TokenBuffer or token entry stream, returning (program, error).
+
+    `lines` is the LineIndex used to place errors when `tokens` is a stream.
+    With `report`, syntax errors are passed to it and parsing goes on.
+    """
+    try:
+        return Parser(fn, tokens, lines, report).parse(), None
+    except (ParseError, lexer.LexError) as e:
+        return None, e.error
@@ -0,0 +1,169 @@
+from array import array
+from bisect import bisect_left
+import lexer
+import holyparser
+from lexer import TokenBuffer, LineIndex
+from astclasses import ASTNode, Program, IfStatement
+
+# A top-level statement always ends with ';' or '}', so lexing can restart at
+# the end of any statement. Only the dangling 'else' lets text after a
+# statement change it: an IfStatement is re-parsed along with whatever follows.
+
+
+def shift_offsets(node, delta):
+    """Move the source offsets of every node under `node` by `delta`."""
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, ASTNode):
+            if item.offset is not None:
+                item.offset += delta
+            stack.extend(getattr(item, field, None) for field in item._fields)
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+
+
+def shift(offsets, first, delta):
+    """Add `delta` to offsets[first:]."""
+    if delta and first < len(offsets):
+        offsets[first:] = array(offsets.typecode, [offset + delta for offset in offsets[first:]])
+
+
+def changed_range(old, new):
+    """Return (start, old_end, new_end) such that only old[start:old_end] became new[start:new_end]."""
+    limit = min(len(old), len(new))
+    # Binary search on slices keeps the comparisons in C
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[:mid] == new[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    start = low
+    low, high = 0, limit - start
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            low = mid
+        else:
+            high = mid - 1
+    return start, len(old) - low, len(new) - low
+
+
+class IncrementalParser:
+    """Keeps the tokens and top-level statements of a source between edits.
+
+    An edit re-lexes and re-parses from the end of the statement before it up
+    to the first old statement that starts at the same, shifted, offset after
+    the edit. Every other statement of the previous Program is reused as is.
+    Walking the reused statements to move their node offsets would cost as
+    much as the edit saves, so that is left to settle_offsets().
+    """
+
+    def __init__(self, fn, text=''):
+        self.fn = fn
+        self.text = ''
+        self.reset()
+        self.edit(0, 0, text)
+
+    def reset(self):
+        self.tokens = TokenBuffer(self.fn, self.text)
+        self.statements = []
+        # Source span and first token index of each top-level statement
+        self.statement_starts = array('I')
+        self.statement_ends = array('I')
+        self.statement_tokens = array('I')
+        self.program = None
+        self.error = None
+        self.reparsed = 0
+
+    def update(self, text):
+        """Replace the whole source, re-parsing only what differs from the previous one."""
+        start, old_end, new_end = changed_range(self.text, text)
+        return self.edit(start, old_end, text[start:new_end])
+
+    def edit(self, start, end, new_text):
+        """Replace text[start:end] with `new_text`, returning (program, error)."""
+        text = self.text[:start] + new_text + self.text[end:]
+        delta = len(new_text) - (end - start)
+        if self.program is None:
+            # The last parse failed, so nothing can be trusted
+            self.text = text
+            self.reset()
+            start = end = 0
+            delta = 0
+        self.text = text
+        self.tokens.text = text
+        self.tokens.lines = LineIndex(text)
+
+        starts, ends = self.statement_starts, self.statement_ends
+        count = len(self.statements)
+        first = bisect_left(ends, start)
+        if first > 0 and isinstance(self.statements[first - 1], IfStatement):
+            first -= 1
+        region_start = ends[first - 1] if first > 0 else 0
+        first_token = self.statement_tokens[first] if first < count else len(self.tokens)
+
+        kinds, token_starts, token_ends, value_ids = array('B'), array('I'), array('I'), array('I')
+        intern, value_index = self.tokens.intern, self.tokens.value_index
+
+        def record(entries):
+            for kind, token_start, token_end, value in entries:
+                value_id = value_index.get(value if type(value) is str else (kind, value))
+                if value_id is None:
+                    value_id = intern(kind, value)
+                kinds.append(kind)
+                token_starts.append(token_start)
+                token_ends.append(token_end)
+                value_ids.append(value_id)
+                yield kind, token_start, token_end, value
+
+        source = lexer.RegexLexer(self.fn, text, region_start)
+        statements = []
+        new_starts, new_ends, new_tokens = array('I'), array('I'), array('I')
+        resync = bisect_left(starts, end)
+        try:
+            parser = holyparser.Parser(self.fn, record(source.iter_tokens()), self.tokens.lines)
+            while parser.kind is not None:
+                # Stop at the first old statement after the edit that starts where the parser is
+                while resync < count and starts[resync] + delta < parser.start:
+                    resync += 1
+                if resync < count and starts[resync] + delta == parser.start:
+                    break
+                new_starts.append(parser.start)
+                new_tokens.append(first_token + parser.idx)
+                statements.append(parser.statement())
+                new_ends.append(token_ends[parser.idx - 1])
+            else:
+                resync = count
+        except (holyparser.ParseError, lexer.LexError) as e:
+            self.program, self.error = None, e.error
+            return None, e.error
+
+        # Splice the new tokens and statements over the old ones, moving everything after them
+        last_token = self.statement_tokens[resync] if resync < count else len(self.tokens)
+        region_tokens = parser.idx
+        for old, new in ((self.tokens.kinds, kinds), (self.tokens.starts, token_starts),
+                         (self.tokens.ends, token_ends), (self.tokens.value_ids, value_ids)):
+            old[first_token:last_token] = new[:region_tokens]
+        shift(self.tokens.starts, first_token + region_tokens, delta)
+        shift(self.tokens.ends, first_token + region_tokens, delta)
+
+        self.statements[first:resync] = statements
+        starts[first:resync] = new_starts
+        ends[first:resync] = new_ends
+        self.statement_tokens[first:resync] = new_tokens
+        shift(starts, first + len(statements), delta)
+        shift(ends, first + len(statements), delta)
+        shift(self.statement_tokens, first + len(statements), region_tokens - (last_token - first_token))
+
+        self.reparsed = len(statements)
+        self.program, self.error = Program(list(self.statements)), None
+        return self.program, None
+
+    def settle_offsets(self):
+        """Bring the node offsets of statements moved by earlier edits up to date."""
+        for statement, start in zip(self.statements, self.statement_starts):
+            if statement.offset != start:
+                shift_offsets(statement, start - statement.offset)
@@ -0,0 +1,614 @@
+# Intermediate representation between the analyzed AST and WAT.
+#
+# A Module holds Functions; a Function is a control flow graph of Blocks, the
+# first of which is its entry. A Block runs its phis, then its instructions in
+# order, then its terminator, which jumps to other blocks, branches, returns
+# or traps. Values are in SSA form: every Instruction with a type is a virtual
+# register, assigned exactly once where it is defined, and the instructions
+# that use it hold it in `args`. A phi picks one of its args by the
+# predecessor control came from: args[i] belongs to block.preds[i].
+#
+# Operators are named after the WebAssembly instruction they become, such as
+# 'i32.add' or 'f32.lt', so the passes and the back-end share one vocabulary.
+#
+# lowering.py builds the IR from an analyzed Program and wat_backend.py turns
+# it into structured WAT. format_module() prints it and verify() checks it.
+
+#######################################
+# CONSTANTS
+#######################################
+
+VALUE_TYPES = ('i32', 'f32')
+
+# Operand type of each binary operator; comparisons produce an i32
+BINARY_OPERATORS = {
+    **{f'i32.{name}': 'i32' for name in ('add', 'sub', 'mul', 'div_s', 'rem_s', 'and', 'or', 'shl',
+                                          'eq', 'ne', 'lt_s', 'gt_s', 'le_s', 'ge_s')},
+    **{f'f32.{name}': 'f32' for name in ('add', 'sub', 'mul', 'div', 'eq', 'ne', 'lt', 'gt', 'le', 'ge')},
+}
+COMPARISONS = {operator for operator in BINARY_OPERATORS
+               if operator.split('.')[1] in ('eq', 'ne', 'lt_s', 'gt_s', 'le_s', 'ge_s', 'lt', 'gt', 'le', 'ge')}
+# Operators whose operands can be swapped
+COMMUTATIVE = {operator for operator in BINARY_OPERATORS
+               if operator.split('.')[1] in ('add', 'mul', 'and', 'or', 'eq', 'ne')}
+
+# Operators that change something besides their result
+EFFECTS = {'store', 'global.set', 'call'}
+# Operators that may trap instead of producing a result
+TRAPS = {'i32.div_s', 'i32.rem_s', 'load'}
+# Operators whose result depends on memory or globals, not only their args
+READS = {'load', 'global.get', 'call'}
+# Operators that neither read state, change it nor trap: their result only depends on their args
+PURE = {'const', 'param'} | {operator for operator in BINARY_OPERATORS if operator not in TRAPS}
+
+TERMINATORS = {'jump', 'branch', 'return', 'unreachable'}
+
+
+class IRError(Exception):
+    """A construct lowering.py cannot express in the IR; `node` is the AST node, for its position."""
+
+    def __init__(self, message, node=None):
+        super().__init__(message)
+        self.node = node
+
+
+#######################################
+# IR
+#######################################
+
+
+class Instruction:
+    """One operation, and the value it defines when `type` is not None.
+
+    `attr` is the operator's immediate: the number of a 'const', the index of
+    a 'param', the name of a global or of the function called, the variable
+    a phi stands for, and the target blocks of a terminator.
+    """
+    __slots__ = ('id', 'op', 'type', 'args', 'attr', 'block')
+
+    def __init__(self, id, op, type, args=(), attr=None, block=None):
+        self.id = id
+        self.op = op
+        self.type = type
+        self.args = list(args)
+        self.attr = attr
+        self.block = block
+
+    def __repr__(self):
+        return f"%{self.id}" if self.type is not None else f"<{self.op}>"
+
+    @property
+    def targets(self):
+        """The blocks a terminator may continue in."""
+        return self.attr if self.op in ('jump', 'branch') else ()
+
+
+class Block:
+    __slots__ = ('id', 'phis', 'instructions', 'terminator', 'preds')
+
+    def __init__(self, id):
+        self.id = id
+        self.phis = []
+        self.instructions = []
+        self.terminator = None
+        # One entry per edge into the block, in the order of the args of its phis
+        self.preds = []
+
+    def __repr__(self):
+        return f"b{self.id}"
+
+    @property
+    def succs(self):
+        return () if self.terminator is None else self.terminator.targets
+
+
+class Function:
+    def __init__(self, name, params=(), result=None, export=True):
+        self.name = name
+        # (name, value type) of each parameter
+        self.params = list(params)
+        # Value type of the delivered value, None for a void function
+        self.result = result
+        self.export = export
+        self.blocks = []
+        self.next_value = 0
+        self.next_block = 0
+
+    def __repr__(self):
+        return f"Function({self.name!r}, {len(self.blocks)} blocks)"
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def new_block(self):
+        block = Block(self.next_block)
+        self.next_block += 1
+        self.blocks.append(block)
+        return block
+
+    def new_value(self, op, type, args=(), attr=None, block=None):
+        """An Instruction with a fresh id; the caller puts it in a block."""
+        instruction = Instruction(self.next_value, op, type, args, attr, block)
+        self.next_value += 1
+        return instruction
+
+    def values(self):
+        """Every phi, instruction and terminator, block by block."""
+        for block in self.blocks:
+            yield from block.phis
+            yield from block.instructions
+            if block.terminator is not None:
+                yield block.terminator
+
+
+class Module:
+    def __init__(self):
+        self.functions = []
+        # Runs the top-level statements when the module is instantiated
+        self.start = Function('holy.start', export=False)
+        # Value type of each global variable, by WAT name
+        self.globals = {}
+        # Parameter types of each imported logging function, by name
+        self.imports = {'log': ['i32']}
+        # Address in memory of each string literal preached, see lowering.string_layout()
+        self.strings = {}
+        # Whether a function takes an array, so the module exports the memory it is in
+        self.memory = False
+
+    def all_functions(self):
+        return self.functions + [self.start]
+
+
+#######################################
+# CONTROL FLOW
+#######################################
+
+
+def reverse_postorder(function):
+    """The blocks reachable from the entry, each before its successors except along back edges."""
+    entry = function.entry
+    seen = {entry}
+    order = []
+    stack = [(entry, iter(entry.succs))]
+    while stack:
+        block, successors = stack[-1]
+        for successor in successors:
+            if successor not in seen:
+                seen.add(successor)
+                stack.append((successor, iter(successor.succs)))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+
+def dominators(function, order=None):
+    """The immediate dominator of each reachable block; the entry's is None.
+
+    The iterative algorithm of Cooper, Harvey and Kennedy, "A Simple, Fast
+    Dominance Algorithm", over `order`, the reverse postorder.
+    """
+    if order is None:
+        order = reverse_postorder(function)
+    index = {block: position for position, block in enumerate(order)}
+    entry = order[0]
+    idom = {entry: entry}
+
+    def intersect(a, b):
+        while a is not b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new = None
+            for pred in block.preds:
+                if pred in idom:
+                    new = pred if new is None else intersect(pred, new)
+            if idom.get(block) is not new:
+                idom[block] = new
+                changed = True
+    idom[entry] = None
+    return idom
+
+
+def dominates(idom, a, b):
+    """Whether block `a` dominates block `b`, given the immediate dominators."""
+    while b is not None:
+        if b is a:
+            return True
+        b = idom[b]
+    return False
+
+
+def dominator_tree(idom, order):
+    """The blocks each block immediately dominates, in `order`."""
+    children = {block: [] for block in order}
+    for block in order:
+        parent = idom[block]
+        if parent is not None:
+            children[parent].append(block)
+    return children
+
+
+def loop_forest(order):
+    """The loops of a reducible graph, such as lowering.py builds, and how they nest.
+
+    `order` is the reverse postorder; an edge to a block no later in it is a
+    back edge, and its target a loop header. Returns (innermost, parent):
+    innermost maps each block in a loop to the header of the innermost loop
+    around it, a header to itself, and parent maps each header to the header
+    of the loop around it, or None. Built from the inner loops out with
+    Havlak's union-find, so deep nesting does not multiply the work.
+    """
+    index = {block: position for position, block in enumerate(order)}
+    latches = {}
+    for block in order:
+        for successor in block.succs:
+            if index[successor] <= index[block]:
+                latches.setdefault(successor, []).append(block)
+    innermost, parent = {}, {}
+    # Block -> header of a loop found around it since
+    absorbed = {}
+
+    def find(block):
+        root = block
+        while root in absorbed:
+            root = absorbed[root]
+        while block is not root:
+            absorbed[block], block = root, absorbed[block]
+        return root
+
+    # An inner header comes after the header of the loop around it
+    for header in sorted(latches, key=index.get, reverse=True):
+        innermost[header] = header
+        parent[header] = None
+        worklist = list(latches[header])
+        while worklist:
+            block = find(worklist.pop())
+            if block is header:
+                continue
+            absorbed[block] = header
+            if block in parent:
+                parent[block] = header  # The header of a loop inside this one
+            else:
+                innermost[block] = header
+            worklist.extend(block.preds)
+    return innermost, parent
+
+
+def remove_unreachable(function):
+    """Drop the blocks control never reaches, and the phi args that came from them."""
+    reachable = set(reverse_postorder(function))
+    if len(reachable) == len(function.blocks):
+        return
+    function.blocks = [block for block in function.blocks if block in reachable]
+    for block in function.blocks:
+        if all(pred in reachable for pred in block.preds):
+            continue
+        kept = [index for index, pred in enumerate(block.preds) if pred in reachable]
+        block.preds = [block.preds[index] for index in kept]
+        for phi in block.phis:
+            phi.args = [phi.args[index] for index in kept]
+
+
+def remove_empty_blocks(function):
+    """Send the edges into each block that only jumps on straight to where it jumps."""
+    entry = function.entry
+    removed = set()
+    for block in function.blocks:
+        terminator = block.terminator
+        if block is entry or block.phis or block.instructions or terminator.op != 'jump':
+            continue
+        target = terminator.targets[0]
+        preds = block.preds
+        if target is block or (target.phis and any(pred in target.preds for pred in preds)):
+            continue  # A pred would reach the target's phis along two edges
+        index = target.preds.index(block)
+        target.preds[index:index + 1] = preds
+        for phi in target.phis:
+            phi.args[index:index + 1] = [phi.args[index]] * len(preds)
+        for pred in preds:
+            pred.terminator.attr = tuple(target if successor is block else successor
+                                         for successor in pred.terminator.attr)
+        removed.add(block)
+    if removed:
+        function.blocks = [block for block in function.blocks if block not in removed]
+
+
+def replace_values(function, replacements):
+    """Make every instruction use replacements[v] instead of v, following chains of replacements."""
+    def resolve(value):
+        target = replacements.get(value)
+        if target is None:
+            return value
+        root = target
+        while root in replacements:
+            root = replacements[root]
+        replacements[value] = root
+        return root
+
+    for instruction in function.values():
+        args = instruction.args
+        for index, arg in enumerate(args):
+            if arg in replacements:
+                args[index] = resolve(arg)
+
+
+def remove_trivial_phis(function):
+    """Replace each phi whose args are all one value, or itself, by that value, until none is left.
+
+    Lowering adds a phi wherever a variable is read in a block with several
+    predecessors, before knowing whether they all bring the same value.
+    """
+    replacements = {}
+
+    def resolve(value):
+        while value in replacements:
+            value = replacements[value]
+        return value
+
+    # The phis that use each phi, revisited once it is replaced
+    users = {}
+    for block in function.blocks:
+        for phi in block.phis:
+            for arg in phi.args:
+                if arg.op == 'phi' and arg is not phi:
+                    users.setdefault(arg, []).append(phi)
+    worklist = [phi for block in reversed(function.blocks) for phi in reversed(block.phis)]
+    while worklist:
+        phi = worklist.pop()
+        if phi in replacements:
+            continue
+        values = {resolve(arg) for arg in phi.args}
+        values.discard(phi)
+        if len(values) == 1:
+            replacements[phi] = values.pop()
+        elif not values:
+            # Only reachable through itself: the variable was never assigned
+            replacements[phi] = undefined(function, phi.block, phi.type)
+        else:
+            continue
+        worklist.extend(users.get(phi, ()))
+    if replacements:
+        for block in function.blocks:
+            block.phis = [phi for phi in block.phis if phi not in replacements]
+        replace_values(function, replacements)
+
+
+def undefined(function, block, type):
+    """A zero, the value of a variable read before any assignment, at the start of `block`."""
+    value = function.new_value('const', type, attr=0, block=block)
+    block.instructions.insert(0, value)
+    return value
+
+
+def use_counts(function):
+    """How many args, of phis, instructions and terminators, hold each value."""
+    counts = {}
+    for instruction in function.values():
+        for arg in instruction.args:
+            counts[arg] = counts.get(arg, 0) + 1
+    return counts
+
+
+#######################################
+# PRINTER
+#######################################
+
+
+def format_instruction(instruction):
+    op, attr = instruction.op, instruction.attr
+    if op == 'phi':
+        operands = ' '.join(f"[{pred} {arg!r}]" for pred, arg in zip(instruction.block.preds, instruction.args))
+        text = f"phi {operands}  ; {attr}"
+    else:
+        parts = [op]
+        if op in TERMINATORS:
+            parts.extend(repr(arg) for arg in instruction.args)
+            parts.extend(repr(target) for target in instruction.targets)
+        else:
+            if attr is not None:
+                parts.append(str(attr))
+            parts.extend(repr(arg) for arg in instruction.args)
+        text = ' '.join(parts)
+    if instruction.type is None:
+        return text
+    return f"%{instruction.id}: {instruction.type} = {text}"
+
+
+def format_function(function):
+    params = ', '.join(f"{name}: {type}" for name, type in function.params)
+    header = f"func {function.name}({params})"
+    if function.result is not None:
+        header += f" -> {function.result}"
+    lines = [header + " {"]
+    for block in function.blocks:
+        label = f"{block}:"
+        if block.preds:
+            label = f"{label:<40} ; preds {' '.join(map(repr, block.preds))}"
+        lines.append(label)
+        for instruction in block.phis + block.instructions:
+            lines.append(f"  {format_instruction(instruction)}")
+        if block.terminator is not None:
+            lines.append(f"  {format_instruction(block.terminator)}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def format_module(module):
+    lines = [f"global {name}: {type}" for name, type in module.globals.items()]
+    lines.extend(f"string {address} {text!r}" for text, address in module.strings.items())
+    functions = [format_function(function) for function in module.all_functions()]
+    return "\n\n".join(["\n".join(lines)] + functions if lines else functions) + "\n"
+
+
+#######################################
+# VERIFIER
+#######################################
+
+
+def verify(function, module=None):
+    """Check that `function` is well formed SSA; returns a message per problem found, empty when it is.
+
+    Every block is reachable and ends in a terminator, preds match the
+    edges, operands have the types their operator expects, and every value
+    is defined before its uses on every path: in the same block above the
+    use, or in a block dominating it. The arg of a phi only needs to be
+    available at the end of its predecessor.
+    """
+    problems = []
+    name = function.name
+
+    def problem(message, block=None):
+        problems.append(f"{name}: {block}: {message}" if block is not None else f"{name}: {message}")
+
+    if not function.blocks:
+        problem("has no blocks")
+        return problems
+    blocks = set(function.blocks)
+    if function.entry.preds:
+        problem("the entry block has predecessors")
+
+    edges = {block: [] for block in function.blocks}
+    for block in function.blocks:
+        terminator = block.terminator
+        if terminator is None or terminator.op not in TERMINATORS:
+            problem("does not end in a terminator", block)
+            continue
+        for target in terminator.targets:
+            if target not in blocks:
+                problem(f"jumps to {target}, which is not in the function", block)
+            else:
+                edges[target].append(block)
+    if problems:
+        return problems
+    for block in function.blocks:
+        if sorted(edges[block], key=id) != sorted(block.preds, key=id):
+            problem(f"preds {block.preds} do not match the edges into it, {edges[block]}", block)
+
+    order = reverse_postorder(function)
+    if len(order) != len(function.blocks):
+        reachable = set(order)
+        problem(f"unreachable blocks {[block for block in function.blocks if block not in reachable]}")
+        return problems
+    idom = dominators(function, order)
+
+    # Where each value is defined: (block, position), phis before every instruction
+    defined = {}
+    for block in function.blocks:
+        for position, instruction in enumerate(block.phis + block.instructions, -len(block.phis)):
+            if instruction in defined:
+                problem(f"{instruction!r} appears twice", block)
+            if instruction.block is not block:
+                problem(f"{instruction!r} says it is in {instruction.block}", block)
+            defined[instruction] = (block, position)
+
+    def available(value, block, position):
+        """Whether `value` is defined before `position` of `block`, on every path to it."""
+        where = defined.get(value)
+        if where is None:
+            return False
+        if where[0] is block:
+            return where[1] < position
+        return dominates(idom, where[0], block)
+
+    for block in function.blocks:
+        for phi in block.phis:
+            if phi.op != 'phi':
+                problem(f"{phi!r} is among the phis but is a {phi.op}", block)
+                continue
+            if len(phi.args) != len(block.preds):
+                problem(f"{phi!r} has {len(phi.args)} args for {len(block.preds)} preds", block)
+                continue
+            for pred, arg in zip(block.preds, phi.args):
+                if arg.type != phi.type:
+                    problem(f"{phi!r} is {phi.type} but gets {arg.type} {arg!r} from {pred}", block)
+                if not available(arg, pred, len(pred.instructions)):
+                    problem(f"{arg!r} of {phi!r} is not defined at the end of {pred}", block)
+        instructions = block.instructions + [block.terminator]
+        for position, instruction in enumerate(instructions):
+            for arg in instruction.args:
+                if not isinstance(arg, Instruction) or arg.type is None:
+                    problem(f"{format_instruction(instruction)} uses {arg!r}, which has no value", block)
+                elif not available(arg, block, position):
+                    problem(f"{format_instruction(instruction)} uses {arg!r} before it is defined", block)
+            message = check_types(instruction, function, module)
+            if message is not None:
+                problem(f"{format_instruction(instruction)}: {message}", block)
+    return problems
+
+
+def check_types(instruction, function, module):
+    """Why `instruction` is mistyped, or None when its operands and result fit its operator."""
+    op, type, args = instruction.op, instruction.type, instruction.args
+    arg_types = [arg.type for arg in args]
+    if op in BINARY_OPERATORS:
+        operand = BINARY_OPERATORS[op]
+        if arg_types != [operand, operand]:
+            return f"needs two {operand} operands"
+        if type != ('i32' if op in COMPARISONS else operand):
+            return f"cannot produce {type}"
+    elif op == 'const':
+        if args or type not in VALUE_TYPES or not isinstance(instruction.attr, (int, float)):
+            return "needs a number and a value type"
+    elif op == 'param':
+        index = instruction.attr
+        if args or not 0 <= index < len(function.params) or function.params[index][1] != type:
+            return f"does not match the parameters {function.params}"
+    elif op == 'load':
+        if arg_types != ['i32'] or type not in VALUE_TYPES:
+            return "needs an i32 address and a value type"
+    elif op == 'store':
+        if len(args) != 2 or arg_types[0] != 'i32' or arg_types[1] not in VALUE_TYPES or type is not None:
+            return "needs an i32 address and a value, and has no result"
+    elif op in ('global.get', 'global.set'):
+        expected = None if module is None else module.globals.get(instruction.attr)
+        if module is not None and expected is None:
+            return f"global {instruction.attr} is not declared"
+        if op == 'global.get' and (args or (expected is not None and type != expected)):
+            return f"global {instruction.attr} is {expected}"
+        if op == 'global.set' and (type is not None or len(args) != 1
+                                   or (expected is not None and arg_types[0] != expected)):
+            return f"global {instruction.attr} is {expected}"
+    elif op == 'call':
+        if module is not None:
+            callee = next((f for f in module.functions if f.name == instruction.attr), None)
+            if callee is not None:
+                if arg_types != [param_type for _, param_type in callee.params] or type != callee.result:
+                    return f"does not match {callee.name}'s signature"
+            elif instruction.attr in module.imports:
+                if arg_types != module.imports[instruction.attr] or type is not None:
+                    return f"does not match the import {instruction.attr}"
+            else:
+                return f"calls {instruction.attr}, which is not defined"
+    elif op == 'branch':
+        if arg_types != ['i32'] or len(instruction.targets) != 2:
+            return "needs an i32 condition and two targets"
+    elif op == 'jump':
+        if args or len(instruction.targets) != 1:
+            return "needs one target"
+    elif op == 'return':
+        if arg_types != ([] if function.result is None else [function.result]):
+            return f"does not deliver the function's {function.result or 'void'}"
+    elif op == 'unreachable':
+        if args:
+            return "takes no operands"
+    else:
+        return "unknown operator"
+    return None
+
+
+def verify_module(module):
+    problems = []
+    for function in module.all_functions():
+        problems.extend(verify(function, module))
+    return problems
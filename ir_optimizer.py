@@ -0,0 +1,438 @@
+import bisect
+
+import ir
+from lowering import ELEMENT_SIZE_SHIFT
+
+# Optimization passes over the IR of ir.py, run between lowering.py and
+# wat_backend.py. A pass rewrites one Function in place and leaves it in SSA
+# form, so verify() holds after each of them. A value a pass finds redundant
+# is replaced in every instruction that uses it; the back-end then keeps the
+# value that stays in a local when it is used more than once.
+
+#######################################
+# ALIASING
+#######################################
+
+
+def address_parts(address):
+    """(base, index, offset) such that `address` is base + ((index + offset) << ELEMENT_SIZE_SHIFT).
+
+    `index` is None for a constant element index. An address that is not an
+    element address is its own base.
+    """
+    if address.op == 'i32.add':
+        for base, scaled in (address.args, reversed(address.args)):
+            if (scaled.op == 'i32.shl' and scaled.args[1].op == 'const'
+                    and scaled.args[1].attr == ELEMENT_SIZE_SHIFT):
+                index = scaled.args[0]
+                if index.op == 'const':
+                    return base, None, index.attr
+                left, right = index.args if index.op in ('i32.add', 'i32.sub') else (None, None)
+                if right is not None and right.op == 'const':
+                    return base, left, right.attr if index.op == 'i32.add' else -right.attr
+                if index.op == 'i32.add' and left.op == 'const':
+                    return base, right, left.attr
+                return base, index, 0
+    return address, None, 0
+
+
+def may_alias(a, b):
+    """Whether the 32-bit accesses at addresses `a` and `b` may overlap.
+
+    Only elements a known constant apart in one array, such as arr[j]
+    and arr[j + 1], are told apart: distinct arrays may share memory.
+    """
+    if a is b:
+        return True
+    base_a, index_a, offset_a = address_parts(a)
+    base_b, index_b, offset_b = address_parts(b)
+    if base_a is base_b and index_a is index_b:
+        return offset_a == offset_b
+    return True
+
+
+#######################################
+# VALUE NUMBERING
+#######################################
+
+
+class MemoryState:
+    """The loads and global reads known to hold, at one point of a function.
+
+    `loads` maps (address, type) to the value at that address, and
+    `globals` the name of a global to its value. A store or a global.set
+    records what it wrote, so a later read reuses it.
+    """
+    __slots__ = ('loads', 'globals')
+
+    def __init__(self, loads=None, globals=None):
+        self.loads = loads or {}
+        self.globals = globals or {}
+
+    def store(self, address, value):
+        self.loads = {key: known for key, known in self.loads.items() if not may_alias(key[0], address)}
+        self.loads[address, value.type] = value
+
+    def forget(self):
+        """A call may write any memory or global."""
+        self.loads.clear()
+        self.globals.clear()
+
+    @staticmethod
+    def meet(states):
+        """What holds after each of `states`: the reads they all agree on."""
+        first, rest = states[0], states[1:]
+        loads = {key: value for key, value in first.loads.items()
+                 if all(state.loads.get(key) is value for state in rest)}
+        globals = {name: value for name, value in first.globals.items()
+                   if all(state.globals.get(name) is value for state in rest)}
+        return MemoryState(loads, globals)
+
+
+def value_key(instruction):
+    """What a pure or trapping instruction computes, equal for instructions that compute the same value."""
+    op = instruction.op
+    if op == 'const':
+        # repr() keeps -0.0 apart from 0.0
+        return op, instruction.type, repr(instruction.attr)
+    if op == 'param':
+        return op, instruction.attr
+    left, right = instruction.args
+    if op in ir.COMMUTATIVE and right.id < left.id:
+        left, right = right, left
+    return op, left, right
+
+
+class ValueNumbering:
+    """Remove instructions that compute a value already computed on every path to them.
+
+    Follows Briggs, Cooper and Simpson's dominator-based value numbering:
+    blocks are visited along the dominator tree, each child in reverse
+    postorder, with a table of the values computed in the blocks that
+    dominate the current one. An instruction whose operator and operands
+    match an entry of the table is replaced by it. That covers pure
+    operators and the traps of division, as the dominating one ran first.
+
+    Loads and global reads also depend on the state of memory, which stores
+    and calls change. Their table flows along the edges instead: a block
+    starts with the reads all its predecessors agree on, and a loop header,
+    entered from code not yet visited, with none. A store only forgets the
+    loads that may_alias() its address.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.replacements = {}
+
+    def resolve(self, value):
+        replacements = self.replacements
+        while value in replacements:
+            value = replacements[value]
+        return value
+
+    def run(self):
+        """Number the values of the function; returns how many instructions were removed."""
+        function = self.function
+        order = ir.reverse_postorder(function)
+        children = ir.dominator_tree(ir.dominators(function, order), order)
+        available = {}
+        # Memory state at the end of each visited block
+        states = {}
+        removed = 0
+        # (block, keys it added to `available`), the keys being None until it is visited
+        stack = [(function.entry, None)]
+        while stack:
+            block, added = stack.pop()
+            if added is not None:
+                for key in added:
+                    del available[key]
+                continue
+            added = []
+            removed += self.number_block(block, available, added, states)
+            stack.append((block, added))
+            stack.extend((child, None) for child in reversed(children[block]))
+        if self.replacements:
+            ir.replace_values(function, self.replacements)
+            ir.remove_trivial_phis(function)
+            ir.remove_empty_blocks(function)
+        return removed
+
+    def number_block(self, block, available, added, states):
+        preds = block.preds
+        if preds and all(pred in states for pred in preds):
+            state = MemoryState.meet([states[pred] for pred in preds])
+        else:
+            state = MemoryState()
+        instructions = block.instructions
+        kept = []
+        for instruction in instructions:
+            args = instruction.args
+            args[:] = [self.resolve(arg) for arg in args]
+            op = instruction.op
+            known = None
+            if op in ir.PURE or op in ('i32.div_s', 'i32.rem_s'):
+                key = value_key(instruction)
+                known = available.get(key)
+                if known is None:
+                    available[key] = instruction
+                    added.append(key)
+            elif op == 'load':
+                key = args[0], instruction.type
+                known = state.loads.get(key)
+                if known is None:
+                    state.loads[key] = instruction
+            elif op == 'global.get':
+                known = state.globals.get(instruction.attr)
+                if known is None:
+                    state.globals[instruction.attr] = instruction
+            elif op == 'store':
+                state.store(args[0], args[1])
+            elif op == 'global.set':
+                state.globals[instruction.attr] = args[0]
+            elif op == 'call':
+                state.forget()
+            if known is None:
+                kept.append(instruction)
+            else:
+                self.replacements[instruction] = known
+        block.instructions = kept
+        terminator = block.terminator
+        terminator.args[:] = [self.resolve(arg) for arg in terminator.args]
+        states[block] = state
+        return len(instructions) - len(kept)
+
+
+#######################################
+# LOOP INVARIANT CODE MOTION
+#######################################
+
+
+class LoopInvariantCodeMotion:
+    """Move the instructions that compute the same value on every iteration of a loop in front of it.
+
+    Every loop first gets a preheader: a block that only jumps to its
+    header, which every edge from outside the loop goes through. An
+    instruction is invariant in a loop when each of its args is defined
+    outside it, and is moved to the end of the preheader of the outermost
+    loop it is invariant in, so it runs once however many times the loops
+    go round. The loops come from ir.loop_forest(), numbered in a walk of
+    the forest so that each loop spans the loops inside it; the blocks are
+    visited in reverse postorder, so an instruction's args have been moved
+    before it, and it goes where it belongs in one step rather than a loop
+    at a time.
+
+    Pure operators move from anywhere in the loop: running one the loop
+    would have skipped costs time but changes nothing. A global read moves
+    out of loops that neither write that global nor call a function. A load
+    moves only when the loop calls nothing and stores nowhere that
+    may_alias() its address, so it is never taken past a write to the same
+    element.
+
+    An instruction that may trap, a load or a division, only moves out of
+    the header, ahead of any effect there: the header runs whenever the
+    loop is entered, so it traps in the preheader exactly when it would
+    have trapped on the first iteration. The preheader is not the header of
+    the loop around it, so it moves no further.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def run(self):
+        """Hoist the invariant instructions of every loop; returns how many were moved."""
+        function = self.function
+        order = ir.reverse_postorder(function)
+        index = {block: position for position, block in enumerate(order)}
+        headers = {successor for block in order for successor in block.succs if index[successor] <= index[block]}
+        if not headers:
+            return 0
+        for header in sorted(headers, key=index.get):
+            self.add_preheader(header, [pred for pred in header.preds if index[pred] < index[header]])
+        order = ir.reverse_postorder(function)
+        index = {block: position for position, block in enumerate(order)}
+        self.innermost, self.parent = ir.loop_forest(order)
+        self.number_loops()
+        self.preheaders = {header: min(header.preds, key=index.get) for header in self.parent}
+        # Stores, globals written and calls in each loop, gathered from the inner loops out
+        own_blocks = {header: [] for header in self.parent}
+        for block in order:
+            if block in self.innermost:
+                own_blocks[self.innermost[block]].append(block)
+        self.summaries = {}
+        for header in reversed(self.preorder):
+            summary = self.summaries[header] = LoopSummary(own_blocks[header])
+            for child in self.children[header]:
+                summary.include(self.summaries[child])
+        moved = 0
+        for block in order:
+            loop = self.innermost.get(block)
+            if loop is None:
+                continue
+            kept = []
+            # Effects already passed in the header, which traps may not move ahead of
+            effects = False
+            for instruction in block.instructions:
+                target = self.destination(instruction, loop, block is loop and not effects)
+                if target is None:
+                    kept.append(instruction)
+                    effects = effects or instruction.op in ir.EFFECTS
+                else:
+                    preheader = self.preheaders[target]
+                    instruction.block = preheader
+                    preheader.instructions.append(instruction)
+                    moved += 1
+            block.instructions = kept
+        ir.remove_empty_blocks(function)
+        return moved
+
+    def add_preheader(self, header, entries):
+        """Route the edges from `entries`, the predecessors of `header` outside its loop, through a block of their own."""
+        if len(entries) == 1 and len(entries[0].succs) == 1:
+            return
+        function = self.function
+        preheader = function.new_block()
+        preheader.terminator = function.new_value('jump', None, attr=(header,), block=preheader)
+        for pred in set(entries):
+            pred.terminator.attr = tuple(preheader if target is header else target for target in pred.terminator.attr)
+        outside = [index for index, pred in enumerate(header.preds) if pred in entries]
+        inside = [index for index, pred in enumerate(header.preds) if pred not in entries]
+        preheader.preds = [header.preds[index] for index in outside]
+        for phi in header.phis:
+            incoming = [phi.args[index] for index in outside]
+            if all(arg is incoming[0] for arg in incoming):
+                value = incoming[0]
+            else:
+                value = function.new_value('phi', phi.type, incoming, phi.attr, preheader)
+                preheader.phis.append(value)
+            phi.args = [value] + [phi.args[index] for index in inside]
+        header.preds = [preheader] + [header.preds[index] for index in inside]
+
+    def number_loops(self):
+        """Number the loops in a walk of the loop forest.
+
+        Each loop gets the span of numbers of the loops inside it, itself
+        included, and its depth, 1 for a loop no loop is around.
+        """
+        parent = self.parent
+        self.children = {header: [] for header in parent}
+        for header, outer in parent.items():
+            if outer is not None:
+                self.children[outer].append(header)
+        self.preorder, self.span, self.depth = [], {}, {}
+        # The loops at each depth and where their spans start, in order
+        self.levels = {}
+        stack = [(header, False) for header in parent if parent[header] is None]
+        while stack:
+            header, done = stack.pop()
+            if done:
+                self.span[header] = (self.span[header], len(self.preorder))
+                continue
+            outer = parent[header]
+            depth = self.depth[header] = 1 if outer is None else self.depth[outer] + 1
+            starts, loops = self.levels.setdefault(depth, ([], []))
+            starts.append(len(self.preorder))
+            loops.append(header)
+            self.span[header] = len(self.preorder)
+            self.preorder.append(header)
+            stack.append((header, True))
+            stack.extend((child, False) for child in self.children[header])
+
+    def contains(self, outer, loop):
+        """Whether `loop` is `outer` or inside it."""
+        start, end = self.span[outer]
+        return start <= self.span[loop][0] < end
+
+    def enclosing(self, loop, depth):
+        """The loop at `depth` around `loop`."""
+        starts, loops = self.levels[depth]
+        return loops[bisect.bisect_right(starts, self.span[loop][0]) - 1]
+
+    def destination(self, instruction, loop, may_trap):
+        """The outermost loop around `instruction`, in `loop`, that it can move out of, or None.
+
+        `may_trap` is whether it can move out of `loop` although it traps.
+        """
+        if instruction.op in ir.PURE:
+            # The depth of the innermost loop around `loop` that an arg is in
+            ceiling = 0
+            for arg in instruction.args:
+                outer = self.innermost.get(arg.block)
+                while outer is not None and not self.contains(outer, loop):
+                    outer = self.parent[outer]
+                if outer is loop:
+                    return None
+                if outer is not None:
+                    ceiling = max(ceiling, self.depth[outer])
+            return self.enclosing(loop, ceiling + 1)
+        target = None
+        while loop is not None and self.summaries[loop].allows(instruction, may_trap):
+            for arg in instruction.args:
+                outer = self.innermost.get(arg.block)
+                if outer is not None and self.contains(loop, outer):
+                    return target
+            target, loop, may_trap = loop, self.parent[loop], False
+        return target
+
+
+class LoopSummary:
+    """What the blocks of a loop may change: the addresses stored to, the globals written and whether it calls."""
+    __slots__ = ('stores', 'written', 'calls')
+
+    def __init__(self, blocks):
+        self.stores, self.written, self.calls = [], set(), False
+        for block in blocks:
+            for instruction in block.instructions:
+                if instruction.op == 'store':
+                    self.stores.append(instruction.args[0])
+                elif instruction.op == 'global.set':
+                    self.written.add(instruction.attr)
+                elif instruction.op == 'call':
+                    self.calls = True
+
+    def include(self, inner):
+        """Add what a loop inside this one changes."""
+        self.stores.extend(inner.stores)
+        self.written |= inner.written
+        self.calls = self.calls or inner.calls
+
+    def allows(self, instruction, may_trap):
+        """Whether nothing in the loop changes the result of `instruction`, whose args are invariant.
+
+        `may_trap` is whether it may move although it traps.
+        """
+        op = instruction.op
+        if op in ir.PURE:
+            return True
+        if op == 'global.get':
+            return not self.calls and instruction.attr not in self.written
+        if op in ('i32.div_s', 'i32.rem_s'):
+            return may_trap
+        if op == 'load':
+            address = instruction.args[0]
+            return may_trap and not self.calls and not any(may_alias(store, address) for store in self.stores)
+        return False
+
+
+#######################################
+# PASSES
+#######################################
+
+# (name, pass) in the order they run
+PASSES = [
+    ('gvn', ValueNumbering),
+    ('licm', LoopInvariantCodeMotion),
+]
+
+
+def optimize(module):
+    """Run the passes over every function of `module`."""
+    for function in module.all_functions():
+        optimize_function(function)
+    return module
+
+
+def optimize_function(function):
+    """Run the passes over `function`, which only depends on itself."""
+    for name, ir_pass in PASSES:
+        ir_pass(function).run()
+    return function
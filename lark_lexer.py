@@ -0,0 +1,167 @@
+from lark.lexer import Lexer as LarkLexer, Token as LarkToken
+import lexer
+
+#######################################
+# TOKEN -> TERMINAL TABLES
+#######################################
+
+# Terminal names used by mygrammar.lark, keyed by the value of the lexer token.
+# Names starting with an underscore are filtered out of the parse tree by Lark,
+# which keeps the tree shape the transformer in asttransformer.py expects.
+KEYWORD_TERMINALS = {
+    'eternal': 'ETERNAL',
+    'invoke': 'INVOKE',
+    'preach': 'KEYWORD_PREACH',
+    'belief': 'KEYWORD_BELIEF',
+    'else': 'KEYWORD_ELSE',
+    'pledge': 'KEYWORD_PLEDGE',
+    'oath': 'KEYWORD_OATH',
+    'chant': 'KEYWORD_CHANT',
+    'persist': 'KEYWORD_PERSIST',
+    'retreat': 'KEYWORD_RETREAT',
+    'deliver': 'KEYWORD_DELIVER',
+    'trial': 'KEYWORD_TRIAL',
+    'mercy': 'KEYWORD_MERCY',
+    'condemn': 'KEYWORD_CONDEMN',
+}
+
+TYPE_KEYWORD_TERMINALS = {
+    'void': 'VOID',
+    'char': 'CHAR',
+    'int': 'INT',
+    'float': 'FLOAT',
+    'bool': 'BOOL',
+    'str': 'STR',
+    'tuple': '_TUPLE',
+    'list': '_LIST',
+    'array': '_ARRAY',
+}
+
+UTILITY_TERMINALS = {
+    'head': 'HEAD',
+    'tail': 'TAIL',
+    'length': 'LENGTH',
+    'cons': 'CONS',
+    'append': 'APPEND',
+    'insert': 'INSERT',
+    'remove': 'REMOVE',
+    'unite': 'UNITE',
+}
+
+OPERATOR_TERMINALS = {
+    '+': 'PLUS',
+    '-': 'MINUS',
+    '*': 'MULTIPLY',
+    '/': 'DIVIDE',
+    '%': 'MODULO',
+    '<': 'LT',
+    '>': 'GT',
+    '<=': 'LEQ',
+    '>=': 'GEQ',
+    '==': 'EQ',
+    '!=': 'NEQ',
+    '&&': 'AND',
+    '||': 'OR',
+    '&': 'BIT_AND',
+    '!': 'NOT',
+    '?': 'QUESTION',
+    '=': 'ASSIGN',
+    '++': 'INCREMENT',
+    '--': 'DECREMENT',
+    '*=': 'MULTIPLY_ASSIGN',
+    '/=': 'DIVIDE_ASSIGN',
+    '%=': 'MODULO_ASSIGN',
+    '+=': 'ADD_ASSIGN',
+    '-=': 'SUBTRACT_ASSIGN',
+}
+
+SYMBOL_TERMINALS = {
+    ',': '_COMMA',
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    '{': 'LBRACE',
+    '}': 'RBRACE',
+    '[': 'LBRACKET',
+    ']': 'RBRACKET',
+    ':': 'COLON',
+    "'": 'QUOTE',
+    '"': 'DOUBLE_QUOTE',
+    '.': 'DOT',
+}
+
+# Token classes whose terminal does not depend on the token value
+LITERAL_TERMINALS = {
+    lexer.Identifier: 'IDENTIFIER',
+    lexer.Int: 'INT_LITERAL',
+    lexer.Float: 'FLOAT_LITERAL',
+    lexer.Bool: 'BOOL_LITERAL',
+    lexer.StringToken: 'STRING_LITERAL',
+    lexer.CharToken: 'CHAR_LITERAL',
+    lexer.EndOfStatement: '_SEMICOLON',
+}
+
+VALUE_TERMINALS = {
+    lexer.Keyword: KEYWORD_TERMINALS,
+    lexer.TypeKeyword: TYPE_KEYWORD_TERMINALS,
+    lexer.UtilityFunction: UTILITY_TERMINALS,
+    lexer.Operator: OPERATOR_TERMINALS,
+    lexer.Symbols: SYMBOL_TERMINALS,
+}
+
+
+def terminal_name(token):
+    """Return the grammar terminal matching a token from lexer.Lexer."""
+    return kind_terminal(type(token), token.value)
+
+
+def kind_terminal(token_class, value):
+    """Return the grammar terminal for a token class and value."""
+    terminal = LITERAL_TERMINALS.get(token_class)
+    if terminal is not None:
+        return terminal
+    table = VALUE_TERMINALS.get(token_class)
+    if table is not None and value in table:
+        return table[value]
+    raise ValueError(f"No grammar terminal for token {token_class(value)!r}")
+
+
+def grammar_terminals(rules):
+    """Names of the terminals used by a Lark parser's rules.
+
+    mygrammar.lark %declares every terminal for TokenStreamLexer, so Lark
+    keeps no TerminalDefs of its own and ``Lark.terminals`` is empty.
+    """
+    return {symbol.name for rule in rules for symbol in rule.expansion if symbol.is_term}
+
+
+#######################################
+# LARK LEXER
+#######################################
+
+
+class TokenStreamLexer(LarkLexer):
+    """Lark lexer that consumes the token list from lexer.Lexer.make_tokens(),
+    or a lexer.TokenBuffer.
+
+    Passing this class as ``lexer=`` to ``Lark`` lets ``parser.parse(tokens)``
+    take the token list directly, so the source is never re-serialized into
+    text and re-lexed by Lark.
+    """
+
+    def __init__(self, lexer_conf):
+        pass
+
+    def lex(self, tokens):
+        if isinstance(tokens, lexer.TokenBuffer):
+            yield from self.lex_buffer(tokens)
+            return
+        for token in tokens:
+            yield LarkToken(terminal_name(token), token.value)
+
+    def lex_buffer(self, buffer):
+        # Read kinds and values from the buffer instead of building its token objects
+        values = buffer.values
+        for kind, value_id, start, end in zip(buffer.kinds, buffer.value_ids, buffer.starts, buffer.ends):
+            value = values[value_id]
+            yield LarkToken(kind_terminal(lexer.TOKEN_KINDS[kind], value), value,
+                            start_pos=start, end_pos=end)
@@ -1,4 +1,6 @@
-from fractions import Fraction
+import re
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
 from typing import Optional, NewType, Union, List
 #######################################
@@ -8,14 +10,14 @@ from typing import Optional, NewType, Union, List
 DIGITS = '0123456789'
 keywords = "eternal belief else chant pledge oath preach invoke deliver persist retreat trial mercy condemn".split()
 booleans = "myth truth".split()
-type_keywords = "int float char bool str tuple list array".split()
+type_keywords = "int float char bool str void tuple list array".split()
 whitespace = [" ", "\n", "\f", "\t", "\r", "\v"]
 symbols = ", ( ) { } [ ] : ' \" .".split()
 
 utils = "cons head tail append insert remove length unite".split()
 
 endofstmt=";".split()
-symbolic_operators = "+ - * / < > <= >= == != && || ! ? = ++ -- *= %= /=".split()
+symbolic_operators = "+ - * / % & < > <= >= == != && || ! ? = ++ -- *= %= /= += -=".split()
 
 #######################################
 # ERRORS
@@ -28,8 +30,6 @@ class Error:
         self.pos_end = pos_end
         self.error_name = error_name
         self.details = details
-        # Automatically print the error details upon instantiation
-        print(self.as_string())
 
     def as_string(self):
         result = f'{self.error_name}: {self.details}\n'
@@ -39,7 +39,14 @@ class Error:
 class IllegalCharError(Error):
     def __init__(self, pos_start, pos_end, details):
         super().__init__(pos_start, pos_end, 'Illegal Character', details)
-        # No need to add a print statement here since it's already in the parent class
+
+
+class LexError(Exception):
+    """Raised by RegexLexer.iter_tokens(), which cannot return an error."""
+
+    def __init__(self, error):
+        super().__init__(error.details)
+        self.error = error
 
 
 
@@ -48,27 +55,53 @@ class IllegalCharError(Error):
 #######################################
 
 
+class LineIndex:
+  """Start offsets of the lines of a text, built the first time a line is asked for.
+
+  A binary search turns an offset into its line and column, so nothing has
+  to count lines while lexing. Offsets into bytes-like text count bytes, so
+  their columns are counted in decoded characters, as they are for a str.
+  """
+
+  def __init__(self, text):
+    self.text = text
+    self.line_starts = None
+
+  def line_col(self, offset):
+    if self.line_starts is None:
+      newline = '\n' if isinstance(self.text, str) else b'\n'
+      self.line_starts = array('Q', [0])
+      self.line_starts.extend(m.end() for m in re.finditer(newline, self.text))
+      if isinstance(self.text, str):
+        self.text = None  # Only the offsets are needed from here on
+    ln = bisect_right(self.line_starts, offset) - 1
+    line_start = self.line_starts[ln]
+    if self.text is None:
+      return ln, offset - line_start
+    return ln, len(self.text[line_start:offset].decode('utf-8', 'replace'))
+
+
 class Position:
 
-  def __init__(self, idx, ln, col, fn, ftxt):
+  def __init__(self, idx, fn, lines):
     self.idx = idx
-    self.ln = ln
-    self.col = col
     self.fn = fn  #filename
-    self.ftxt = ftxt  #filetext
+    self.lines = lines  #LineIndex of the file text
 
-  def advance(self, current_char):
-    self.idx += 1
-    self.col += 1
+  @property
+  def ln(self):
+    return self.lines.line_col(self.idx)[0]
 
-    if current_char == '\n':
-      self.ln += 1
-      self.col = 0
+  @property
+  def col(self):
+    return self.lines.line_col(self.idx)[1]
 
+  def advance(self):
+    self.idx += 1
     return self
 
   def copy(self):
-    return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+    return Position(self.idx, self.fn, self.lines)
 
 
 #######################################
@@ -164,14 +197,14 @@ class Lexer:
   def __init__(self, fn, text):
     self.fn = fn
     self.text = text
-    self.pos = Position(-1, 0, -1, fn, text)
+    self.pos = Position(-1, fn, LineIndex(text))
     self.current_char = None
     self.advance()
     self.single_char_tokens, self.double_char_tokens = self.generate_token_mappings(
     )
 
   def advance(self):
-    self.pos.advance(self.current_char)
+    self.pos.advance()
     self.current_char = self.text[self.pos.idx] if self.pos.idx < len(
         self.text) else None
 
@@ -206,7 +239,7 @@ class Lexer:
     while self.current_char is not None:
       if self.current_char in whitespace:
         self.advance()
-      elif self.current_char in DIGITS or self.current_char == '-':
+      elif self.current_char in DIGITS or (self.current_char == '-' and self.starts_negative_number(tokens)):
         tokens.append(self.make_number())
       elif self.current_char == ';':
         tokens.append(EndOfStatement(';'))
@@ -243,6 +276,19 @@ class Lexer:
           return [], error  # Return an empty list and the error object
     return tokens, None
 
+  def starts_negative_number(self, tokens):
+    """A '-' starts a number only if a digit follows and it cannot be a binary minus."""
+    if not self.peek().isdigit():
+      return False
+    if not tokens:
+      return True
+    previous = tokens[-1]
+    if isinstance(previous, (Int, Float, Bool, Identifier, UtilityFunction, StringToken, CharToken)):
+      return False
+    if isinstance(previous, (Symbols, Operator)) and previous.value in (')', ']', '++', '--'):
+      return False
+    return True
+
   def skip_comment(self):
     while self.current_char is not None and self.current_char != '\n':
       self.advance()
@@ -358,8 +404,410 @@ class Lexer:
       else:
           return Int(int(num_str))
 
+
+#######################################
+# TOKEN BUFFER
+#######################################
+
+# Token classes in kind code order; TokenBuffer.kinds stores indexes into this tuple
+TOKEN_KINDS = (Int, Float, Bool, EndOfStatement, Keyword, Identifier, Operator, Symbols,
+               StringToken, TypeKeyword, UtilityFunction, CharToken)
+KIND_CODES = {token_class: code for code, token_class in enumerate(TOKEN_KINDS)}
+(INT_KIND, FLOAT_KIND, BOOL_KIND, END_OF_STATEMENT_KIND, KEYWORD_KIND, IDENTIFIER_KIND, OPERATOR_KIND,
+ SYMBOL_KIND, STRING_KIND, TYPE_KEYWORD_KIND, UTILITY_KIND, CHAR_KIND) = range(len(TOKEN_KINDS))
+OPERAND_KINDS = {INT_KIND, FLOAT_KIND, BOOL_KIND, IDENTIFIER_KIND, UTILITY_KIND, STRING_KIND, CHAR_KIND}
+
+
+def value_key(kind, value):
+  # Strings are their own key; other values keep their kind so 1, 1.0 and truth stay apart
+  return value if type(value) is str else (kind, value)
+
+
+class TokenBuffer:
+  """Struct-of-arrays token stream.
+
+  Token i is a TOKEN_KINDS[kinds[i]] spanning text[starts[i]:ends[i]] whose
+  value is values[value_ids[i]]. Values are interned, so every use of a name
+  shares one string. Indexing or iterating gives back the token dataclasses,
+  built once per distinct token.
+  """
+
+  def __init__(self, fn, text=None):
+    self.fn = fn
+    self.text = text
+    self.lines = LineIndex(text) if text is not None else None
+    self.kinds = array('B')
+    self.starts = array('I')
+    self.ends = array('I')
+    self.value_ids = array('I')
+    self.values = []
+    self.value_index = {}
+    self.token_cache = {}
+
+  @classmethod
+  def from_tokens(cls, fn, tokens):
+    """Pack a token list; without source text every offset is 0."""
+    buffer = cls(fn)
+    for token in tokens:
+      kind = KIND_CODES[type(token)]
+      buffer.append(kind, 0, 0, buffer.intern(kind, token.value))
+    return buffer
+
+  def intern(self, kind, value):
+    key = value_key(kind, value)
+    value_id = self.value_index.get(key)
+    if value_id is None:
+      value_id = self.value_index[key] = len(self.values)
+      self.values.append(value)
+    return value_id
+
+  def append(self, kind, start, end, value_id):
+    self.kinds.append(kind)
+    self.starts.append(start)
+    self.ends.append(end)
+    self.value_ids.append(value_id)
+
+  def __len__(self):
+    return len(self.kinds)
+
+  def kind(self, idx):
+    return TOKEN_KINDS[self.kinds[idx]]
+
+  def value(self, idx):
+    return self.values[self.value_ids[idx]]
+
+  def position(self, offset):
+    return Position(offset, self.fn, self.lines)
+
+  def token(self, kind, value_id):
+    key = value_id << 4 | kind
+    token = self.token_cache.get(key)
+    if token is None:
+      token = self.token_cache[key] = TOKEN_KINDS[kind](self.values[value_id])
+    return token
+
+  def __getitem__(self, idx):
+    return self.token(self.kinds[idx], self.value_ids[idx])
+
+  def __iter__(self):
+    token = self.token
+    for kind, value_id in zip(self.kinds, self.value_ids):
+      yield token(kind, value_id)
+
+  def tokens(self):
+    return list(self)
+
+  def entries(self):
+    """Yield (kind, start, end, value) per token, as RegexLexer.iter_tokens() does."""
+    values = self.values
+    for kind, start, end, value_id in zip(self.kinds, self.starts, self.ends, self.value_ids):
+      yield kind, start, end, values[value_id]
+
+
+#######################################
+# REGEX LEXER
+#######################################
+
+# One alternation matches the next token, after skipping any whitespace and
+# comments in front of it. Longer operators come first so '<=' is never read
+# as '<' followed by '='. The last groups catch malformed input and the end of
+# the text, so every match starts where the previous one ended.
+MASTER_PATTERN = re.compile(r"""
+    (?:[ \n\f\t\r\v]+|//[^\n]*\n?)*
+    (?:
+      (?P<identifier>[^\W\d_]\w*)
+    | (?P<symbol>[,(){}\[\]:.])
+    | (?P<operator>""" + '|'.join(re.escape(op) for op in sorted(symbolic_operators, key=len, reverse=True)) + r""")
+    | (?P<end_of_statement>;)
+    | (?P<number>\d[\d.]*)
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<char>'(?:\\[nrt\\']|[^\\])')
+    | (?P<string_start>")
+    | (?P<char_start>')
+    | (?P<illegal>[^ \n\f\t\r\v])
+    | (?P<end_of_text>\Z)
+    )
+""", re.VERBOSE | re.DOTALL)
+# The same pattern for bytes-like text, such as an mmap of the source file. A
+# bytes class only knows ASCII letters, so every non-ASCII byte is taken as part
+# of an identifier, and the decoded word is checked against IDENTIFIER_PATTERN.
+BYTES_MASTER_PATTERN = re.compile(MASTER_PATTERN.pattern.replace(
+    r"(?P<identifier>[^\W\d_]\w*)", r"(?P<identifier>(?:[^\W\d_]|[\x80-\xff])(?:\w|[\x80-\xff])*)"
+).encode(), re.VERBOSE | re.DOTALL)
+IDENTIFIER_PATTERN = re.compile(r"[^\W\d_]\w*")
+
+STRING_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+STRING_ESCAPES = {'n': '\n', '"': '"'}  # Any other escaped character is dropped
+# Escapes accepted in char literals; as in Lexer.make_char, '\\r' gives 'r'
+CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': 'r', '\\': '\\', "'": "'"}
+
+# Single table mapping every reserved word to its token
+RESERVED_WORDS = {}
+RESERVED_WORDS.update((word, Keyword(word)) for word in keywords)
+RESERVED_WORDS.update((word, Bool(word == 'truth')) for word in booleans)
+RESERVED_WORDS.update((word, TypeKeyword(word)) for word in type_keywords)
+RESERVED_WORDS.update((word, UtilityFunction(word)) for word in utils)
+
+# Tokens that stand for themselves are shared instead of rebuilt every time
+OPERATOR_TOKENS = {op: Operator(op) for op in symbolic_operators}
+SYMBOL_TOKENS = {sym: Symbols(sym) for sym in symbols}
+END_OF_STATEMENT = EndOfStatement(';')
+MINUS = OPERATOR_TOKENS['-']
+OPERAND_TOKENS = (Int, Float, Bool, Identifier, UtilityFunction, StringToken, CharToken)
+
+# (kind, value) of every reserved word and punctuation mark, keyed by its lexeme
+LEXEME_TOKENS = {}
+for lexeme, token in [*RESERVED_WORDS.items(), *OPERATOR_TOKENS.items(), *SYMBOL_TOKENS.items(),
+                      (';', END_OF_STATEMENT)]:
+  LEXEME_TOKENS[lexeme] = (KIND_CODES[type(token)], token.value)
+BYTES_LEXEME_TOKENS = {lexeme.encode(): entry for lexeme, entry in LEXEME_TOKENS.items()}
+# A '-' after one of these is a binary minus rather than the sign of a number
+CLOSING_VALUES = {')', ']', '++', '--'}
+
+
+class RegexLexer:
+  """Single pass lexer driven by MASTER_PATTERN.
+
+  Produces the same tokens and errors as Lexer without tracking a Position
+  per character; positions are only computed when an error is reported.
+  Only text[start:end] is lexed, and offsets always index into `text`.
+  iter_tokens() also accepts bytes-like text, such as an mmap of the file.
+
+  With a `report` callback, iter_tokens() hands it each error and skips the
+  malformed text instead of stopping there.
+  """
+
+  def __init__(self, fn, text, start=0, end=None, report=None):
+    self.fn = fn
+    self.text = text
+    self.start = start
+    self.end = len(text) if end is None else end
+    self.lines = LineIndex(text)
+    self.report = report
+
+  def position(self, idx):
+    return Position(idx, self.fn, self.lines)
+
+  def illegal(self, start, end, details):
+    return IllegalCharError(self.position(start), self.position(end), details)
+
+  def fail(self, error):
+    """Raise LexError, or pass the error to `report` and let lexing go on."""
+    if self.report is None:
+      raise LexError(error)
+    self.report(error)
+
+  def source(self, start, end):
+    """text[start:end] as a str."""
+    chunk = self.text[start:end]
+    return chunk if type(chunk) is str else chunk.decode('utf-8', 'replace')
+
+  def make_tokens(self):
+    """Lex a str source into a list of token dataclasses."""
+    tokens = []
+    append = tokens.append
+    for m in MASTER_PATTERN.finditer(self.text, self.start, self.end):
+      kind = m.lastgroup
+      if kind == 'identifier':
+        word = m.group(kind)
+        token = RESERVED_WORDS.get(word)
+        append(token if token is not None else Identifier(word))
+      elif kind == 'symbol':
+        append(SYMBOL_TOKENS[m.group(kind)])
+      elif kind == 'operator':
+        append(OPERATOR_TOKENS[m.group(kind)])
+      elif kind == 'end_of_statement':
+        append(END_OF_STATEMENT)
+      elif kind == 'number':
+        num_start = m.start(kind)
+        # A '-' directly before the digits is a sign unless it can be a binary minus
+        if tokens and tokens[-1] is MINUS and m.start() == num_start and self.text[num_start - 1] == '-' \
+            and (len(tokens) < 2 or not self.ends_operand(tokens[-2])):
+          tokens.pop()
+          num_start -= 1
+        token, error = self.make_number(num_start, self.text[num_start:m.end()])
+        if error:
+          return [], error
+        append(token)
+      elif kind == 'string':
+        append(StringToken(self.string_value(m.group(kind)[1:-1])))
+      elif kind == 'char':
+        append(CharToken(self.char_value(m.group(kind)[1:-1])))
+      elif kind == 'string_start':
+        return [], self.illegal(self.end, self.end, "Expected '\"' at the end of string")
+      elif kind == 'char_start':
+        return [], self.char_error(m.start(kind))
+      elif kind == 'end_of_text':
+        break
+      else:
+        idx = m.start(kind)
+        return [], self.illegal(idx, idx + 1, "Unable to identify character: " + self.text[idx])
+    return tokens, None
+
+  def iter_tokens(self):
+    """Yield (kind, start, end, value) for each token, one at a time.
+
+    Memory stays bounded however long the text is. Malformed input raises
+    LexError once the tokens in front of it have been yielded; when errors
+    are reported instead, the bad token is dropped.
+    """
+    text = self.text
+    if isinstance(text, str):
+      pattern, lexemes, decode = MASTER_PATTERN, LEXEME_TOKENS, None
+    else:
+      pattern, lexemes, decode = BYTES_MASTER_PATTERN, BYTES_LEXEME_TOKENS, bytes.decode
+    names = {}  # Each distinct identifier is decoded once and then shared
+    held = None  # A '-' that may be the sign of the number right after it
+    held_is_sign = after_operand = False
+    pos = self.start  # Where lexing starts again after an error skipped some text
+    while pos is not None:
+      restart, pos = pos, None
+      for m in pattern.finditer(text, restart, self.end):
+        group = m.lastgroup
+        start, end = m.span(group)
+        if group == 'identifier':
+          word = m.group(group)
+          entry = lexemes.get(word)
+          if entry is not None:
+            kind, value = entry
+          else:
+            kind = IDENTIFIER_KIND
+            value = names.get(word)
+            if value is None:
+              value = word if decode is None else decode(word, 'utf-8', 'surrogateescape')
+              letters = IDENTIFIER_PATTERN.match(value)
+              if letters is not None and letters.end() == len(value):
+                names[word] = value
+              elif letters is None:
+                # A non-ASCII character no identifier may start with; start again after it
+                bad = value[0]
+                pos = start + len(bad.encode('utf-8', 'surrogateescape'))
+                shown = '\ufffd' if '\udc80' <= bad <= '\udcff' else bad
+                self.fail(self.illegal(start, pos, "Unable to identify character: " + shown))
+                break
+              else:
+                # The identifier ends where a str source would end it; the rest is lexed again
+                value = letters.group()
+                pos = end = start + len(value.encode())
+        elif group == 'symbol' or group == 'operator' or group == 'end_of_statement':
+          kind, value = lexemes[m.group(group)]
+        elif group == 'number':
+          if held is not None and held_is_sign and held[2] == start:
+            start = held[1]
+            held = None
+          value, error = self.number_value(start, self.source(start, end))
+          if error:
+            self.fail(error)
+            continue
+          kind = FLOAT_KIND if type(value) is float else INT_KIND
+        elif group == 'string':
+          kind, value = STRING_KIND, self.string_value(self.source(start + 1, end - 1))
+        elif group == 'char':
+          kind, value = CHAR_KIND, self.char_value(self.source(start + 1, end - 1))
+        elif group == 'string_start':
+          # The unterminated string runs to the end of the text
+          self.fail(self.illegal(self.end, self.end, "Expected '\"' at the end of string"))
+          break
+        elif group == 'char_start':
+          self.fail(self.char_error(start))
+          # Start again after the rest of the malformed literal
+          pos = self.char_literal_end(start)
+          break
+        elif group == 'end_of_text':
+          break
+        else:
+          self.fail(self.illegal(start, start + 1, "Unable to identify character: " + self.source(start, start + 1)))
+          continue
+
+        if held is not None:
+          yield held
+          held = None
+        if kind == OPERATOR_KIND and value == '-':
+          held = (kind, start, end, value)
+          held_is_sign = not after_operand
+        else:
+          yield kind, start, end, value
+        after_operand = kind in OPERAND_KINDS or (kind == SYMBOL_KIND or kind == OPERATOR_KIND) and value in CLOSING_VALUES
+        if pos is not None:
+          break
+    if held is not None:
+      yield held
+
+  def make_token_buffer(self):
+    """Lex into a TokenBuffer, interning every token value."""
+    buffer = TokenBuffer(self.fn, self.text)
+    buffer.lines = self.lines
+    add_kind, add_start, add_end, add_value_id = (buffer.kinds.append, buffer.starts.append,
+                                                  buffer.ends.append, buffer.value_ids.append)
+    intern, value_index = buffer.intern, buffer.value_index
+    try:
+      for kind, start, end, value in self.iter_tokens():
+        value_id = value_index.get(value if type(value) is str else (kind, value))
+        if value_id is None:
+          value_id = intern(kind, value)
+        add_kind(kind)
+        add_start(start)
+        add_end(end)
+        add_value_id(value_id)
+    except LexError as e:
+      return [], e.error
+    return buffer, None
+
+  def ends_operand(self, token):
+    if isinstance(token, OPERAND_TOKENS):
+      return True
+    return isinstance(token, (Symbols, Operator)) and token.value in CLOSING_VALUES
+
+  def make_number(self, idx, num_str):
+    value, error = self.number_value(idx, num_str)
+    if error:
+      return None, error
+    return (Float if type(value) is float else Int)(value), None
+
+  def number_value(self, idx, num_str):
+    dot_count = num_str.count('.')
+    if dot_count > 1:
+      second_dot = num_str.index('.', num_str.index('.') + 1)
+      return None, self.illegal(idx, idx + second_dot,
+                                f"Multiple decimal points found in number '{num_str[:second_dot]}'")
+    if dot_count:
+      return float(num_str), None
+    return int(num_str), None
+
+  def string_value(self, string_val):
+    if '\\' in string_val:
+      string_val = STRING_ESCAPE.sub(lambda e: STRING_ESCAPES.get(e.group(1), ''), string_val)
+    return string_val
+
+  def char_value(self, char_val):
+    if char_val[0] == '\\':
+      return CHAR_ESCAPES[char_val[1]]
+    return char_val
+
+  def char_literal_end(self, idx):
+    """The offset after the closing quote of the malformed char literal at `idx`, if it is on the same line."""
+    quote, newline = ("'", '\n') if isinstance(self.text, str) else (b"'", b'\n')
+    line_end = self.text.find(newline, idx + 1, self.end)
+    close = self.text.find(quote, idx + 1, self.end if line_end < 0 else line_end)
+    return idx + 1 if close < 0 else close + 1
+
+  def char_error(self, idx):
+    window = self.source(idx, min(idx + 3, self.end))
+    if window.startswith('\\', 1):
+      escape = window[2] if len(window) > 2 else None
+      if escape not in CHAR_ESCAPES:
+        return self.illegal(idx, idx + 2, f"Unknown escape sequence '\\{escape}'")
+    return self.illegal(idx, min(idx + 2, self.end),
+                        "Character literals must be single characters enclosed in single quotes")
+
+
 def run(fn, text):
-  lexer = Lexer(fn, text)
+  lexer = RegexLexer(fn, text)
   tokens, error = lexer.make_tokens()
 
   return tokens, error
+
+
+def run_buffer(fn, text, start=0, end=None):
+  """Lex text[start:end] into a TokenBuffer instead of a token list."""
+  return RegexLexer(fn, text, start, end).make_token_buffer()
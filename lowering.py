@@ -0,0 +1,585 @@
+import ir
+from ir import IRError
+from optimizer import walk
+from visitor import Visitor, handles
+from wasm_generator import BINARY_INSTRUCTIONS, FLOAT_INSTRUCTIONS, VALUE_TYPES
+
+# Lowering of an analyzed Program to an ir.Module. It relies on what
+# SemanticAnalyzer annotated: node.type for the type of each expression and
+# node.binding for the declaration each identifier refers to. A variable is
+# known by binding.local, which is unique within its function; variables
+# declared at the top level are WebAssembly globals, the others become SSA
+# values as they are assigned.
+#
+# The top-level statements go into the module's start function, and each
+# FunctionDefinition into a Function of its own.
+
+#######################################
+# CONSTANTS
+#######################################
+
+# Operator each compound assignment applies before it stores
+COMPOUND_OPERATORS = {'+=': '+', '-=': '-', '*=': '*', '/=': '/', '%=': '%'}
+
+# Size in bytes of an array element; every value type is 32 bits wide
+ELEMENT_SIZE_SHIFT = 2
+
+# Preached strings are stored from here on, in the page after the first one:
+# hosts write the arrays they pass in from address 0, as the A7 tests do
+STRINGS_ADDRESS = 65536
+
+#######################################
+# HELPERS
+#######################################
+
+
+def value_type(type_name):
+    """The IR value type of a HolyScript type; arrays are an i32 address."""
+    return VALUE_TYPES.get(type_name, 'i32')
+
+
+def is_global(binding):
+    return binding.scope.parent is None
+
+
+def string_layout(node):
+    """The address of every string literal preached under `node`, one after the other in memory."""
+    layout = {}
+    address = STRINGS_ADDRESS
+    for item in walk(node):
+        if type(item).__name__ == 'PreachStatement' and type(item.expression).__name__ == 'StringLiteral':
+            text = item.expression.value
+            if text not in layout:
+                layout[text] = address
+                address += len(text.encode())
+    return layout
+
+
+def binary_operator(operator, operand_type, node):
+    """The IR operator of HolyScript `operator` on operands of IR type `operand_type`."""
+    instructions = FLOAT_INSTRUCTIONS if operand_type == 'f32' else BINARY_INSTRUCTIONS
+    op = instructions.get(operator)
+    if op is None:
+        raise IRError(f"Operator '{operator}' is not supported on {operand_type}", node)
+    return op
+
+
+def result_type(op):
+    return 'i32' if op in ir.COMPARISONS else ir.BINARY_OPERATORS[op]
+
+
+
+#######################################
+# BUILDER
+#######################################
+
+
+class Builder:
+    """Appends instructions to a function, putting its variables in SSA form as they are assigned.
+
+    Follows Braun et al., "Simple and Efficient Construction of Static Single
+    Assignment Form". write() records the value a variable has at the end of
+    the current block; read() looks it up, going back through the
+    predecessors, and adds a phi where they join. A block is sealed once all
+    its predecessors are known; until then reads there get an incomplete phi
+    whose args seal() fills in. Lookups walk the graph with explicit
+    worklists, so deeply nested code does not recurse.
+
+    The builder records which variables each loop writes. Once a loop is
+    lowered and its header sealed, a variable the loop leaves alone is
+    looked up in the block before the loop rather than getting a phi in the
+    header. Otherwise a variable read inside n nested loops would get a phi
+    in each of their headers, only for remove_trivial_phis() to take them
+    all out again.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        # variable -> {block: its value at the end of the block}
+        self.definitions = {}
+        # variable -> IR value type
+        self.types = {}
+        # block -> {variable: phi waiting for the block to be sealed}
+        self.incomplete = {}
+        self.sealed = set()
+        # Variables written in each loop being lowered, innermost last
+        self.written = []
+        # loop header -> variables its loop writes; the header's first predecessor enters the loop
+        self.loop_variables = {}
+        # (persist target, retreat target) of each enclosing loop, innermost last
+        self.loops = []
+        self.block = function.new_block()
+        self.seal(self.block)
+
+    #######################################
+    # INSTRUCTIONS
+    #######################################
+
+    def emit(self, op, type, args=(), attr=None):
+        value = self.function.new_value(op, type, args, attr, self.block)
+        self.block.instructions.append(value)
+        return value
+
+    def const(self, value, type):
+        return self.emit('const', type, attr=value)
+
+    def binary(self, op, left, right):
+        return self.emit(op, result_type(op), (left, right))
+
+    def terminate(self, op, args=(), targets=None):
+        block = self.block
+        block.terminator = self.function.new_value(op, None, args, targets, block)
+        for target in targets or ():
+            target.preds.append(block)
+        self.block = None
+
+    def jump(self, target):
+        self.terminate('jump', targets=(target,))
+
+    def branch(self, condition, if_true, if_false):
+        self.terminate('branch', (condition,), (if_true, if_false))
+
+    def switch(self, block):
+        """Continue appending in `block`."""
+        self.block = block
+
+    def new_block(self):
+        return self.function.new_block()
+
+    def unreachable_block(self):
+        """A block no edge leads to, for the statements after a jump; remove_unreachable() drops it."""
+        block = self.new_block()
+        self.seal(block)
+        return block
+
+    def finish(self):
+        """Close the last block and clean the function up once all of it is lowered."""
+        if self.function.result is None:
+            self.terminate('return')
+        else:
+            self.terminate('unreachable')  # Fell off the end without delivering
+        ir.remove_unreachable(self.function)
+        ir.remove_trivial_phis(self.function)
+        ir.remove_empty_blocks(self.function)
+
+    #######################################
+    # VARIABLES
+    #######################################
+
+    def declare(self, variable, type):
+        self.types[variable] = type
+        self.definitions.setdefault(variable, {})
+
+    def write(self, variable, value):
+        self.definitions[variable][self.block] = value
+        if self.written:
+            self.written[-1].add(variable)
+
+    def begin_loop(self):
+        """Start recording the variables written in a loop."""
+        self.written.append(set())
+
+    def end_loop(self, header):
+        """Stop recording, before `header` is sealed; writes in a loop are writes in the loops around it."""
+        written = self.written.pop()
+        if self.written:
+            self.written[-1] |= written
+        self.loop_variables[header] = written
+
+    def read(self, variable):
+        pending = []
+        value = self.find(variable, self.block, pending)
+        self.complete(variable, pending)
+        return value
+
+    def find(self, variable, block, pending):
+        """The value of `variable` at the end of `block`; phis it adds that still need args go in `pending`."""
+        definitions = self.definitions[variable]
+        path = []
+        while True:
+            value = definitions.get(block)
+            if value is not None:
+                break
+            path.append(block)
+            preds = block.preds
+            assigned = self.loop_variables.get(block)
+            if assigned is not None and variable not in assigned:
+                block = preds[0]
+                continue
+            if block not in self.sealed:
+                value = self.phi(block, variable)
+                self.incomplete.setdefault(block, {})[variable] = value
+            elif len(preds) == 1:
+                block = preds[0]
+                continue
+            elif not preds:
+                # Unreachable code, or a read before any assignment: a zero, as WAT locals start
+                value = ir.undefined(self.function, block, self.types[variable])
+            else:
+                value = self.phi(block, variable)
+                pending.append(value)
+            break
+        # Recorded before the phis get their args, so loops back to them find them
+        for visited in path:
+            definitions[visited] = value
+        return value
+
+    def complete(self, variable, pending):
+        """Give each phi in `pending` an arg per predecessor, adding the phis those need in turn."""
+        while pending:
+            phi = pending.pop()
+            preds = phi.block.preds
+            written = self.loop_variables.get(phi.block)
+            if written is not None and variable not in written:
+                # Read before the loop was lowered; it keeps the value it enters with
+                phi.args = [self.find(variable, preds[0], pending)] * len(preds)
+            else:
+                phi.args = [self.find(variable, pred, pending) for pred in preds]
+
+    def phi(self, block, variable):
+        phi = self.function.new_value('phi', self.types[variable], attr=variable, block=block)
+        block.phis.append(phi)
+        return phi
+
+    def seal(self, block):
+        """Record that every predecessor of `block` is known, and complete the phis read there before."""
+        self.sealed.add(block)
+        for variable, phi in self.incomplete.pop(block, {}).items():
+            self.complete(variable, [phi])
+
+
+#######################################
+# LOWERING
+#######################################
+
+
+class Lowering(Visitor):
+    """Build an ir.Module from an analyzed Program.
+
+    Statement handlers append to the Builder of the function being lowered;
+    expression handlers return the IR value of the expression. Constructs
+    the IR cannot express, such as tuples, raise IRError.
+    """
+
+    def __init__(self, strings):
+        self.module = ir.Module()
+        # string_layout() of the whole program
+        self.module.strings = strings
+        self.builder = None
+
+    def lower(self, node):
+        self.visit(node)
+        return self.module
+
+    def generic_visit(self, node):
+        raise IRError(f"{type(node).__name__} cannot be compiled yet", node)
+
+    #######################################
+    # STATEMENTS
+    #######################################
+
+    @handles('Program')
+    def handle_program(self, node):
+        self.builder = Builder(self.module.start)
+        for statement in node.statements:
+            yield statement
+        self.builder.finish()
+
+    @handles('FunctionDefinition')
+    def handle_function_definition(self, node):
+        return_type = node.return_type.type_keyword
+        function = ir.Function(node.name, [(name, value_type(type_keyword)) for type_keyword, name in node.parameters],
+                               None if return_type == 'void' else value_type(return_type))
+        if any(type_keyword.endswith('[]') for type_keyword, _ in node.parameters):
+            # The host writes the arrays it passes in into the exported memory
+            self.module.memory = True
+        enclosing = self.builder
+        self.builder = builder = Builder(function)
+        # The analyzer gives parameters their own name as local, being the first declared in the function
+        for index, (name, param_type) in enumerate(function.params):
+            builder.declare(name, param_type)
+            builder.write(name, builder.emit('param', param_type, attr=index))
+        yield node.body
+        builder.finish()
+        self.builder = enclosing
+        self.module.functions.append(function)
+
+    @handles('CompoundStatement')
+    def handle_compound_statement(self, node):
+        for statement in node.statements:
+            yield statement
+
+    @handles('ErrorStatement')
+    def handle_error_statement(self, node):
+        return None
+
+    @handles('VariableDeclaration')
+    def handle_variable_declaration(self, node):
+        assignment = node.assignment_expression
+        if node.declaration_specifier is not None:
+            binding = assignment.left.binding
+            if is_global(binding):
+                self.module.globals[binding.local] = value_type(binding.type)
+            else:
+                self.builder.declare(binding.local, value_type(binding.type))
+        yield assignment
+
+    @handles('PreachStatement')
+    def handle_preach_statement(self, node):
+        expression = node.expression
+        builder = self.builder
+        if type(expression).__name__ == 'StringLiteral':
+            # The host reads the UTF-8 text out of the exported memory
+            text = expression.value
+            self.module.imports['log_string'] = ['i32', 'i32']
+            builder.emit('call', None, (builder.const(self.module.strings[text], 'i32'),
+                                        builder.const(len(text.encode()), 'i32')), 'log_string')
+            return
+        value = yield expression
+        name = 'log_float' if value.type == 'f32' else 'log'
+        self.module.imports[name] = [value.type]
+        builder.emit('call', None, (value,), name)
+
+    @handles('IfStatement', 'SelectionStatement')
+    def handle_if_statement(self, node):
+        builder = self.builder
+        condition = yield node.condition
+        then_block = builder.new_block()
+        join = builder.new_block()
+        else_block = join if node.false_branch is None else builder.new_block()
+        builder.branch(condition, then_block, else_block)
+        builder.seal(then_block)
+        builder.switch(then_block)
+        yield node.true_branch
+        builder.jump(join)
+        if node.false_branch is not None:
+            builder.seal(else_block)
+            builder.switch(else_block)
+            yield node.false_branch
+            builder.jump(join)
+        builder.seal(join)
+        builder.switch(join)
+
+    @handles('WhileLoop')
+    def handle_while_loop(self, node):
+        builder = self.builder
+        header = builder.new_block()
+        builder.jump(header)
+        builder.begin_loop()
+        builder.switch(header)
+        condition = yield node.condition
+        body, exit = builder.new_block(), builder.new_block()
+        builder.branch(condition, body, exit)
+        builder.seal(body)
+        builder.loops.append((header, exit))
+        builder.switch(body)
+        yield node.body
+        builder.jump(header)
+        builder.loops.pop()
+        builder.end_loop(header)
+        builder.seal(header)
+        builder.seal(exit)
+        builder.switch(exit)
+
+    @handles('ForLoop')
+    def handle_for_loop(self, node):
+        builder = self.builder
+        yield node.init
+        header = builder.new_block()
+        builder.jump(header)
+        builder.begin_loop()
+        builder.switch(header)
+        body, exit = builder.new_block(), builder.new_block()
+        if node.condition is None:
+            builder.jump(body)
+        else:
+            builder.branch((yield node.condition), body, exit)
+        builder.seal(body)
+        # 'persist' goes on with the update
+        latch = builder.new_block()
+        builder.loops.append((latch, exit))
+        builder.switch(body)
+        yield node.body
+        builder.jump(latch)
+        builder.loops.pop()
+        builder.seal(latch)
+        builder.switch(latch)
+        if node.update is not None:
+            yield node.update
+        builder.jump(header)
+        builder.end_loop(header)
+        builder.seal(header)
+        builder.seal(exit)
+        builder.switch(exit)
+
+    @handles('DoWhileLoop')
+    def handle_do_while_loop(self, node):
+        builder = self.builder
+        body = builder.new_block()
+        builder.jump(body)
+        builder.begin_loop()
+        # 'persist' goes on with the condition
+        latch, exit = builder.new_block(), builder.new_block()
+        builder.loops.append((latch, exit))
+        builder.switch(body)
+        yield node.body
+        builder.jump(latch)
+        builder.loops.pop()
+        builder.seal(latch)
+        builder.switch(latch)
+        builder.branch((yield node.condition), body, exit)
+        builder.end_loop(body)
+        builder.seal(body)
+        builder.seal(exit)
+        builder.switch(exit)
+
+    @handles('JumpStatement')
+    def handle_jump_statement(self, node):
+        builder = self.builder
+        keyword = node.keyword
+        if keyword == 'deliver':
+            if node.expression is None:
+                builder.terminate('return')
+            else:
+                builder.terminate('return', ((yield node.expression),))
+        else:
+            if not builder.loops:
+                raise IRError(f"'{keyword}' used outside a loop", node)
+            persist_target, retreat_target = builder.loops[-1]
+            builder.jump(persist_target if keyword == 'persist' else retreat_target)
+        builder.switch(builder.unreachable_block())
+
+    #######################################
+    # EXPRESSIONS
+    #######################################
+
+    @handles('IntegerLiteral', 'IntLiteral', 'BoolLiteral')
+    def handle_integer_literal(self, node):
+        return self.builder.const(int(node.value), 'i32')
+
+    @handles('CharLiteral')
+    def handle_char_literal(self, node):
+        value = node.value
+        return self.builder.const(ord(value) if isinstance(value, str) else value, 'i32')
+
+    @handles('FloatLiteral')
+    def handle_float_literal(self, node):
+        return self.builder.const(float(node.value), 'f32')
+
+    @handles('Identifier')
+    def handle_identifier(self, node):
+        binding = node.binding
+        if is_global(binding):
+            return self.builder.emit('global.get', value_type(binding.type), attr=binding.local)
+        return self.builder.read(binding.local)
+
+    @handles('FunctionCall')
+    def handle_function_call(self, node):
+        arguments = []
+        for argument in node.arguments:
+            arguments.append((yield argument))
+        result = None if node.type == 'void' else value_type(node.type)
+        return self.builder.emit('call', result, arguments, node.name)
+
+    @handles('MemberAccessExpression')
+    def handle_member_access_expression(self, node):
+        if node.index is None:
+            return self.generic_visit(node)
+        address = yield from self.element_address(node)
+        return self.builder.emit('load', value_type(node.type), (address,))
+
+    @handles('BinaryExpression')
+    def handle_binary_expression(self, node):
+        operator = node.operator
+        if operator in ('&&', '||'):
+            return (yield from self.lower_logic(node))
+        if operator == '=' or operator in COMPOUND_OPERATORS:
+            return (yield from self.lower_assignment(node))
+        left = yield node.left
+        right = yield node.right
+        return self.builder.binary(binary_operator(operator, left.type, node), left, right)
+
+    @handles('UnaryExpression')
+    def handle_unary_expression(self, node):
+        # Only the postfix '++' and '--', which store and produce the old value
+        operator = getattr(node.operator, 'value', node.operator)
+        builder = self.builder
+        target = node.operand
+        operand_type = value_type(target.type)
+        op = binary_operator('+' if operator == '++' else '-', operand_type, node)
+        if type(target).__name__ == 'MemberAccessExpression' and target.index is not None:
+            address = yield from self.element_address(target)
+            old = builder.emit('load', operand_type, (address,))
+            builder.emit('store', None, (address, builder.binary(op, old, builder.const(1, operand_type))))
+            return old
+        old = yield target
+        self.assign(target, builder.binary(op, old, builder.const(1, operand_type)))
+        return old
+
+    def lower_logic(self, node):
+        """Evaluate the right operand of '&&' and '||' only when the left one does not decide the result."""
+        builder = self.builder
+        left = yield node.left
+        left_end = builder.block
+        right_block, join = builder.new_block(), builder.new_block()
+        if node.operator == '&&':
+            builder.branch(left, right_block, join)
+        else:
+            builder.branch(left, join, right_block)
+        builder.seal(right_block)
+        builder.switch(right_block)
+        right = yield node.right
+        right_end = builder.block
+        builder.jump(join)
+        builder.seal(join)
+        builder.switch(join)
+        # The left operand decided the result when control came straight from it
+        phi = self.builder.function.new_value('phi', 'i32', attr=node.operator, block=join)
+        phi.args = [left if pred is left_end else right for pred in join.preds]
+        join.phis.append(phi)
+        return phi
+
+    def lower_assignment(self, node):
+        builder = self.builder
+        target = node.left
+        operator = node.operator
+        if type(target).__name__ == 'MemberAccessExpression' and target.index is not None:
+            address = yield from self.element_address(target)
+            if operator == '=':
+                value = yield node.right
+            else:
+                old = builder.emit('load', value_type(target.type), (address,))
+                value = builder.binary(binary_operator(COMPOUND_OPERATORS[operator], old.type, node),
+                                       old, (yield node.right))
+            builder.emit('store', None, (address, value))
+            return value
+        if type(target).__name__ != 'Identifier':
+            raise IRError(f"Cannot assign to {type(target).__name__}", node)
+        if operator == '=':
+            value = yield node.right
+        else:
+            old = yield target
+            value = builder.binary(binary_operator(COMPOUND_OPERATORS[operator], old.type, node),
+                                   old, (yield node.right))
+        self.assign(target, value)
+        return value
+
+    def assign(self, identifier, value):
+        binding = identifier.binding
+        if is_global(binding):
+            self.builder.emit('global.set', None, (value,), binding.local)
+        else:
+            self.builder.write(binding.local, value)
+
+    def element_address(self, node):
+        """The address of element node.index of the array node.object_expr."""
+        builder = self.builder
+        base = yield node.object_expr
+        index = yield node.index
+        offset = builder.binary('i32.shl', index, builder.const(ELEMENT_SIZE_SHIFT, 'i32'))
+        return builder.binary('i32.add', base, offset)
+
+
+def lower(program):
+    """The ir.Module of analyzed `program`; raises IRError on what the IR cannot express yet."""
+    return Lowering(string_layout(program)).lower(program)
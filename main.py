@@ -1,97 +1,319 @@
 import sys
 import os
+import mmap
+import argparse
+import functools
+from types import GeneratorType
 import lexer
-from lark import Lark, Transformer, Tree
-from lark import ast_utils
-import asttransformer, astclasses
-from anytree import Node, RenderTree
-import astclasses
-from wasm_generator import WATGenerator  # Import the WAT generator
-import subprocess
-
-# Load your grammar from the file
-with open('mygrammar.lark') as file:
-    grammar = file.read()
-parser = Lark(grammar, start='start', parser='earley')
-
-transformer = ast_utils.create_transformer(sys.modules[__name__], asttransformer.ToAst())
+from visitor import Visitor, handles
+from symbols import SymbolTable
+from diagnostics import Diagnostics, TooManyErrors, FORMATS, MAX_ERRORS
+
+# Lark, the AST transformer, the WAT generator, the IR and subprocess are
+# imported by the stage that needs them, so `main.py --help` or a lex error never pays for them.
+
+# The grammar and its cache sit next to this file, wherever the compiler is run from
+COMPILER_DIR = os.path.dirname(os.path.abspath(__file__))
+GRAMMAR_FILE = os.path.join(COMPILER_DIR, 'mygrammar.lark')
+# Analyzed LALR tables, saved by Lark together with a hash of the grammar and
+# parser options; a grammar edit changes the hash and the tables are rebuilt
+GRAMMAR_CACHE = os.path.join(COMPILER_DIR, '__pycache__', 'mygrammar.lark.cache')
+
+def build_parser(algorithm='lalr', transformer=None):
+    # The grammar matches typed terminals, so the parser reads lexer tokens directly.
+    # The grammar is LALR(1); 'earley' is kept as a fallback.
+    # A LALR parser given a transformer calls it as each rule is reduced and
+    # returns the AST without building a parse tree.
+    from lark import Lark
+    from lark_lexer import TokenStreamLexer
+    with open(GRAMMAR_FILE) as file:
+        grammar = file.read()
+    if algorithm != 'lalr':
+        return Lark(grammar, start='start', parser=algorithm, lexer=TokenStreamLexer)
+    os.makedirs(os.path.dirname(GRAMMAR_CACHE), exist_ok=True)
+    if transformer is not None:
+        # The grammar %declares its terminals, so Lark calls no terminal callbacks itself
+        from asttransformer import InlineTerminals
+        transformer = InlineTerminals(transformer)
+    return Lark(grammar, start='start', parser='lalr', lexer=TokenStreamLexer, cache=GRAMMAR_CACHE,
+                transformer=transformer)
+
+# Built on first use by get_parser(), get_ast_parser() and get_transformer()
+parser = None
+ast_parser = None
+transformer = None
+# Set by --count-visits before the transformer is built
+count_visits = False
+
+def get_parser():
+    global parser
+    if parser is None:
+        parser = build_parser()
+    return parser
+
+def get_ast_parser():
+    global ast_parser
+    if ast_parser is None:
+        ast_parser = build_parser('lalr', get_transformer())
+    return ast_parser
+
+def get_transformer():
+    global transformer
+    if transformer is None:
+        from lark import ast_utils
+        import asttransformer
+        transformer = ast_utils.create_transformer(sys.modules[__name__], asttransformer.ToAst())
+        if count_visits:
+            from lark_lexer import grammar_terminals
+            rules = get_parser().rules
+            transformer.count_visits({rule.alias or rule.origin.name for rule in rules} | grammar_terminals(rules))
+    return transformer
+
+def parse_tokens(tokens):
+    """Parse a token list or lexer.TokenBuffer."""
+    return get_parser().parse(tokens)
+
+def parse_program(fn, tokens, parser_name='native'):
+    """Build the astclasses Program for a token list or buffer, returning (ast, error)."""
+    if parser_name == 'native':
+        import holyparser
+        return holyparser.run(fn, tokens)
+    from lark.exceptions import UnexpectedInput
+    try:
+        if parser_name == 'lalr':
+            return get_ast_parser().parse(tokens), None
+        return get_transformer().transform(parse_tokens(tokens)), None
+    except UnexpectedInput as e:
+        # Lark stops at its first syntax error; report it like the native parser does
+        return None, lark_syntax_error(fn, tokens, e)
+
+def lark_syntax_error(fn, tokens, e):
+    from holyparser import InvalidSyntaxError
+    token = getattr(e, 'token', None)
+    start = getattr(token, 'start_pos', None)
+    pos_start = pos_end = None
+    if start is not None and isinstance(tokens, lexer.TokenBuffer):
+        pos_start = lexer.Position(start, fn, tokens.lines)
+        pos_end = lexer.Position(token.end_pos, fn, tokens.lines)
+    found = repr(token.value) if token is not None else 'end of input'
+    return InvalidSyntaxError(fn, -1, f"Unexpected {found}", pos_start, pos_end)
+
+def report_visits():
+    """Print and reset the transformer visit counts of the last compile."""
+    if transformer is None or not hasattr(transformer, 'visits'):
+        print("Transformer visits: 0 (the native parser builds no parse tree)")
+        return
+    visits = transformer.visits
+    print(f"Transformer visits: {sum(visits.values())}")
+    for name, count in visits.most_common():
+        print(f"    {name}: {count}")
+    visits.clear()
 
 def read_holy_script_file(file_path):
+    """Memory-map the file read-only, so its text is never copied into a str."""
     try:
-        with open(file_path, 'r') as file:
-            content = file.read()
-            # print("File Content Read:", content)  # Debug: Print content to verify it's read correctly
-            return content
-    except IOError as e:
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''  # mmap cannot map an empty file
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, ValueError) as e:
         print(f"Error reading file {file_path}: {e}")
         return None
 
-class SemanticAnalyzer:
-    def __init__(self):
-        self.symbol_table = {}
-        self.scope_stack = ['global']
+def typed(handler):
+    """Store the type an expression handler returns in the node's `type` slot.
+
+    The analyzer types each expression once per run; the optimizer and the
+    WATGenerator read node.type rather than walking the expression again.
+    Types are written on every run, since incremental.py reuses statements
+    whose declarations may have changed.
+    """
+    @functools.wraps(handler)
+    def handle(self, node):
+        result = handler(self, node)
+        if type(result) is GeneratorType:
+            return record_type(node, result)
+        if result != -1:
+            node.type = result
+        return result
+    return handle
+
+def record_type(node, handler):
+    result = yield from handler
+    if result != -1:
+        node.type = result
+    return result
+
+# Operators that store into their left operand
+ASSIGNMENT_OPERATORS = {'=', '|=', '&=', '+=', '-=', '*=', '/=', '%='}
+
+class SemanticAnalyzer(Visitor):
+    def __init__(self, diagnostics=None):
+        self.symbols = SymbolTable()
+        # Messages are buffered here and rendered by the caller, never printed while analyzing
+        self.diagnostics = Diagnostics() if diagnostics is None else diagnostics
+        # The FunctionDefinition whose body is being analyzed, for 'deliver'
+        self.function = None
 
     def analyze(self, node):
-        node_type = type(node).__name__
-        if node_type == "Program":
-            print("Analyzing program")
-            for statement in node.statements:
-                if self.analyze(statement) == -1:
-                    return "Code contains semantic errors"
-            return "Code analyzed successfully"
-        
-        elif node_type == "VariableDeclaration":
-            return self.handle_variable_declaration(node)
-        elif node_type == "PreachStatement":
-            return self.handle_preach_statement(node)
-        elif node_type in ["IntegerLiteral", "CharLiteral", "StringLiteral", "BoolLiteral", "FloatLiteral"]:
-            return self.get_literal_type(node_type)
-        elif node_type == "CompoundStatement":
-            return self.handle_compound_statement(node)
-        elif node_type == "Identifier":
-            return self.handle_identifier(node)
-        elif node_type == "IfStatement":
-            return self.handle_if_statement(node)
-        elif node_type == "BinaryExpression":
-            return self.handle_binary_expression(node)
-        elif node_type in ["LeftBrace", "RightBrace"]:
-            return None  # Ignore braces as they are not semantically relevant
-        elif node_type == "TupleDeclaration":
-            return self.handle_tuple_declaration(node)
-        elif node_type == "ForLoop":
-            return self.handle_for_loop(node)
-        elif node_type == "WhileLoop":
-            return self.handle_while_loop(node)
+        return self.visit(node)
+
+    # Handlers yield the nodes they need analyzed and get their result back,
+    # so deeply nested programs are analyzed without recursion (see visitor.py)
+    #
+    # A node that fails reports its error and returns -1. That result poisons
+    # whatever contains it: the enclosing expression or statement returns -1
+    # too, without reporting again, and analysis goes on with the next
+    # statement so one run reports every error.
+
+    @handles('Program')
+    def handle_program(self, node):
+        self.diagnostics.note('analyzing', "Analyzing program", node)
+        # Functions can be called before the statement that defines them
+        self.declare_functions(node.statements)
+        failed = False
+        for statement in node.statements:
+            if (yield statement) == -1:
+                failed = True
+        return "Code contains semantic errors" if failed else "Code analyzed successfully"
+
+    @handles('IntegerLiteral', 'CharLiteral', 'StringLiteral', 'BoolLiteral', 'FloatLiteral')
+    @typed
+    def handle_literal(self, node):
+        return self.get_literal_type(type(node).__name__)
+
+    @handles('LeftBrace', 'RightBrace')
+    def handle_brace(self, node):
+        return None  # Ignore braces as they are not semantically relevant
+
+    @handles('ErrorStatement')
+    def handle_error_statement(self, node):
+        return None  # The parser already reported why the statement is missing
+
+    def generic_visit(self, node):
+        self.diagnostics.error('unhandled-node', f"Unhandled node type: {type(node).__name__}", node)
+        return -1
+
+    def declare_functions(self, statements):
+        for statement in statements:
+            if type(statement).__name__ == 'FunctionDefinition':
+                self.declare_function(statement)
+
+    def declare_function(self, node):
+        existing = self.symbols.lookup_local(node.name)
+        if existing is not None and existing.signature is not None:
+            self.diagnostics.error('duplicate-function', f"Function '{node.name}' is already defined.", node)
+            return
+        signature = (node.return_type.type_keyword, tuple(type_keyword for type_keyword, _ in node.parameters))
+        self.declare_signature(node.name, signature)
+
+    def declare_signature(self, name, signature):
+        binding = self.symbols.declare(name, 'function')
+        binding.signature = signature
+        return binding
+
+    @handles('FunctionDefinition')
+    def handle_function_definition(self, node):
+        binding = self.symbols.lookup(node.name)
+        if binding is None or binding.signature is None:
+            self.declare_function(node)  # Analyzed on its own, without its Program
+        self.enter_scope(f"function {node.name}")
+        # WAT locals belong to their function, so their names are numbered per function
+        declarations, self.symbols.declarations = self.symbols.declarations, {}
+        for type_keyword, name in node.parameters:
+            self.symbols.declare(name, type_keyword, node)
+        enclosing, self.function = self.function, node
+        result = yield from self.analyze_branch(node.body)
+        self.function = enclosing
+        self.symbols.declarations = declarations
+        self.exit_scope()
+        return result
+
+    @handles('JumpStatement')
+    def handle_jump_statement(self, node):
+        if node.keyword != 'deliver':
+            return 0
+        if self.function is None:
+            self.diagnostics.error('deliver-outside-function', "'deliver' used outside a function", node)
+            return -1
+        return_type = self.function.return_type.type_keyword
+        if node.expression is None:
+            delivered = 'void'
         else:
-            print(f"Unhandled node type: {node_type}")
+            delivered = yield node.expression
+            if delivered == -1:
+                return -1
+        if delivered != return_type:
+            self.diagnostics.error('type-mismatch', f"Function '{self.function.name}' delivers {return_type}, "
+                                                    f"got {delivered}", node)
             return -1
+        return 0
+
+    @handles('FunctionCall')
+    @typed
+    def handle_function_call(self, node):
+        argument_types = []
+        for argument in node.arguments:
+            argument_types.append((yield argument))
+        binding = self.symbols.lookup(node.name)
+        if binding is None or binding.signature is None:
+            self.diagnostics.error('undeclared', f"Function '{node.name}' is not defined.", node)
+            return -1
+        if -1 in argument_types:
+            return -1
+        return_type, parameter_types = binding.signature
+        if len(argument_types) != len(parameter_types):
+            self.diagnostics.error('argument-count', f"Function '{node.name}' takes {len(parameter_types)} "
+                                                     f"arguments, got {len(argument_types)}", node)
+            return -1
+        for position, (expected, actual) in enumerate(zip(parameter_types, argument_types), 1):
+            if expected != actual:
+                self.diagnostics.error('type-mismatch', f"Argument {position} of '{node.name}' should be "
+                                                        f"{expected}, got {actual}", node)
+                return -1
+        node.binding = binding
+        return return_type
+
+    @handles('PreachStatement')
     def handle_preach_statement(self, node):
         # Analyze the expression within the PreachStatement to ensure it's valid
-        expression_result = self.analyze(node.expression)
+        expression_result = yield node.expression
         if expression_result == -1:
-            print("Error evaluating expression in preach statement")
             return -1
-        print(f"Preach statement evaluated: {node.expression.value}")
+        shown = getattr(node.expression, 'value', type(node.expression).__name__)
+        self.diagnostics.note('preach', f"Preach statement evaluated: {shown}", node)
         return 0
+    @handles('ForLoop')
     def handle_for_loop(self, node):
-        self.enter_scope()
-        self.analyze(node.init)
-        condition_type = self.analyze(node.condition)
-        if condition_type != 'boolean':
-            print("Error: Loop condition is not a boolean")
-            self.exit_scope()
-            return -1
-        self.analyze(node.update)
-        result = self.analyze(node.body)
+        self.enter_scope('for')
+        failed = (yield node.init) == -1
+        condition_type = yield node.condition
+        if condition_type == -1:
+            failed = True
+        elif condition_type != 'boolean':
+            self.diagnostics.error('non-boolean-condition', "Loop condition is not a boolean", node.condition)
+            failed = True
+        if (yield node.update) == -1:
+            failed = True
+        if (yield node.body) == -1:
+            failed = True
         self.exit_scope()
-        return result
+        return -1 if failed else 0
+    @handles('TupleDeclaration')
     def handle_tuple_declaration(self, node):
-        tuple_values = [self.analyze(value) for value in node.values]
-        if not all(v == tuple_values[0] for v in tuple_values):  # Ensuring all elements are of the same type
-            print("Error: Tuple elements have different types")
-            return -1
-        self.symbol_table[node.identifier.value] = {'type': f"tuple({tuple_values[0]})", 'scope': self.scope_stack[-1]}
-        return 0
+        tuple_values = []
+        for value in node.values:
+            tuple_values.append((yield value))
+        if -1 in tuple_values:
+            tuple_type = -1
+        elif not all(v == tuple_values[0] for v in tuple_values):  # Ensuring all elements are of the same type
+            self.diagnostics.error('tuple-type-mismatch', "Tuple elements have different types", node)
+            tuple_type = -1
+        else:
+            tuple_type = f"tuple({tuple_values[0]})"
+        # Declared even when poisoned, so its uses are not reported as undeclared
+        node.identifier.binding = self.symbols.declare(node.identifier.value, tuple_type, node)
+        return -1 if tuple_type == -1 else 0
     def get_literal_type(self, node_type):
         type_mapping = {
             'IntegerLiteral': 'int',
@@ -102,29 +324,85 @@ class SemanticAnalyzer:
         }
         return type_mapping.get(node_type, None)
 
+    @handles('VariableDeclaration')
     def handle_variable_declaration(self, node):
+        if node.declaration_specifier is None:
+            # An assignment statement such as 'x = 1;' declares nothing
+            return (yield node.assignment_expression)
         var_type = node.declaration_specifier.type_specifier.type_keyword
         identifier = node.assignment_expression.left.value
-        self.symbol_table[identifier] = {'type': var_type, 'scope': self.scope_stack[-1]}  # Pre-declare variable
-        expression_result = self.analyze(node.assignment_expression)
+        binding = self.symbols.declare(identifier, var_type, node)  # Pre-declare variable
+        binding.eternal = bool(node.declaration_specifier.eternal)
+        expression_result = yield node.assignment_expression
 
+        if expression_result == -1:
+            return -1
         if not self.is_type_compatible(var_type, expression_result):
-            print(f"Error: Type mismatch for '{identifier}' ({var_type} expected, got {expression_result}).")
+            self.diagnostics.error('type-mismatch',
+                                   f"Type mismatch for '{identifier}' ({var_type} expected, got {expression_result}).", node)
             return -1
-        print(f"Added '{identifier}' of type '{var_type}' to the symbol table in scope '{self.scope_stack[-1]}'.")
+        self.diagnostics.note('declared', f"Added '{identifier}' of type '{var_type}' to the symbol table "
+                                          f"in scope '{self.symbols.scope.name}'.", node)
         return 0
 
 
+    @handles('Identifier')
+    @typed
     def handle_identifier(self, node):
         identifier = node.value
-        if identifier in self.symbol_table:
-            return self.symbol_table[identifier]['type']
-        print(f"Error: Identifier '{identifier}' is not declared.")
+        binding = self.symbols.lookup(identifier)
+        if binding is not None:
+            # Codegen reads the resolved declaration straight off the node
+            node.binding = binding
+            return binding.type
+        self.diagnostics.error('undeclared', f"Identifier '{identifier}' is not declared.", node)
         return -1
 
+    @handles('UnaryExpression')
+    @typed
+    def handle_unary_expression(self, node):
+        operand_type = yield node.operand
+        if operand_type == -1:
+            return -1
+        operator = getattr(node.operator, 'value', node.operator)
+        if operator in ('++', '--') and not self.check_store(node.operand, node):
+            return -1
+        if operand_type not in ('int', 'float'):
+            self.diagnostics.error('type-mismatch', f"Operator '{operator}' needs a number, got {operand_type}", node)
+            return -1
+        return operand_type
+
+    @handles('MemberAccessExpression')
+    @typed
+    def handle_member_access_expression(self, node):
+        if node.index is None:
+            # List and tuple operations such as 'head' are not checked yet
+            return self.generic_visit(node)
+        object_type = yield node.object_expr
+        index_type = yield node.index
+        if object_type == -1 or index_type == -1:
+            return -1
+        if isinstance(object_type, str) and object_type.endswith('[]'):
+            element_type = object_type[:-2]
+        elif isinstance(object_type, str) and object_type.startswith('tuple('):
+            element_type = object_type[len('tuple('):-1]
+        else:
+            self.diagnostics.error('type-mismatch', f"Only arrays and tuples can be indexed, got {object_type}", node)
+            return -1
+        if index_type != 'int':
+            self.diagnostics.error('type-mismatch', f"Index should be int, got {index_type}", node.index)
+            return -1
+        return element_type
+
+    @handles('BinaryExpression')
+    @typed
     def handle_binary_expression(self, node):
-        left_type = self.analyze(node.left)
-        right_type = self.analyze(node.right)
+        left_type = yield node.left
+        right_type = yield node.right
+        if left_type == -1 or right_type == -1:
+            return -1
+        if node.operator in ASSIGNMENT_OPERATORS and not self.check_store(node.left, node):
+            return -1
 
         # Define operator types
         comparison_operators = {'==', '!=', '<', '>', '<=', '>=', '&&', '||'}
@@ -133,7 +411,7 @@ class SemanticAnalyzer:
         # Handle comparison (resulting in boolean)
         if node.operator in comparison_operators:
             if left_type != right_type:
-                print(f"Type mismatch in comparison: {left_type} vs. {right_type}")
+                self.diagnostics.error('type-mismatch', f"Type mismatch in comparison: {left_type} vs. {right_type}", node)
                 return -1
             return 'boolean'
 
@@ -141,125 +419,254 @@ class SemanticAnalyzer:
         elif node.operator in arithmetic_operators:
             if left_type == right_type:
                 return left_type
-            print(f"Type mismatch in arithmetic: {left_type} vs. {right_type}")
+            self.diagnostics.error('type-mismatch', f"Type mismatch in arithmetic: {left_type} vs. {right_type}", node)
             return -1
 
         # Handle assignment (simple equality is a special case)
         elif node.operator == '=':
             if left_type == right_type:
                 return right_type
-            print(f"Type mismatch in assignment: {left_type} cannot be assigned to {right_type}")
+            self.diagnostics.error('type-mismatch', f"Type mismatch in assignment: {left_type} cannot be assigned to {right_type}", node)
             return -1
 
         else:
-            print(f"Unhandled operator: {node.operator}")
+            self.diagnostics.error('unhandled-operator', f"Unhandled operator: {node.operator}", node)
             return -1
+    @handles('WhileLoop')
     def handle_while_loop(self, node):
-        self.enter_scope()
-        condition_result = self.analyze(node.condition)
-        if condition_result != 'boolean':
-            print("Error: Condition in while loop is not boolean.")
-            self.exit_scope()
-            return -1
-        
-        body_result = self.analyze(node.body)
+        self.enter_scope('while')
+        condition_result = yield node.condition
+        failed = condition_result == -1
+        if condition_result != 'boolean' and not failed:
+            self.diagnostics.error('non-boolean-condition', "Condition in while loop is not boolean.", node.condition)
+            failed = True
+
+        body_result = yield node.body
         self.exit_scope()
-        return body_result if body_result != -1 else -1
-        
-        body_result = self.analyze(node.body)
-        self.exit_scope()
-        return body_result if body_result != -1 else -1
+        return -1 if failed or body_result == -1 else body_result
+    @handles('CompoundStatement')
     def handle_compound_statement(self, node):
         self.enter_scope()
+        failed = False
         for statement in node.statements:
-            if self.analyze(statement) == -1:
-                self.exit_scope()
-                return -1
+            if (yield statement) == -1:
+                failed = True
         self.exit_scope()
-        return 0
+        return -1 if failed else 0
+    @handles('IfStatement')
     def handle_if_statement(self, node):
-        condition_result = self.analyze(node.condition)
-        if condition_result != 'boolean':
-            print("Error: Condition in if statement is not a boolean expression")
-            return -1
+        condition_result = yield node.condition
+        failed = condition_result == -1
+        if condition_result != 'boolean' and not failed:
+            self.diagnostics.error('non-boolean-condition', "Condition in if statement is not a boolean expression", node.condition)
+            failed = True
         # Handle the branches
-        true_branch_result = self.handle_compound_statement(node.true_branch)
+        true_branch_result = yield from self.analyze_branch(node.true_branch)
         false_branch_result = 0  # Default to successful if no else branch
         if node.false_branch:
-            false_branch_result = self.handle_compound_statement(node.false_branch)
+            false_branch_result = yield from self.analyze_branch(node.false_branch)
 
-        if true_branch_result == -1 or false_branch_result == -1:
+        if failed or true_branch_result == -1 or false_branch_result == -1:
             return -1
         return 0
 
-    def enter_scope(self):
-        self.scope_stack.append({})
+    def check_store(self, target, node):
+        """Report `node` storing into `target` if it is an 'eternal' variable other than in its declaration."""
+        binding = target.binding
+        if binding is None or not binding.eternal or getattr(binding.node, 'assignment_expression', None) is node:
+            return True
+        self.diagnostics.error('assign-eternal', f"Cannot assign to eternal variable '{binding.name}'", node)
+        return False
+
+    def analyze_branch(self, branch):
+        if hasattr(branch, 'statements'):
+            return (yield from self.handle_compound_statement(branch))
+        # Such as the ErrorStatement of a branch the parser skipped
+        return (yield branch)
+
+    def enter_scope(self, name='block'):
+        self.symbols.enter_scope(name)
 
     def exit_scope(self):
-        if len(self.scope_stack) > 1:
-            self.scope_stack.pop()
+        self.symbols.exit_scope()
     def is_type_compatible(self, expected_type, actual_type):
         return expected_type == actual_type
     
 
 
 
-def convert_wat_to_wasm(wat_file, wasm_file):
+def convert_wat_to_wasm(wat_file, wasm_file, diagnostics=None):
+    import subprocess
     try:
         subprocess.run(['wat2wasm', wat_file, '-o', wasm_file], check=True)
     except subprocess.CalledProcessError as e:
-        print("Failed to convert WAT to WASM:", e)
+        if diagnostics is None:
+            print("Failed to convert WAT to WASM:", e)
+        else:
+            diagnostics.error('wat2wasm', f"Failed to convert WAT to WASM: {e}")
+        return False
+    except FileNotFoundError:
+        # The .wat file is written all the same; only the conversion is skipped
+        message = "wat2wasm was not found on PATH; install the WebAssembly Binary Toolkit to get a .wasm file"
+        if diagnostics is None:
+            print(message)
+        else:
+            diagnostics.warning('wat2wasm-missing', message)
+        return False
+    return True
+
 
 
 
+def script_frame(text):
+    """Return the (start, end) offsets of the source between 'summon HolyScript' and 'doom', or None.
 
-def run_script(text, file_path):
+    `text` may be a str or bytes-like, such as an mmap; nothing is copied.
+    """
     start_marker = "summon HolyScript"
     end_marker = "doom"
+    if not isinstance(text, str):
+        start_marker, end_marker = start_marker.encode(), end_marker.encode()
     start_idx = text.find(start_marker)
     end_idx = text.find(end_marker)
 
     if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-        start_idx += len(start_marker)
-        script_text = text[start_idx:end_idx].strip()
-    else:
-        print("Error: Script must be enclosed between 'summon HolyScript' and 'doom'.")
+        return start_idx + len(start_marker), end_idx
+    return None
+
+def extract_script(text):
+    """Return the source between 'summon HolyScript' and 'doom', or None."""
+    frame = script_frame(text)
+    if frame is None:
+        return None
+    start_idx, end_idx = frame
+    return text[start_idx:end_idx].strip()
+
+def parse_source(fn, text, start=0, end=None, parser_name='native', report=None):
+    """Lex and parse text[start:end], returning (ast, error).
+
+    With `report`, lex errors and, for the native parser, syntax errors are
+    passed to it and the rest of the source is still parsed.
+    """
+    source = lexer.RegexLexer(fn, text, start, end, report)
+    if parser_name == 'native':
+        import holyparser
+        # Tokens go from the lexer to the parser one at a time and are never all held in memory
+        return holyparser.run(fn, source.iter_tokens(), source.lines, report)
+    tokens, error = source.make_token_buffer()
+    if error:
+        return None, error
+    return parse_program(fn, tokens, parser_name)
+
+def run_script(text, file_path, parser_name='native', quiet=False, diagnostics_format='text',
+               max_errors=MAX_ERRORS, jobs=None, optimize=True, backend='ir', emit_ir=False):
+    diagnostics = Diagnostics(file_path, lexer.LineIndex(text), quiet, max_errors)
+    try:
+        compile_script(text, file_path, diagnostics, parser_name, jobs, optimize, backend, emit_ir)
+    except TooManyErrors:
+        pass  # Diagnostics recorded why the compile stopped
+    finally:
+        # Everything the compile reported is written in one go, whether it finished or not
+        diagnostics.flush(diagnostics_format)
+
+def compile_script(text, file_path, diagnostics, parser_name='native', jobs=None, optimize=True,
+                   backend='ir', emit_ir=False):
+    """Compile the script in `text` to a .wat file next to `file_path`.
+
+    With `jobs`, functions are analyzed, lowered and generated through the IR
+    by that many worker processes (0 for one per CPU), see parallel.py,
+    whatever `backend` is. `optimize` runs the
+    passes of optimizer.py between analysis and code generation. `backend`
+    'ir' lowers the tree to the SSA form of ir.py and generates the WAT from
+    that, after the passes of ir_optimizer.py when `optimize`, writing the IR
+    to a .ir file as well with `emit_ir`.
+    """
+    frame = script_frame(text)
+    if frame is None:
+        diagnostics.error('missing-frame', "Script must be enclosed between 'summon HolyScript' and 'doom'.")
         return
 
-    tokens, error = lexer.run(file_path, script_text)
+    my_ast, error = parse_source(file_path, text, *frame, parser_name=parser_name,
+                                 report=diagnostics.add_error)
     if error:
-        print(error.as_string())
+        diagnostics.add_error(error)
         return
+    if count_visits:
+        report_visits()
 
-    script = " ".join(str(token) for token in tokens)
-    tree = parser.parse(script)
-    my_ast = transformer.transform(tree)
-    semantic_analyzer = SemanticAnalyzer()
-    semantic_output = semantic_analyzer.analyze(my_ast)
+    code = None
+    if jobs is None:
+        semantic_analyzer = SemanticAnalyzer(diagnostics)
+        semantic_output = semantic_analyzer.analyze(my_ast)
+    else:
+        import parallel
+        code, semantic_output = parallel.compile_program(my_ast, diagnostics, jobs, optimize)
 
     if semantic_output != "Code analyzed successfully":
-        print("Semantic analysis failed:", semantic_output)
+        diagnostics.error('semantic-analysis', f"Semantic analysis failed: {semantic_output}")
         return
-
-    # Generate WAT code from the AST
-    wat_generator = WATGenerator()
-    wat_code = wat_generator.generate_wat(my_ast)
+    if diagnostics.has_errors:
+        return  # Statements with syntax errors were left out of the tree
+    if optimize and code is None:
+        import optimizer
+        my_ast = optimizer.optimize(my_ast)
+
+    if code is not None:
+        wat_code = code  # parallel.py went through the IR already
+    elif backend == 'ir':
+        wat_code = generate_from_ir(my_ast, file_path, diagnostics, optimize, emit_ir)
+        if wat_code is None:
+            return
+    else:
+        # Generate WAT code from the AST
+        from wasm_generator import WATGenerator, UnsupportedError
+        wat_generator = WATGenerator()
+        try:
+            wat_code = wat_generator.generate_wat(my_ast)
+        except UnsupportedError as e:
+            diagnostics.error('unsupported', str(e), e.node)
+            return
     output_path = file_path.replace('.holy', '.wat')
 
     # Write the generated WAT code to a file
     with open(output_path, 'w') as output_file:
         output_file.write(wat_code)
-    print(f"WAT file generated at {output_path}")
+    diagnostics.note('output', f"WAT file generated at {output_path}")
 
     # Convert the generated WAT file to a WASM file
     wasm_output_path = output_path.replace('.wat', '.wasm')
-    convert_wat_to_wasm(output_path, wasm_output_path)
-    print(f"WASM file generated at {wasm_output_path}")
+    if convert_wat_to_wasm(output_path, wasm_output_path, diagnostics):
+        diagnostics.note('output', f"WASM file generated at {wasm_output_path}")
+
+def generate_from_ir(my_ast, file_path, diagnostics, optimize=True, emit_ir=False):
+    """Lower the analyzed `my_ast` to IR, optimize it, and return its WAT, or None when that failed."""
+    import ir
+    import lowering
+    from wat_backend import WATBackend
+    try:
+        module = lowering.lower(my_ast)
+    except ir.IRError as e:
+        diagnostics.error('unsupported', str(e), e.node)
+        return None
+    if optimize:
+        import ir_optimizer
+        ir_optimizer.optimize(module)
+    if emit_ir:
+        ir_path = file_path.replace('.holy', '.ir')
+        with open(ir_path, 'w') as ir_file:
+            ir_file.write(ir.format_module(module))
+        diagnostics.note('output', f"IR file generated at {ir_path}")
+    problems = ir.verify_module(module)
+    for problem in problems:
+        diagnostics.error('ir-verify', problem)
+    if problems:
+        return None
+    return WATBackend().generate(module)
 
 def is_holy_script_file(file_path):
     return os.path.isfile(file_path) and file_path.endswith('.holy')
 
-def run_cli():
+def run_cli(parser_name='native', quiet=False, diagnostics_format='text'):
     print("""
 ══════════════════════════════════════
 Welcome, faithful coder, to the HolyScript CLI.
@@ -275,36 +682,70 @@ Type 'exit' to depart.
             print("Farewell, till we meet again in the realm of code.")
             break
 
-        tokens, error = lexer.run('<stdin>', line)
+        diagnostics = Diagnostics('<stdin>', lexer.LineIndex(line), quiet)
+        tokens, error = lexer.run_buffer('<stdin>', line)
         if error:
-            print(error.as_string())
+            diagnostics.add_error(error)
         else:
-            values = []
-            for token in tokens:
-                values.append(str(token))
-            # Print the values separated by commas
-            # print(" ".join(values))
-            script = (" ".join(values))
-            tree = parser.parse(script)
-            print(tree.pretty())
-            my_ast = transformer.transform(tree)
+            if parser_name != 'native':
+                print(parse_tokens(tokens).pretty())
+            my_ast, error = parse_program('<stdin>', tokens, parser_name)
+            if error:
+                diagnostics.add_error(error)
+                diagnostics.flush(diagnostics_format)
+                continue
             print(my_ast)
             print(my_ast.pretty_print())
             # print(transform_ast_string(my_ast))
-            semantic_analyzer = SemanticAnalyzer()
+            semantic_analyzer = SemanticAnalyzer(diagnostics)
             output  = semantic_analyzer.analyze(my_ast)
             # print(output)
+        diagnostics.flush(diagnostics_format)
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        file_path = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description="Compile a HolyScript file, or start the CLI when no file is given.")
+    arg_parser.add_argument('file', nargs='?', help="the .holy file to compile")
+    arg_parser.add_argument('--parser', choices=['native', 'lalr', 'earley'], default='native',
+                            help="parser used to build the AST (default: native)")
+    arg_parser.add_argument('--earley', action='store_const', dest='parser', const='earley',
+                            help="shorthand for --parser earley")
+    arg_parser.add_argument('--count-visits', action='store_true',
+                            help="print how often each grammar rule was visited while building the AST")
+    arg_parser.add_argument('-q', '--quiet', action='store_true',
+                            help="report only warnings and errors, so a clean compile prints nothing")
+    arg_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                            help="analyze and generate each function through the IR in N worker processes, 0 for one per CPU")
+    arg_parser.add_argument('-O', '--optimize', type=int, choices=[0, 1], default=1, metavar='LEVEL',
+                            help="0 generates code straight from the analyzed tree, 1 (default) optimizes it first")
+    arg_parser.add_argument('--backend', choices=['ast', 'ir'], default='ir',
+                            help="generate WAT from the SSA IR of the tree (default), or straight from the tree")
+    arg_parser.add_argument('--emit-ir', action='store_true',
+                            help="with --backend ir, also write the IR next to the .wat file")
+    arg_parser.add_argument('--max-errors', type=int, default=MAX_ERRORS,
+                            help=f"stop after this many errors, 0 for no limit (default: {MAX_ERRORS})")
+    arg_parser.add_argument('--diagnostics-format', choices=FORMATS, default='text',
+                            help="how diagnostics are written once the compile ends (default: text)")
+    args = arg_parser.parse_args()
+    if args.jobs is not None and args.backend == 'ast':
+        arg_parser.error("--jobs generates WAT per function through the IR; it cannot be used with --backend ast")
+    if args.jobs is not None and args.emit_ir:
+        arg_parser.error("--jobs never holds the IR of the whole module; it cannot be used with --emit-ir")
+    count_visits = args.count_visits
+    if args.parser == 'earley':
+        parser = build_parser('earley')
+
+    if args.file:
+        file_path = args.file
         if is_holy_script_file(file_path):
             text = read_holy_script_file(file_path)
             if text is not None:
-                run_script(text, file_path)
+                run_script(text, file_path, args.parser, args.quiet, args.diagnostics_format,
+                           args.max_errors, args.jobs, args.optimize > 0, args.backend, args.emit_ir)
+                if isinstance(text, mmap.mmap):
+                    text.close()
             else:
                 print(f"Failed to read the sacred text: {file_path}")
         else:
             print(f"The provided scripture '{file_path}' is not found or lacks the sacred .holy suffix.")
     else:
-        run_cli()
+        run_cli(args.parser, args.quiet, args.diagnostics_format)
@@ -0,0 +1,485 @@
+import struct
+from astclasses import IntegerLiteral, FloatLiteral, BoolLiteral, CompoundStatement
+from visitor import Visitor, handles
+
+# Optimization passes over an analyzed AST, run between SemanticAnalyzer and
+# WATGenerator. They rely on what the analyzer annotated: node.binding to
+# tell variables apart however they are shadowed, and node.type. A pass
+# rewrites the tree in place: each handler returns the node that replaces
+# the one it was given, usually itself, and the parent stores it back.
+
+#######################################
+# CONSTANTS
+#######################################
+
+# Literal classes the folder evaluates, by the value type of their node
+LITERAL_TYPES = {
+    'IntegerLiteral': 'int',
+    'IntLiteral': 'int',
+    'FloatLiteral': 'float',
+    'BoolLiteral': 'boolean',
+}
+
+# Operators that store into their left operand, which is never folded
+ASSIGNMENT_OPERATORS = {'=', '+=', '-=', '*=', '/=', '%=', '|=', '&='}
+
+# Operators that update their operand in place
+UPDATE_OPERATORS = {'++', '--'}
+
+# Statements that leave their block: whatever follows them there never runs
+JUMP_KEYWORDS = {'deliver', 'retreat', 'persist'}
+
+LOOPS = ('ForLoop', 'WhileLoop', 'DoWhileLoop')
+
+COMPARISONS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+#######################################
+# HELPERS
+#######################################
+
+
+def wrap_i32(value):
+    """`value` wrapped to a signed 32-bit integer, as the i32 instructions do."""
+    value &= 0xFFFFFFFF
+    return value - 0x100000000 if value & 0x80000000 else value
+
+
+def round_f32(value):
+    """`value` rounded to the nearest 32-bit float, as the f32 instructions do."""
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def fold_int(operator, a, b):
+    """The i32 result of `a operator b`, or None when it traps or is not an int operation."""
+    if operator == '+':
+        return wrap_i32(a + b)
+    if operator == '-':
+        return wrap_i32(a - b)
+    if operator == '*':
+        return wrap_i32(a * b)
+    if operator in ('/', '%'):
+        if b == 0 or (operator == '/' and a == -0x80000000 and b == -1):
+            return None  # Traps at run time, so it is left for the program to do
+        # i32.div_s truncates towards zero and i32.rem_s takes the dividend's sign
+        quotient = abs(a) // abs(b)
+        if (a < 0) != (b < 0):
+            quotient = -quotient
+        return wrap_i32(quotient) if operator == '/' else wrap_i32(a - b * quotient)
+    return None
+
+
+def fold_float(operator, a, b):
+    if operator == '+':
+        return round_f32(a + b)
+    if operator == '-':
+        return round_f32(a - b)
+    if operator == '*':
+        return round_f32(a * b)
+    if operator == '/' and b != 0:
+        return round_f32(a / b)
+    return None
+
+
+def children(node):
+    """The AST nodes held in the fields of `node`."""
+    for field in getattr(node, '_fields', ()):
+        value = getattr(node, field, None)
+        if isinstance(value, list):
+            for item in value:
+                if hasattr(item, '_fields'):
+                    yield item
+        elif hasattr(value, '_fields'):
+            yield value
+
+
+def walk(node):
+    """`node` and every node below it, without recursion."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(children(node))
+
+
+def stored_names(node):
+    """Names of the variables that something under `node` stores into after their declaration.
+
+    A chant loop's variable counts as stored, as its update expression
+    steps it. Names rather than bindings, so the set can be computed
+    before, or without, analysis; a variable that is never stored keeps the
+    value it is declared with.
+    """
+    names = set()
+    initializers = set()
+    for node in walk(node):
+        name = type(node).__name__
+        if name == 'VariableDeclaration' and node.declaration_specifier is not None:
+            initializers.add(id(node.assignment_expression))
+            continue
+        if name == 'BinaryExpression' and node.operator in ASSIGNMENT_OPERATORS and id(node) not in initializers:
+            target = node.left
+        elif name == 'UnaryExpression' and getattr(node.operator, 'value', node.operator) in UPDATE_OPERATORS:
+            target = node.operand
+        elif name == 'ForLoop':
+            names.update(identifier.value for identifier in walk(node.init)
+                         if type(identifier).__name__ == 'Identifier')
+            if node.update is not None:
+                names.update(identifier.value for identifier in walk(node.update)
+                             if type(identifier).__name__ == 'Identifier')
+            continue
+        else:
+            continue
+        if type(target).__name__ == 'Identifier':
+            names.add(target.value)
+    return names
+
+
+def is_pure(node):
+    """Whether evaluating expression `node` has no effect besides its value: no call or store."""
+    for node in walk(node):
+        if type(node).__name__ in ('FunctionCall', 'BuiltinFunction', 'UtilityFunctionCall'):
+            return False
+        operator = getattr(node, 'operator', None)
+        operator = getattr(operator, 'value', operator)
+        if operator in ASSIGNMENT_OPERATORS or operator in UPDATE_OPERATORS:
+            return False
+    return True
+
+
+def literal(value, type, like):
+    """A literal node of `value`, typed `type`, standing where node `like` was."""
+    if type == 'boolean':
+        node = BoolLiteral(value)
+    elif type == 'float':
+        node = FloatLiteral(value)
+    else:
+        node = IntegerLiteral(value)
+    node.type = type
+    offset = like.offset
+    if offset is not None:
+        node.offset = offset
+    return node
+
+
+#######################################
+# PASSES
+#######################################
+
+
+class Pass(Visitor):
+    """Base of the rewriting passes: visits every child and stores back what replaces it."""
+
+    def run(self, node):
+        return self.visit(node)
+
+    def generic_visit(self, node):
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    if hasattr(item, '_fields'):
+                        value[index] = yield item
+            elif hasattr(value, '_fields'):
+                setattr(node, field, (yield value))
+        return node
+
+
+class ConstantFolder(Pass):
+    """Evaluate constant expressions at compile time and replace the uses of 'eternal' variables with their value.
+
+    Operators over int, float and boolean literals become a literal of their
+    result, computed with the wrapping and rounding of the WebAssembly
+    instruction, and a condition such as `x > 0 && true` becomes `x > 0`.
+    SemanticAnalyzer rejects stores to an eternal variable, so the literal
+    it is declared with is its value at every use. So is the literal of a
+    variable whose name is not in `stored`, see stored_names().
+    """
+
+    def __init__(self, constants=None, stored=None):
+        # symbols.Binding of each constant variable -> the literal it holds
+        self.constants = {} if constants is None else constants
+        # None when stores are not known, and only eternal variables are constant
+        self.stored = stored
+        self.folded = 0
+
+    @handles('VariableDeclaration')
+    def handle_variable_declaration(self, node):
+        # An assignment keeps its target and only has its value folded
+        node.assignment_expression = assignment = yield node.assignment_expression
+        specifier = node.declaration_specifier
+        if specifier is None or getattr(assignment, 'operator', None) != '=':
+            return node
+        value = assignment.right
+        binding = assignment.left.binding
+        if binding is None or type(value).__name__ not in LITERAL_TYPES:
+            return node
+        if specifier.eternal or (self.stored is not None and binding.name not in self.stored):
+            self.constants[binding] = value
+        return node
+
+    @handles('Identifier')
+    def handle_identifier(self, node):
+        value = self.constants.get(node.binding)
+        if value is None:
+            return node
+        self.folded += 1
+        return literal(value.value, node.type or LITERAL_TYPES[type(value).__name__], node)
+
+    @handles('UnaryExpression')
+    def handle_unary_expression(self, node):
+        return node  # Only '++' and '--', which store into their operand
+
+    @handles('BinaryExpression')
+    def handle_binary_expression(self, node):
+        operator = node.operator
+        if operator in ASSIGNMENT_OPERATORS:
+            node.right = yield node.right
+            return node
+        node.left = left = yield node.left
+        node.right = right = yield node.right
+        left_type = LITERAL_TYPES.get(type(left).__name__)
+        right_type = LITERAL_TYPES.get(type(right).__name__)
+
+        if operator in ('&&', '||'):
+            return self.fold_logic(node, left, right, left_type, right_type)
+        if left_type is None or left_type != right_type:
+            return node
+        a, b = left.value, right.value
+        if operator in COMPARISONS:
+            result, result_type = COMPARISONS[operator](a, b), 'boolean'
+        elif left_type == 'int':
+            result, result_type = fold_int(operator, a, b), 'int'
+        elif left_type == 'float':
+            result, result_type = fold_float(operator, a, b), 'float'
+        else:
+            result = None
+        if result is None:
+            return node
+        self.folded += 1
+        return literal(result, result_type, node)
+
+    def fold_logic(self, node, left, right, left_type, right_type):
+        if left_type == 'boolean':
+            # `true && x` is x and `false && x` is false; x is not evaluated either way
+            if bool(left.value) == (node.operator == '&&'):
+                self.folded += 1
+                return right
+            self.folded += 1
+            return literal(bool(left.value), 'boolean', node)
+        if right_type == 'boolean':
+            # `x && true` is x; `x && false` is false only when x need not be evaluated
+            if bool(right.value) == (node.operator == '&&'):
+                self.folded += 1
+                return left
+            if is_pure(left):
+                self.folded += 1
+                return literal(bool(right.value), 'boolean', node)
+        return node
+
+
+class DeadCodeEliminator(Pass):
+    """Remove statements that never run or whose effect is never seen.
+
+    Goes after ConstantFolder, which leaves literal conditions behind:
+    - a belief with a literal condition is replaced by the branch taken
+    - a pledge or chant loop whose condition is false, leaving a chant's
+      init, and an oath loop's condition, which is then checked once after
+      the body
+    - the statements after a deliver, retreat or persist in the same block
+    - the declaration of a local variable that is never read, when its
+      value has no side effect, and the pure assignments to it
+    - blocks nested in a block, whose statements join it
+
+    Dead stores are looked for last statement first, once the block is
+    pruned, so a declaration only read by a dead one is found dead too.
+    Handlers return None for a removed statement.
+    """
+
+    def __init__(self):
+        # symbols.Binding of each variable -> how many expressions read it
+        self.reads = {}
+        self.removed = 0
+
+    def run(self, node):
+        reads = self.reads
+        for binding in read_bindings(node):
+            reads[binding] = reads.get(binding, 0) + 1
+        return self.visit(node)
+
+    def forget(self, node):
+        """Drop the reads in `node`, which is removed."""
+        self.removed += 1
+        reads = self.reads
+        for binding in read_bindings(node):
+            reads[binding] -= 1
+
+    @handles('Program')
+    def handle_program(self, node):
+        statements = []
+        for statement in node.statements:
+            statement = yield statement
+            if statement is not None:
+                statements.append(statement)
+        node.statements = statements
+        return node
+
+    @handles('CompoundStatement')
+    def handle_compound_statement(self, node):
+        statements = node.statements
+        reachable = []
+        for index, statement in enumerate(statements):
+            statement = yield statement
+            if statement is None:
+                continue
+            if type(statement).__name__ == 'CompoundStatement':
+                # Such as the branch of a folded belief. Locals already have
+                # their own WAT names, so the block's scope is not needed.
+                reachable.extend(statement.statements)
+            else:
+                reachable.append(statement)
+            if always_jumps(statement):
+                for unreachable in statements[index + 1:]:
+                    self.forget(unreachable)
+                break
+        kept = []
+        for statement in reversed(reachable):
+            if self.is_dead_store(statement):
+                self.forget(statement)
+            else:
+                kept.append(statement)
+        kept.reverse()
+        node.statements = kept
+        return node
+
+    def is_dead_store(self, statement):
+        """Whether `statement` declares or assigns a local that is never read, computing nothing else."""
+        if type(statement).__name__ != 'VariableDeclaration':
+            return False
+        assignment = statement.assignment_expression
+        if getattr(assignment, 'operator', None) != '=':
+            return False
+        binding = assignment.left.binding
+        if binding is None or binding.scope.parent is None:
+            return False  # Globals belong to the module
+        return self.reads.get(binding, 0) == 0 and is_pure(assignment.right)
+
+    @handles('IfStatement', 'SelectionStatement')
+    def handle_if_statement(self, node):
+        condition = node.condition
+        if LITERAL_TYPES.get(type(condition).__name__) != 'boolean':
+            node.true_branch = (yield node.true_branch) or empty_block()
+            if node.false_branch is not None:
+                node.false_branch = yield node.false_branch
+            return node
+        taken, dropped = node.true_branch, node.false_branch
+        if not condition.value:
+            taken, dropped = dropped, taken
+        if dropped is not None:
+            self.forget(dropped)
+        if taken is None:
+            self.removed += 1
+            return None
+        return (yield taken)
+
+    @handles('WhileLoop', 'ForLoop')
+    def handle_loop(self, node):
+        condition = node.condition
+        if LITERAL_TYPES.get(type(condition).__name__) == 'boolean' and not condition.value:
+            self.forget(node)
+            init = getattr(node, 'init', None)
+            if init is None:
+                return None
+            # A chant's init still runs once before its condition is checked. It
+            # stays as a statement of its own, which the enclosing block drops
+            # like any other dead store when it declares a local nothing reads.
+            reads = self.reads
+            for binding in read_bindings(init):
+                reads[binding] += 1
+            return init
+        node.body = (yield node.body) or empty_block()
+        return node
+
+    @handles('DoWhileLoop')
+    def handle_do_while_loop(self, node):
+        node.body = body = (yield node.body) or empty_block()
+        condition = node.condition
+        # Without the loop around it, a retreat or persist in the body would leave an outer loop
+        if (LITERAL_TYPES.get(type(condition).__name__) == 'boolean' and not condition.value
+                and not has_loop_jump(body)):
+            self.removed += 1
+            return body
+        return node
+
+    @handles('FunctionDefinition')
+    def handle_function_definition(self, node):
+        node.body = (yield node.body) or empty_block()
+        return node
+
+    def generic_visit(self, node):
+        return node  # Expressions and the other statements are kept as they are
+
+
+def empty_block():
+    return CompoundStatement([], [])
+
+
+def read_bindings(node):
+    """The binding of every identifier under `node` that is read, rather than assigned with '='."""
+    targets = set()
+    for node in walk(node):
+        name = type(node).__name__
+        if name == 'BinaryExpression' and node.operator == '=':
+            targets.add(id(node.left))
+        elif name == 'Identifier' and node.binding is not None and id(node) not in targets:
+            yield node.binding
+
+
+def always_jumps(statement):
+    """Whether every way through `statement`, already optimized, ends in a deliver, retreat or persist."""
+    while True:
+        name = type(statement).__name__
+        if name == 'JumpStatement':
+            return statement.keyword in JUMP_KEYWORDS
+        if name == 'CompoundStatement':
+            if not statement.statements:
+                return False
+            statement = statement.statements[-1]
+        elif name in ('IfStatement', 'SelectionStatement'):
+            if statement.false_branch is None or not always_jumps(statement.false_branch):
+                return False
+            statement = statement.true_branch
+        else:
+            return False
+
+
+def has_loop_jump(node):
+    """Whether a retreat or persist under `node` jumps out of or back to the loop around it."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        name = type(node).__name__
+        if name == 'JumpStatement' and node.keyword in ('retreat', 'persist'):
+            return True
+        if name not in LOOPS and name != 'FunctionDefinition':
+            stack.extend(children(node))
+    return False
+
+
+def optimize(node, constants=None, stored=None):
+    """Run the optimization passes over analyzed `node`, returning the node that replaces it, or None.
+
+    `constants` maps the bindings of the constant variables declared outside
+    `node` to their literal, and gets those declared in it. `stored` is
+    stored_names() of the whole program, which is `node` when not given.
+    """
+    if stored is None:
+        stored = stored_names(node)
+    node = ConstantFolder(constants, stored).run(node)
+    return DeadCodeEliminator().run(node)
@@ -0,0 +1,223 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import astarena
+import optimizer
+from diagnostics import Diagnostics
+
+# Once the signatures of the 'invoke' functions are collected, the body of
+# each function only depends on them and on the global declarations in front
+# of it, so it can be analyzed, lowered to IR, optimized and generated as WAT
+# on its own. Top-level statements are analyzed here, in order, and lowered
+# into the module's start function, logging every global declaration;
+# functions go to worker processes in contiguous chunks, packed into an
+# ASTArena, which pickles far smaller than the node objects, together with the
+# log up to the last of them. A worker replays the log as it goes, so each
+# global is declared once per chunk rather than once per function. Every
+# result is keyed by the position of its statement and merged in that order,
+# so the module and the diagnostics come out the same whatever the number of
+# workers. String literals are laid out before any function is optimized, so
+# one only preached in a branch the optimizer drops still gets its data
+# segment.
+
+# Chunks per worker: enough to balance functions of uneven size, few enough
+# that pickling the arenas and starting each task stays cheap
+CHUNKS_PER_WORKER = 4
+
+
+def is_function(statement):
+    return type(statement).__name__ == 'FunctionDefinition'
+
+
+def signature_stub(name, signature):
+    """A Function with no body and the signature of function `name`, to check calls to it against."""
+    import ir
+    from lowering import value_type
+    return_type, parameter_types = signature
+    return ir.Function(name, [(str(index), value_type(type_keyword)) for index, type_keyword in enumerate(parameter_types)],
+                       None if return_type == 'void' else value_type(return_type))
+
+
+def lower(lowering, statement, diagnostics):
+    """Lower analyzed `statement`, returning False after reporting what the IR cannot express in it."""
+    import ir
+    try:
+        lowering.visit(statement)
+    except ir.IRError as e:
+        diagnostics.error('unsupported', str(e), e.node)
+        return False
+    return True
+
+
+def check(function, context, diagnostics):
+    """Report the problems ir.verify() finds in `function`, returning whether there were none."""
+    import ir
+    problems = ir.verify(function, context)
+    for problem in problems:
+        diagnostics.error('ir-verify', problem)
+    return not problems
+
+
+def compile_chunk(fn, arena, jobs, history, quiet, stored, strings):
+    """compile_functions() on the functions packed in `arena`; runs in a worker."""
+    return compile_functions(fn, arena.program().statements, jobs, history, quiet, stored, strings)
+
+
+def compile_functions(fn, functions, jobs, history, quiet, stored, strings):
+    """Analyze `functions`, lower them to IR, optimize them unless `stored` is None, and generate their WAT.
+
+    `stored` is optimizer.stored_names() and `strings` lowering.string_layout()
+    of the whole program.
+
+    `history` lists the (name, type, signature, eternal, constant) of the
+    global declarations in source order, where `constant` is the literal of
+    a constant variable, and `jobs` the (position, declared) pair of each
+    function, where the first `declared` of them come before it. Returns one
+    (position, wat, records, result) per function, and the imports and
+    memory flag of the ir.Module the functions were lowered into.
+    """
+    import ir
+    import ir_optimizer
+    import lowering
+    import main
+    from wat_backend import WATBackend
+    analyzer = main.SemanticAnalyzer()
+    lowerer = lowering.Lowering(strings)
+    module = lowerer.module
+    # The module's globals and a stub of every function, for ir.verify()
+    context = ir.Module()
+    context.globals, context.imports = module.globals, module.imports
+    backend = WATBackend()
+    constants = {}
+    replayed = 0
+    results = []
+    for function, (position, declared) in zip(functions, jobs):
+        for name, type, signature, eternal, constant in history[replayed:declared]:
+            if signature is None:
+                binding = analyzer.symbols.declare(name, type)
+                binding.eternal = eternal
+                module.globals[binding.local] = lowering.value_type(type)
+            else:
+                binding = analyzer.declare_signature(name, signature)
+                context.functions.append(signature_stub(name, signature))
+            if constant is not None:
+                constants[binding] = constant
+        replayed = declared
+        analyzer.diagnostics = diagnostics = Diagnostics(fn, quiet=quiet)
+        result = analyzer.analyze(function)
+        wat = ""
+        if not diagnostics.has_errors:
+            if stored is not None:
+                function = optimizer.optimize(function, constants, stored)
+            if lower(lowerer, function, diagnostics):
+                lowered = module.functions.pop()
+                if stored is not None:
+                    ir_optimizer.optimize_function(lowered)
+                if check(lowered, context, diagnostics):
+                    wat = backend.function(lowered)
+        results.append((position, wat, diagnostics.records, result))
+    return results, module.imports, module.memory
+
+
+def compile_program(program, diagnostics, workers=None, optimize=True):
+    """Analyze `program` and generate its WAT module through the IR, one function per task.
+
+    Returns (wat, semantic_output) like SemanticAnalyzer.analyze() and
+    main.generate_from_ir() on the whole program would, with every
+    diagnostic added to `diagnostics` in source order. `wat` is None when
+    analysis failed. Raises diagnostics.TooManyErrors past its error cap.
+    """
+    import ir
+    import ir_optimizer
+    import lowering
+    import main
+    from wat_backend import WATBackend
+    fn, quiet = diagnostics.fn, diagnostics.quiet
+    workers = workers or os.cpu_count() or 1
+    diagnostics.note('analyzing', "Analyzing program", program)
+
+    analyzer = main.SemanticAnalyzer(Diagnostics(fn, quiet=quiet))
+    history = analyzer.symbols.history = []
+    statements = list(program.statements)
+    # Functions are folded apart from the rest, so which variables are stored is found up front
+    stored = optimizer.stored_names(program) if optimize else None
+    strings = lowering.string_layout(program)
+    analyzer.declare_functions(statements)
+    # position -> (wat, diagnostic records, analyzer result); -1 holds the signature errors
+    results = {-1: ("", analyzer.diagnostics.records, 0)}
+    # The top-level statements go into the start function of this module
+    lowerer = lowering.Lowering(strings)
+    module = lowerer.module
+    lowerer.builder = lowering.Builder(module.start)
+    lowered = not analyzer.diagnostics.has_errors
+    context = ir.Module()
+    context.globals, context.imports = module.globals, module.imports
+    context.functions = [signature_stub(binding.name, binding.signature) for binding in history
+                         if binding.signature is not None]
+    constants = {}
+    functions, jobs = [], []
+    for position, statement in enumerate(statements):
+        if is_function(statement):
+            functions.append(statement)
+            jobs.append((position, len(history)))
+            continue
+        analyzer.diagnostics = Diagnostics(fn, quiet=quiet)
+        result = analyzer.analyze(statement)
+        # Once a statement fails, the start function is not generated, so the rest are not lowered
+        lowered = lowered and not analyzer.diagnostics.has_errors
+        if optimize and result != -1:
+            statement = optimizer.optimize(statement, constants, stored)
+        # None when the statement was optimized away
+        if lowered and statement is not None:
+            lowered = lower(lowerer, statement, analyzer.diagnostics)
+        results[position] = ("", analyzer.diagnostics.records, result)
+    if lowered:
+        lowerer.builder.finish()
+        if optimize:
+            ir_optimizer.optimize_function(module.start)
+        lowered = check(module.start, context, diagnostics)
+
+    if functions:
+        # Bindings are not picklable, and signatures are only set once declared
+        history = [(binding.name, binding.type, binding.signature, binding.eternal, constants.get(binding))
+                   for binding in history]
+        chunks = min(len(functions), workers * CHUNKS_PER_WORKER)
+        bounds = [len(functions) * n // chunks for n in range(chunks + 1)]
+        groups, job_chunks, histories = [], [], []
+        for start, end in zip(bounds, bounds[1:]):
+            groups.append(functions[start:end])
+            job_chunks.append(jobs[start:end])
+            histories.append(history[:jobs[end - 1][1]])
+        if workers == 1:
+            # Nothing to send anywhere, so the nodes are used as they are
+            chunk_results = map(compile_functions, [fn] * chunks, groups, job_chunks, histories, [quiet] * chunks,
+                                [stored] * chunks, [strings] * chunks)
+        else:
+            arenas = [astarena.ASTArena.from_statements(piece, fn) for piece in groups]
+            del functions, groups
+            executor = ProcessPoolExecutor(workers)
+            chunk_results = executor.map(compile_chunk, [fn] * chunks, arenas, job_chunks, histories, [quiet] * chunks,
+                                         [stored] * chunks, [strings] * chunks)
+        try:
+            for chunk, imports, memory in chunk_results:
+                for position, wat, records, result in chunk:
+                    results[position] = (wat, records, result)
+                module.imports.update(imports)
+                module.memory = module.memory or memory
+        finally:
+            if workers != 1:
+                executor.shutdown(cancel_futures=True)
+
+    failed = False
+    pieces = []
+    for position in sorted(results):
+        wat, records, result = results[position]
+        diagnostics.merge(records)
+        if result == -1:
+            failed = True
+        if wat:
+            pieces.append(wat)
+    if failed:
+        return None, "Code contains semantic errors"
+    if not lowered:
+        return "", "Code analyzed successfully"  # Why is in the diagnostics
+    return WATBackend().module(module, pieces), "Code analyzed successfully"
@@ -0,0 +1,95 @@
+#######################################
+# SYMBOL TABLE
+#######################################
+
+# Scopes form a chain, innermost last, and each holds the bindings declared
+# in it. `bindings` indexes them the other way round: for every name, the
+# stack of its bindings in the open scopes, innermost last. Looking a name up
+# is then one dict lookup however deeply scopes are nested, and closing a
+# scope pops exactly the names it declared.
+
+
+class Binding:
+    """A declared name: its type, the scope it belongs to and its WAT local."""
+    __slots__ = ('name', 'type', 'scope', 'node', 'local', 'signature', 'eternal')
+
+    def __init__(self, name, type, scope, node=None, local=None):
+        self.name = name
+        self.type = type
+        self.scope = scope
+        self.node = node
+        # Shadowing declarations get their own local, so codegen can use it as is
+        self.local = name if local is None else local
+        # (return type, parameter types) of a function, None for a variable
+        self.signature = None
+        # Declared 'eternal': assigned once, where it is declared
+        self.eternal = False
+
+    def __repr__(self):
+        return f"Binding({self.name!r}, {self.type!r}, scope={self.scope.name!r}, local={self.local!r})"
+
+
+class Scope:
+    __slots__ = ('name', 'parent', 'depth', 'symbols')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.symbols = {}
+
+    def __repr__(self):
+        return f"Scope({self.name!r}, depth={self.depth})"
+
+
+class SymbolTable:
+    def __init__(self):
+        self.scope = Scope('global')
+        self.bindings = {}
+        # Declarations of each name so far, to give each one its own local
+        self.declarations = {}
+        # When a list, every binding declared in the global scope is appended to it
+        self.history = None
+
+    def enter_scope(self, name='block'):
+        self.scope = Scope(name, self.scope)
+        return self.scope
+
+    def exit_scope(self):
+        scope = self.scope
+        if scope.parent is None:
+            return scope
+        bindings = self.bindings
+        for name in scope.symbols:
+            stack = bindings[name]
+            stack.pop()
+            if not stack:
+                del bindings[name]
+        self.scope = scope.parent
+        return scope
+
+    def declare(self, name, type, node=None):
+        """Bind `name` in the innermost scope, replacing an earlier declaration in that same scope."""
+        scope = self.scope
+        count = self.declarations.get(name, 0)
+        self.declarations[name] = count + 1
+        binding = Binding(name, type, scope, node, name if count == 0 else f"{name}.{count}")
+        stack = self.bindings.setdefault(name, [])
+        if name in scope.symbols:
+            # The innermost scope's binding is always on top of the stack
+            stack[-1] = binding
+        else:
+            stack.append(binding)
+        scope.symbols[name] = binding
+        if self.history is not None and scope.parent is None:
+            self.history.append(binding)
+        return binding
+
+    def lookup(self, name):
+        """The binding `name` refers to in the innermost scope, or None."""
+        stack = self.bindings.get(name)
+        return stack[-1] if stack else None
+
+    def lookup_local(self, name):
+        """The binding of `name` in the innermost scope only, or None."""
+        return self.scope.symbols.get(name)
@@ -0,0 +1,95 @@
+#######################################
+# VISITOR
+#######################################
+
+# Base class of the passes over astclasses trees: semantic analysis, the
+# optimization passes and WAT generation. A pass marks its handler methods
+# with @handles and calls self.visit(node); the handler for each node class
+# is looked up once, then found with a single dict lookup however many node
+# kinds there are.
+#
+# A handler may be a generator: it yields a node instead of calling
+# self.visit() on it, and gets the node's result back from the yield. visit()
+# keeps such handlers on its own stack, so nesting depth is not limited by
+# Python's recursion limit.
+
+from types import GeneratorType
+
+
+def handles(*class_names):
+    """Register the decorated method as the handler of the named AST classes.
+
+    Classes are named rather than imported, so a pass can be defined without
+    loading astclasses. A handler also applies to subclasses of its classes.
+    """
+    def register(method):
+        method.handled_classes = getattr(method, 'handled_classes', ()) + class_names
+        return method
+    return register
+
+
+class Visitor:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Handler name of each class name, inherited ones first so subclasses can override them
+        cls.handler_names = {}
+        for klass in reversed(cls.__mro__):
+            for name, method in vars(klass).items():
+                for class_name in getattr(method, 'handled_classes', ()):
+                    cls.handler_names[class_name] = name
+        # Filled in by handler_for() with the function to call for each node class
+        cls.dispatch = {}
+
+    @classmethod
+    def handler_for(cls, node_class):
+        """Find, and cache, the function that handles instances of `node_class`."""
+        for klass in node_class.__mro__:
+            name = cls.handler_names.get(klass.__name__)
+            if name is not None:
+                break
+        else:
+            name = 'generic_visit'
+        handler = cls.dispatch[node_class] = getattr(cls, name)
+        return handler
+
+    def visit(self, node):
+        dispatch = self.dispatch
+        try:
+            handler = dispatch[type(node)]
+        except KeyError:
+            handler = self.handler_for(type(node))
+        result = handler(self, node)
+        if type(result) is not GeneratorType:
+            return result
+
+        # Generator handlers waiting for the result of the node they yielded
+        stack = [result]
+        result = None
+        while stack:
+            try:
+                node = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                continue
+            try:
+                handler = dispatch[type(node)]
+            except KeyError:
+                handler = self.handler_for(type(node))
+            result = handler(self, node)
+            if type(result) is GeneratorType:
+                stack.append(result)
+                result = None
+        return result
+
+    def generic_visit(self, node):
+        """Visit the AST nodes in the fields of a node that has no handler."""
+        for field in getattr(node, '_fields', ()):
+            value = getattr(node, field, None)
+            if isinstance(value, (list, tuple)):
+                for item in value:
+                    if hasattr(item, '_fields'):
+                        yield item
+            elif hasattr(value, '_fields'):
+                yield value
+        return None
@@ -1,28 +1,148 @@
 import astclasses
+from visitor import Visitor, handles
 
-class WATGenerator:
+# WebAssembly instruction of each binary operator on i32 values
+BINARY_INSTRUCTIONS = {
+    '>': 'i32.gt_s',
+    '<': 'i32.lt_s',
+    '>=': 'i32.ge_s',
+    '<=': 'i32.le_s',
+    '==': 'i32.eq',
+    '!=': 'i32.ne',
+    '+': 'i32.add',
+    '-': 'i32.sub',
+    '*': 'i32.mul',
+    '/': 'i32.div_s',
+    '%': 'i32.rem_s',
+    '&&': 'i32.and',
+    '||': 'i32.or',
+}
+
+# Instruction of each binary operator on f32 values; floats have no remainder or logic
+FLOAT_INSTRUCTIONS = {
+    '>': 'f32.gt',
+    '<': 'f32.lt',
+    '>=': 'f32.ge',
+    '<=': 'f32.le',
+    '==': 'f32.eq',
+    '!=': 'f32.ne',
+    '+': 'f32.add',
+    '-': 'f32.sub',
+    '*': 'f32.mul',
+    '/': 'f32.div',
+}
+
+# WebAssembly value type of each HolyScript type; arrays are passed as an i32 address.
+# Literals are typed 'boolean' by the analyzer, declarations 'bool'
+VALUE_TYPES = {'int': 'i32', 'bool': 'i32', 'boolean': 'i32', 'char': 'i32', 'float': 'f32'}
+
+
+class UnsupportedError(Exception):
+    """A construct WATGenerator cannot lower yet; `node` is the AST node, for its position."""
+
+    def __init__(self, message, node=None):
+        super().__init__(message)
+        self.node = node
+
+
+class WATGenerator(Visitor):
     def __init__(self):
         self.module_name = "js"  # Assuming JavaScript module for external functions
 
     def generate_wat(self, ast):
+        return self.module(self.generate_code(ast))
+
+    def module(self, code):
+        """Wrap the generated code of the top-level statements in the module."""
         wat_code = "(module\n"
         # Import log function for preach statements
         wat_code += f'  (import "{self.module_name}" "log" (func $log (param i32)))\n'
-        wat_code += self.generate_code(ast)
+        wat_code += code
         wat_code += ")\n"
         return wat_code
 
     def generate_code(self, node):
-        if isinstance(node, astclasses.Program):
-            return self.handle_program(node)
-        return ""
+        return self.visit(node)
 
+    def generic_visit(self, node):
+        # Leaving the node out would still give a valid-looking module that does the wrong thing
+        raise UnsupportedError(f"{type(node).__name__} cannot be compiled from the tree yet", node)
+
+    @handles('Program')
     def handle_program(self, program_node):
         return "\n".join(self.generate_code(stmt) for stmt in program_node.statements)
 
+    # Functions are lowered one statement at a time; so far only 'deliver' and
+    # the expressions in it produce code, and anything else raises UnsupportedError
+
+    @handles('FunctionDefinition')
+    def handle_function_definition(self, function):
+        header = f'  (func ${function.name} (export "{function.name}")'
+        for type_keyword, name in function.parameters:
+            header += f" (param ${name} {VALUE_TYPES.get(type_keyword, 'i32')})"
+        return_type = function.return_type.type_keyword
+        if return_type != 'void':
+            header += f" (result {VALUE_TYPES.get(return_type, 'i32')})"
+        lines = [header]
+        for statement in getattr(function.body, 'statements', ()):
+            code = yield statement
+            if code:
+                lines.append(f"    {code}")
+        lines.append("  )\n")
+        return "\n".join(lines)
+
+    @handles('JumpStatement')
+    def handle_jump_statement(self, jump):
+        if jump.keyword != 'deliver':
+            raise UnsupportedError(f"'{jump.keyword}' cannot be compiled from the tree yet", jump)
+        if jump.expression is None:
+            return "(return)"
+        return f"(return {(yield jump.expression)})"
+
+    # Expressions carry the type SemanticAnalyzer computed for them in node.type
+
+    @handles('BinaryExpression')
+    def handle_binary_expression(self, expr):
+        left_code = yield expr.left
+        right_code = yield expr.right
+        # A comparison is typed boolean, so the instruction follows its operands' type
+        instructions = FLOAT_INSTRUCTIONS if expr.left.type == 'float' else BINARY_INSTRUCTIONS
+        instruction = instructions.get(expr.operator)
+        if instruction is None:
+            raise UnsupportedError(f"Operator '{expr.operator}' cannot be compiled from the tree yet", expr)
+        return f"({instruction} {left_code} {right_code})"
+
+    @handles('FunctionCall')
+    def handle_function_call(self, call):
+        arguments = []
+        for argument in call.arguments:
+            arguments.append((yield argument))
+        return f"(call ${call.name}{''.join(' ' + code for code in arguments)})"
+
+    @handles('Identifier')
+    def handle_identifier(self, identifier):
+        binding = identifier.binding
+        if binding is not None and binding.scope.parent is None:
+            raise UnsupportedError(f"Global variable '{identifier.value}' cannot be compiled from the tree yet",
+                                   identifier)
+        return f"(local.get ${self.local_name(identifier)})"
+
+    @handles('IntegerLiteral', 'CharLiteral')
+    def handle_integer_literal(self, literal):
+        value = literal.value
+        return f"(i32.const {ord(value) if isinstance(value, str) else value})"
+
+    @handles('FloatLiteral')
+    def handle_float_literal(self, literal):
+        return f"(f32.const {literal.value})"
+
+    @handles('BoolLiteral')
+    def handle_bool_literal(self, literal):
+        return f"(i32.const {int(literal.value)})"
+
     def handle_variable_declaration(self, var_decl):
         # Assuming simplified local variable handling (integers only)
-        var_name = var_decl.assignment_expression.left.value
+        var_name = self.local_name(var_decl.assignment_expression.left)
         var_value = var_decl.assignment_expression.right.value
         return f"(local ${var_name} i32)\n(set_local ${var_name} (i32.const {var_value}))"
 
@@ -34,22 +154,17 @@ class WATGenerator:
 
     def generate_code_for_expression(self, expr):
         if isinstance(expr, astclasses.BinaryExpression):
-            left_code = f"local.get ${expr.left.value}"
+            left_code = f"local.get ${self.local_name(expr.left)}"
             right_code = f"i32.const {expr.right.value}"
-            op_code = {
-                '>': 'i32.gt_s',
-                '<': 'i32.lt_s',
-                '==': 'i32.eq',
-                '!=': 'i32.ne',
-                '+': 'i32.add',
-                '-': 'i32.sub',
-                '*': 'i32.mul',
-                '/': 'i32.div_s',
-                '%': 'i32.rem_s'
-            }[expr.operator]
+            op_code = BINARY_INSTRUCTIONS[expr.operator]
             return f"({op_code} {left_code} {right_code})"
         return ""
 
+    def local_name(self, identifier):
+        # SemanticAnalyzer resolved the identifier; unanalyzed trees fall back to its name
+        binding = identifier.binding
+        return identifier.value if binding is None else binding.local
+
     def handle_preach_statement(self, preach_stmt):
         # Assuming we map messages to integer indexes
         message_index = {
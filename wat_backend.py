@@ -0,0 +1,315 @@
+import ir
+
+# Structured WAT from an ir.Module.
+#
+# WebAssembly has no goto: control flow is nested block, loop and if
+# constructs, and a branch may only leave a construct it is in, to its end
+# for a block or its start for a loop. The CFG is turned into that shape
+# following Ramsey, "Beyond Relooper: Recursive Translation of Unstructured
+# Control Flow to Structured Control Flow", which handles every reducible
+# graph, and so everything lowering.py builds:
+#
+# - code is laid out along the dominator tree, in reverse postorder
+# - a block that is the target of a back edge is a loop header: its code is
+#   wrapped in a `loop`, which a branch back to it continues
+# - a block that two or more forward edges lead to is a merge node: its
+#   dominator puts the code that comes before it in a `block`, which a
+#   branch to it leaves, and the merge node follows the `block`
+# - a branch to any other block, which only its dominator reaches, is
+#   replaced by that block's code
+#
+# Every value gets a WAT local, assigned where it is defined. Phis are
+# resolved on the edges into their block: the branch pushes the incoming
+# values on the operand stack, then pops them into the phis' locals, so
+# phis that read each other swap correctly. A constant, a parameter, or a
+# pure value used once, later in its own block, is written inline as the
+# operand of its user instead.
+#
+# Code is emitted knowing the block that runs when it falls off its end,
+# so a branch there is left out rather than written as a `br`.
+
+#######################################
+# EMITTER
+#######################################
+
+
+def run(generator):
+    """Run `generator`, and the generators it yields in turn, to completion without recursing."""
+    stack = [generator]
+    result = None
+    while stack:
+        try:
+            inner = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            continue
+        stack.append(inner)
+        result = None
+    return result
+
+
+class FunctionEmitter:
+    def __init__(self, function):
+        self.function = function
+        self.lines = []
+        self.depth = 1
+
+        order = ir.reverse_postorder(function)
+        self.rpo = {block: index for index, block in enumerate(order)}
+        idom = ir.dominators(function, order)
+        children = ir.dominator_tree(idom, order)
+        self.loop_headers = set()
+        forward = {}
+        for block in order:
+            for successor in block.succs:
+                if self.rpo[successor] <= self.rpo[block]:
+                    self.loop_headers.add(successor)
+                else:
+                    forward[successor] = forward.get(successor, 0) + 1
+        self.merge_nodes = {block for block, count in forward.items() if count > 1}
+        # The merge nodes each block dominates, in reverse postorder
+        self.merge_children = {block: [child for child in children[block] if child in self.merge_nodes]
+                               for block in order}
+        self.inlined = self.find_inlined()
+
+    def find_inlined(self):
+        """The values written as the operand of their only user rather than kept in a local."""
+        uses = ir.use_counts(self.function)
+        self.uses = uses
+        inlined = {value for value in self.function.values() if value.op in ('const', 'param')}
+        # Inlined values whose whole expression is pure, so it can move past anything
+        movable = set(inlined)
+        for block in self.function.blocks:
+            instructions = block.instructions + [block.terminator]
+            position = {instruction: index for index, instruction in enumerate(instructions)}
+            # Position of the last instruction that cannot move
+            barrier = -1
+            for index, instruction in enumerate(instructions):
+                for arg in instruction.args:
+                    if arg in inlined or uses.get(arg) != 1 or arg not in position:
+                        continue
+                    # Effects and traps keep their order: they only move past movable code
+                    if arg in movable or position[arg] == barrier:
+                        inlined.add(arg)
+                if instruction.op in ir.PURE and all(arg in movable or arg not in inlined for arg in instruction.args):
+                    movable.add(instruction)
+                else:
+                    barrier = index
+            # The phis of a successor are set at the end of the block
+            for successor in block.succs:
+                index = successor.preds.index(block)
+                for phi in successor.phis:
+                    arg = phi.args[index]
+                    if arg.block is block and arg in movable and uses.get(arg) == 1:
+                        inlined.add(arg)
+        return inlined
+
+    #######################################
+    # OUTPUT
+    #######################################
+
+    def emit(self, text):
+        self.lines.append('  ' * self.depth + text)
+
+    def open(self, text):
+        self.emit(text)
+        self.depth += 1
+
+    def close(self):
+        self.depth -= 1
+        self.emit(')')
+
+    def local(self, value):
+        return f"$%{value.id}"
+
+    def expression(self, value, define=False):
+        """The WAT of operand `value`: its local, or its computation when it is inlined or `define`."""
+        # Built bottom up with an explicit stack, so long operator chains do not recurse
+        operands = []
+        stack = [(value, define or value in self.inlined)]
+        while stack:
+            value, expand = stack.pop()
+            if expand is None:
+                count = len(value.args)
+                args = operands[len(operands) - count:]
+                del operands[len(operands) - count:]
+                operands.append(self.operation(value, args))
+            elif expand:
+                stack.append((value, None))
+                stack.extend((arg, arg in self.inlined) for arg in reversed(value.args))
+            else:
+                operands.append(f"(local.get {self.local(value)})")
+        return operands[0]
+
+    def operation(self, value, args):
+        op, attr = value.op, value.attr
+        if op == 'const':
+            return f"({value.type}.const {attr})"
+        if op == 'param':
+            return f"(local.get ${self.function.params[attr][0]})"
+        if op == 'load':
+            return f"({value.type}.load {args[0]})"
+        if op == 'store':
+            return f"({value.args[1].type}.store {args[0]} {args[1]})"
+        if op in ('global.get', 'global.set', 'call'):
+            return f"({op} ${attr}{''.join(' ' + arg for arg in args)})"
+        return f"({op} {' '.join(args)})"
+
+    #######################################
+    # FUNCTION
+    #######################################
+
+    def generate(self):
+        function = self.function
+        header = f"(func ${function.name}"
+        if function.export:
+            header += f' (export "{function.name}")'
+        for name, type in function.params:
+            header += f" (param ${name} {type})"
+        if function.result is not None:
+            header += f" (result {function.result})"
+        self.open(header)
+        for value in function.values():
+            if self.uses.get(value) and value not in self.inlined:
+                self.emit(f"(local {self.local(value)} {value.type})")
+        run(self.do_tree(function.entry, None))
+        if function.result is not None and not self.lines[-1].lstrip().startswith(('(return', '(br', '(unreachable')):
+            # The end of a loop or an if is reachable as far as validation knows
+            self.emit("(unreachable)")
+        self.close()
+        return "\n".join(self.lines)
+
+    def do_tree(self, block, follow):
+        """Emit `block`, the blocks it dominates and the control flow between them.
+
+        `follow` is the block control reaches by falling off the end of the
+        code, or None when that ends the function.
+        """
+        if block in self.loop_headers:
+            self.open(f"(loop $L{block.id}")
+            yield self.node_within(block, self.merge_children[block], follow)
+            self.close()
+        else:
+            yield self.node_within(block, self.merge_children[block], follow)
+
+    def node_within(self, block, merges, follow):
+        if merges:
+            # The last merge node goes outermost, so the earlier ones come before it
+            merge = merges[-1]
+            self.open(f"(block $B{merge.id}")
+            yield self.node_within(block, merges[:-1], merge)
+            self.close()
+            yield self.do_tree(merge, follow)
+            return
+        for instruction in block.instructions:
+            self.instruction(instruction)
+        terminator = block.terminator
+        op = terminator.op
+        if op == 'jump':
+            yield self.do_branch(block, terminator.targets[0], follow)
+        elif op == 'branch':
+            if_true, if_false = terminator.targets
+            start = len(self.lines)
+            self.open(f"(if {self.expression(terminator.args[0])}")
+            self.open("(then")
+            yield self.do_branch(block, if_true, follow)
+            self.close()
+            else_start = len(self.lines)
+            self.open("(else")
+            yield self.do_branch(block, if_false, follow)
+            self.close()
+            if len(self.lines) == else_start + 2:
+                del self.lines[else_start:]  # Nothing to do otherwise
+            self.close()
+            if len(self.lines) == start + 4:
+                # Both ways go on with `follow`; only the condition is left to run
+                del self.lines[start:]
+                self.emit(f"(drop {self.expression(terminator.args[0])})")
+        elif op == 'return':
+            self.emit(f"(return {self.expression(terminator.args[0])})" if terminator.args else "(return)")
+        else:
+            self.emit("(unreachable)")
+
+    def do_branch(self, source, target, follow):
+        self.copy_phis(source, target)
+        if self.rpo[target] <= self.rpo[source]:
+            self.emit(f"(br $L{target.id})")
+        elif target is follow:
+            return  # Falls through
+        elif target in self.merge_nodes:
+            self.emit(f"(br $B{target.id})")
+        else:
+            yield self.do_tree(target, follow)
+
+    def copy_phis(self, source, target):
+        """Set the locals of `target`'s phis to what they get from `source`."""
+        phis = [phi for phi in target.phis if self.uses.get(phi)]
+        if not phis:
+            return
+        index = target.preds.index(source)
+        if len(phis) == 1:
+            self.emit(f"(local.set {self.local(phis[0])} {self.expression(phis[0].args[index])})")
+            return
+        for phi in phis:
+            self.emit(self.expression(phi.args[index]))
+        for phi in reversed(phis):
+            self.emit(f"(local.set {self.local(phi)})")
+
+    def instruction(self, instruction):
+        if instruction in self.inlined:
+            return
+        if instruction.type is None:
+            self.emit(self.expression(instruction, define=True))
+        elif self.uses.get(instruction):
+            self.emit(f"(local.set {self.local(instruction)} {self.expression(instruction, define=True)})")
+        elif instruction.op not in ir.PURE:
+            self.emit(f"(drop {self.expression(instruction, define=True)})")
+
+
+#######################################
+# MODULE
+#######################################
+
+PAGE_SIZE = 65536
+
+
+def data_string(text):
+    """`text` as the UTF-8 bytes of a WAT string, escaping all but printable ASCII."""
+    return ''.join(chr(byte) if 32 <= byte < 127 and byte not in b'"\\' else f'\\{byte:02x}'
+                   for byte in text.encode())
+
+
+class WATBackend:
+    """Generate the WAT module of an ir.Module."""
+
+    def __init__(self):
+        self.module_name = "js"
+
+    def generate(self, module):
+        return self.module(module, [self.function(function) for function in module.functions])
+
+    def module(self, module, functions):
+        """The WAT module of `module`, where `functions` is the WAT of module.functions, generated apart."""
+        lines = ["(module"]
+        # In name order, so the module does not depend on which statement was lowered first
+        for name, types in sorted(module.imports.items()):
+            lines.append(f'  (import "{self.module_name}" "{name}" (func ${name} (param {" ".join(types)})))')
+        end = max((address + len(text.encode()) for text, address in module.strings.items()), default=0)
+        if module.memory or end:
+            # Arrays are passed in as addresses into this memory, and the preached strings follow them
+            lines.append(f'  (memory (export "memory") {end // PAGE_SIZE + 1})')
+        for text, address in module.strings.items():
+            lines.append(f'  (data (i32.const {address}) "{data_string(text)}")')
+        for name, type in module.globals.items():
+            lines.append(f"  (global ${name} (mut {type}) ({type}.const 0))")
+        lines.extend(functions)
+        start = module.start
+        if start.blocks and (start.entry.instructions or len(start.blocks) > 1):
+            lines.append(self.function(start))
+            lines.append(f"  (start ${start.name})")
+        lines.append(")\n")
+        return "\n".join(lines)
+
+    def function(self, function):
+        return FunctionEmitter(function).generate()